@@ -27,7 +27,12 @@ import argparse
 import xgimport
 import xgzarc
 import xgstruct
-import pprint
+import xgdump
+import xgmanifest
+import xgcorpus
+import xgmetrics
+
+COMPACT_EXT = '.xgcf'
 
 def parseoptsegments(parser, segments):
 
@@ -39,6 +44,49 @@ def parseoptsegments(parser, segments):
     return segmentlist
 
 
+def segmentpath(xgfilename, outdir, ext):
+
+    xgbasepath = os.path.dirname(xgfilename)
+    xgbasefile = os.path.basename(xgfilename)
+    xgext = os.path.splitext(xgfilename)
+    if (outdir is not None):
+        xgbasepath = outdir
+    return os.path.abspath(os.path.join(
+            xgbasepath, xgbasefile[:-len(xgext[1])] + ext))
+
+
+def compactext(ext):
+
+    return os.path.splitext(ext)[0] + COMPACT_EXT
+
+
+def segmentfiles(xgfilename, outdir):
+    # The segments extracted from xgfilename that exist, raw or compact,
+    # as (ext, path) pairs
+    for ext in xgimport.Import.Segment.EXTENSIONS:
+        if ext is None:
+            continue
+        for segext in sorted(set([ext, compactext(ext)])):
+            path = segmentpath(xgfilename, outdir, segext)
+            if os.path.exists(path):
+                yield segext, path
+
+
+def writecompact(segment, fileto):
+
+    segment.fd.seek(0, os.SEEK_SET)
+    if segment.type == xgimport.Import.Segment.XG_GAMEFILE:
+        compact = xgstruct.CompactFrameFile(
+            Data=segment.fd.read(), RecSize=xgstruct.MoveEntry.SIZEOFREC)
+    else:
+        compact = xgstruct.CompactFrameFile(
+            Data=segment.fd.read(),
+            RecSize=xgstruct.RolloutContextEntry.SIZEOFREC,
+            KeyOffset=xgstruct.CompactFrameFile.NOKEY)
+    with open(fileto, 'wb') as compactfile:
+        compact.tostream(compactfile)
+
+
 def directoryisvalid(parser, dir):
 
     if not os.path.isdir(dir):
@@ -56,46 +104,138 @@ if __name__ == '__main__':
                         "(Default is same directory as the import file)\n",
                         type=lambda dir:
                         directoryisvalid(parser, dir), default=None)
+    parser.add_argument("-f", "--format", dest="format",
+                        choices=xgdump.RecordWriter.FORMATS,
+                        help="Record output format (Default is pprint)\n",
+                        default='pprint')
+    parser.add_argument("-o", metavar='FILE', dest="outfile",
+                        help="File to write records to "
+                        "(Default is stdout)\n", default=None)
+    parser.add_argument("-z", "--compress", dest="compress",
+                        choices=sorted(xgdump.RecordWriter.COMPRESSORS),
+                        help="Compress the record output\n", default=None)
+    parser.add_argument("-m", "--manifest", metavar='FILE', dest="manifest",
+                        help="Incremental mode: only process files that are "
+                        "new or changed\nsince they were recorded in the "
+                        "manifest FILE\n", default=None)
+    parser.add_argument("-c", "--compact", dest="compact",
+                        action='store_true',
+                        help="Write the game file and rollout segments in "
+                        "the compact\nframe format (%s) instead of raw\n"
+                        % COMPACT_EXT)
+    parser.add_argument("-x", "--expand", dest="expand",
+                        action='store_true',
+                        help="FILE arguments are compact frame files (%s): "
+                        "write the\noriginal segments back and output "
+                        "their records\n" % COMPACT_EXT)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("--stats", dest="stats", action='store_true',
+                        help="Report the time spent in each import stage "
+                        "and decoding\neach record type\n")
+    parser.add_argument("--prometheus", metavar='FILE', dest="prometheus",
+                        help="Write the import stage statistics to FILE in "
+                        "the Prometheus\ntext format\n", default=None)
     parser.add_argument('files', metavar='FILE', type=str, nargs='+',
-                        help='An XG files to import')
+                        help='XG files to import, or directories to search '
+                        'for them\n(for compact frame files with --expand)')
     args = parser.parse_args()
+    if args.expand and (args.compact or args.manifest is not None):
+        parser.error("--expand can't be used with --compact or --manifest")
+
+    # Keep messages out of the record stream unless it is the
+    # traditional pprint output to stdout
+    if args.format == 'pprint' and args.outfile is None and \
+            args.compress is None:
+        msgout = sys.stdout
+    else:
+        msgout = sys.stderr
+
+    recwriter = xgdump.RecordWriter(filename=args.outfile,
+                                    format=args.format,
+                                    compress=args.compress)
+
+    skip = xgcorpus.readskiplist(args.skip) if args.skip else None
+    manifest = None
+    if args.manifest is not None:
+        manifest = xgmanifest.Manifest(args.manifest)
+        changes = manifest.scan(args.files)
+        for xgfilename, error in changes.errors:
+            msgout.write('%s\n' % error)
+
+        # Move the segments extracted from renamed files along with them
+        for oldname, newname in changes.renamed:
+            msgout.write('Renamed file: %s -> %s\n' % (oldname, newname))
+            for ext, oldpath in list(segmentfiles(oldname, args.outdir)):
+                os.rename(oldpath, segmentpath(newname, args.outdir, ext))
+        # and remove those of deleted files so the match is gone
+        for xgfilename in changes.deleted:
+            msgout.write('Deleted file: %s\n' % xgfilename)
+            for ext, path in list(segmentfiles(xgfilename, args.outdir)):
+                os.unlink(path)
+        manifest.apply(changes)
 
-    for xgfilename in args.files:
-        xgbasepath = os.path.dirname(xgfilename)
-        xgbasefile = os.path.basename(xgfilename)
-        xgext = os.path.splitext(xgfilename)
-        if (args.outdir is not None):
-            xgbasepath = args.outdir
+        msgout.write('%d unchanged, %d new, %d changed files\n' %
+                     (len(changes.unchanged), len(changes.new),
+                      len(changes.changed)))
+        xgfilenames = list(xgcorpus.skipfiles(changes.toprocess(), skip))
+    else:
+        xgfilenames = list(xgcorpus.findfiles(
+            args.files, extension=COMPACT_EXT if args.expand else
+            xgcorpus.XG_EXTENSION, skip=skip))
 
+    stats = None
+    if args.stats or args.prometheus is not None:
+        stats = xgmetrics.Stats()
+
+    if args.expand:
+        for compactname in xgfilenames:
+            try:
+                segment = xgimport.readcompactsegment(compactname,
+                                                      stats=stats)
+                msgout.write('Expanding file: %s\n' % compactname)
+                recwriter.writefile(compactname)
+                expandedname = segmentpath(compactname, args.outdir,
+                                           os.path.splitext(segment.ext)[1])
+                with open(expandedname, 'wb') as expandedfile:
+                    expandedfile.write(segment.fd.getvalue())
+                for rec in segment.records():
+                    recwriter.write(rec)
+            except (IOError, xgimport.Error) as e:
+                msgout.write('%s\n' % getattr(e, 'value', e))
+        xgfilenames = []
+
+    for xgfilename in xgfilenames:
         try:
-            xgobj = xgimport.Import(xgfilename)
-            print ('Processing file: %s' % xgfilename)
-            fileversion = -1
-            # To do: move this code to XGImport where it belongs
+            xgobj = xgimport.Import(xgfilename, stats=stats)
+            msgout.write('Processing file: %s\n' % xgfilename)
+            recwriter.writefile(xgfilename)
             for segment in xgobj.getfilesegment():
-                segment.copyto(os.path.abspath(
-                        os.path.join(xgbasepath,
-                        xgbasefile[:-len(xgext[1])] + segment.ext)))
-
-                if segment.type == xgimport.Import.Segment.XG_GAMEFILE:
-                    segment.fd.seek(os.SEEK_SET, 0)
-                    while True:
-                        rec = xgstruct.GameFileRecord(
-                                version=fileversion).fromstream(segment.fd)
-                        if rec is None:
-                            break
-                        if isinstance(rec, xgstruct.HeaderMatchEntry):
-                            fileversion = rec.Version
-                        elif isinstance(rec, xgstruct.UnimplementedEntry):
-                            continue
-                        pprint.pprint (rec,width=160)
-                elif segment.type == xgimport.Import.Segment.XG_ROLLOUTS:
-                    segment.fd.seek(os.SEEK_SET, 0)
-                    while True:
-                        rec = xgstruct.RolloutFileRecord().fromstream(segment.fd)
-                        if rec is None:
-                            break
-                        pprint.pprint (rec,width=160)
+                isframes = segment.type in [
+                    xgimport.Import.Segment.XG_GAMEFILE,
+                    xgimport.Import.Segment.XG_ROLLOUTS]
+                if args.compact and isframes:
+                    writecompact(segment, segmentpath(
+                        xgfilename, args.outdir, compactext(segment.ext)))
+                else:
+                    segment.copyto(segmentpath(xgfilename, args.outdir,
+                                               segment.ext))
+
+                if isframes:
+                    for rec in segment.records():
+                        recwriter.write(rec)
+
+            if manifest is not None:
+                manifest.update(xgfilename, changes.states[xgfilename])
 
         except (xgimport.Error, xgzarc.Error) as e:
-            print (e.value)
+            msgout.write('%s\n' % e.value)
+
+    recwriter.close()
+    if manifest is not None:
+        manifest.save()
+    if args.stats:
+        msgout.write('%s\n' % stats.report())
+    if args.prometheus is not None:
+        stats.writeprometheus(args.prometheus)
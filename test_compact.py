@@ -0,0 +1,138 @@
+#
+#   test_compact.py - Round trip tests of the compact frame format
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   The temp.xg and temp.xgr segments of xggen matches are written as
+#   compact frame files and must expand to the same bytes, also with a
+#   trailing partial frame and with unused candidate slots that don't
+#   hold their fill value. Run with python -m unittest test_compact
+#
+
+import io as _io
+import os as _os
+import shutil as _shutil
+import struct as _struct
+import tempfile as _tempfile
+import unittest as _unittest
+import xggen as _xggen
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+
+_SEGMENT = _xgimport.Import.Segment
+_COMPACT = _xgstruct.CompactFrameFile
+
+
+def _roundtrip(data, **kw):
+    # Write data in the compact format and return it expanded again
+    stream = _io.BytesIO()
+    _COMPACT(Data=data, **kw).tostream(stream)
+    stream.seek(0)
+    return _COMPACT().fromstream(stream).Data
+
+
+def _moveframes(data):
+    # Offsets of the MoveEntry frames in temp.xg data
+    recsize = _xgstruct.MoveEntry.SIZEOFREC
+    return [offset for offset in range(0, len(data) - recsize + 1, recsize)
+            if bytearray(data[offset + 8:offset + 9])[0] ==
+            _xgstruct.GameFileRecord.ENTRYTYPE_MOVE]
+
+
+class CompactFrameFileTest(_unittest.TestCase):
+
+    def setUp(self):
+        self.segments = []
+        for seed in range(4):
+            generator = _xggen.MatchGenerator(
+                seed=seed, games=2, rollouts=True,
+                version=_xggen.MIN_VERSION + seed * 3)
+            self.segments.append(generator.generate())
+
+    def gamefile(self, index=0):
+        return self.segments[index][_SEGMENT.XG_GAMEFILE]
+
+    def rollouts(self, index=0):
+        return self.segments[index][_SEGMENT.XG_ROLLOUTS]
+
+    def test_gamefile(self):
+        for index in range(len(self.segments)):
+            data = self.gamefile(index)
+            self.assertTrue(_moveframes(data))
+            self.assertEqual(_roundtrip(data), data)
+
+    def test_rollouts(self):
+        for index in range(len(self.segments)):
+            data = self.rollouts(index)
+            self.assertTrue(data)
+            self.assertEqual(_roundtrip(
+                data, RecSize=_xgstruct.RolloutContextEntry.SIZEOFREC,
+                KeyOffset=_COMPACT.NOKEY), data)
+
+    def test_partialframe(self):
+        for data in [self.gamefile() + b'\x01\x02\x03',
+                     self.gamefile()[:-1], b'', b'abc']:
+            self.assertEqual(_roundtrip(data), data)
+        data = self.rollouts() + b'\xff' * 100
+        self.assertEqual(_roundtrip(
+            data, RecSize=_xgstruct.RolloutContextEntry.SIZEOFREC,
+            KeyOffset=_COMPACT.NOKEY), data)
+
+    def test_residual(self):
+        data = bytearray(self.gamefile())
+        moves = _moveframes(data)
+        self.assertTrue(len(moves) >= 3)
+        # Garbage in the unused slots of every candidate array
+        nmoves = _struct.unpack_from('<l', data, moves[0] +
+                                     _COMPACT.MOVE_NMOVES)[0]
+        for base, size, fill in _COMPACT.MOVE_SLOTS:
+            offset = moves[0] + base + size * _COMPACT.MAXCANDIDATES - 1
+            if nmoves < _COMPACT.MAXCANDIDATES:
+                data[offset] ^= 0x5a
+        # NMoves out of range: all the slots are kept
+        _struct.pack_into('<l', data, moves[1] + _COMPACT.MOVE_NMOVES, 99)
+        _struct.pack_into('<l', data, moves[2] + _COMPACT.MOVE_NMOVES, -1)
+        data = bytes(data)
+        self.assertEqual(_roundtrip(data), data)
+        self.assertEqual(_roundtrip(data + b'\x07'), data + b'\x07')
+        self.assertEqual(_roundtrip(data, Compressed=False), data)
+
+    def test_readcompactsegment(self):
+        tempdir = _tempfile.mkdtemp(prefix='tmpXGC')
+        try:
+            for segtype, data, kw in [
+                    (_SEGMENT.XG_GAMEFILE, self.gamefile(), {}),
+                    (_SEGMENT.XG_ROLLOUTS, self.rollouts(),
+                     {'RecSize': _xgstruct.RolloutContextEntry.SIZEOFREC,
+                      'KeyOffset': _COMPACT.NOKEY})]:
+                filename = _os.path.join(tempdir, 'segment.xgcf')
+                with open(filename, 'wb') as compactfile:
+                    _COMPACT(Data=data, **kw).tostream(compactfile)
+                segment = _xgimport.readcompactsegment(filename)
+                self.assertEqual(segment.type, segtype)
+                self.assertEqual(segment.fd.read(), data)
+        finally:
+            _shutil.rmtree(tempdir, ignore_errors=True)
+
+    def test_notcompact(self):
+        self.assertEqual(_COMPACT().fromstream(_io.BytesIO(b'XG')), None)
+        self.assertEqual(_COMPACT().fromstream(
+            _io.BytesIO(self.gamefile())), None)
+
+
+if __name__ == '__main__':
+    _unittest.main()
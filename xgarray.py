@@ -0,0 +1,301 @@
+#
+#   xgarray.py - NumPy views of raw XG records
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   The dtypes below mirror the Delphi records read by xgstruct, field
+#   for field and at the same byte offsets, so a block of raw temp.xg
+#   data can be viewed as an array of records without decoding it
+#   record by record. Fields are named as in xgstruct. Version dependent
+#   fields at the end of a record only hold meaningful values when the
+#   file version is recent enough (see xgstruct).
+#
+
+import xgstruct as _xgstruct
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG arrays: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _requirenumpy():
+    if _np is None:
+        raise Error("numpy is required")
+
+
+FRAMESIZE = _xgstruct.MoveEntry.SIZEOFREC
+ENTRYTYPE_OFFSET = 8
+
+if _np is not None:
+    EVALLEVEL_DTYPE = _np.dtype([
+        ('Level', '<i2'), ('isDouble', 'u1'), ('pad', 'i1')])
+
+    BESTMOVE_DTYPE = _np.dtype({
+        'names': ['Pos', 'Dice', 'Level', 'Score', 'Cube', 'CubePos',
+                  'Crawford', 'Jacoby', 'NMoves', 'PosPlayed', 'Moves',
+                  'EvalLevel', 'Eval', 'Unused', 'met', 'Choice0',
+                  'Choice3'],
+        'formats': [('i1', 26), ('<i4', 2), '<i4', ('<i4', 2), '<i4',
+                    '<i4', '<i4', '<i4', '<i4', ('i1', (32, 26)),
+                    ('i1', (32, 8)), (EVALLEVEL_DTYPE, 32), ('<f4', (32, 7)),
+                    'i1', 'i1', 'i1', 'i1'],
+        'offsets': [0, 28, 36, 40, 48, 52, 56, 60, 64, 68, 900, 1156, 1284,
+                    2180, 2181, 2182, 2183],
+        'itemsize': _xgstruct.EngineStructBestMoveRecord.SIZEOFREC})
+
+    MOVEENTRY_DTYPE = _np.dtype({
+        'names': ['EntryType', 'PositionI', 'PositionEnd', 'ActiveP',
+                  'Moves', 'Dice', 'CubeA', 'ErrorM', 'NMoveEval',
+                  'DataMoves', 'Played', 'ErrMove', 'ErrLuck', 'CompChoice',
+                  'InitEq', 'RolloutIndexM', 'AnalyzeM', 'AnalyzeL',
+                  'InvalidM', 'PositionTutor', 'Tutor', 'ErrTutorMove',
+                  'Flagged', 'CommentMove', 'EditedMove', 'TimeDelayMove',
+                  'TimeDelayMoveDone', 'NumberOfAutoDoubleMove'],
+        'formats': ['u1', ('i1', 26), ('i1', 26), '<i4', ('<i4', 8),
+                    ('<i4', 2), '<i4', '<f8', '<i4', BESTMOVE_DTYPE, 'u1',
+                    '<f8', '<f8', '<i4', '<f8', ('<i4', 32), '<i4', '<i4',
+                    '<i4', ('i1', 26), 'i1', '<f8', 'u1', '<i4', 'u1',
+                    '<u4', '<u4', '<i4'],
+        'offsets': [8, 9, 35, 64, 68, 100, 108, 112, 120, 124, 2308, 2312,
+                    2320, 2328, 2336, 2344, 2472, 2476, 2480, 2484, 2510,
+                    2512, 2520, 2524, 2528, 2532, 2536, 2540],
+        'itemsize': FRAMESIZE})
+
+    HEADERGAME_DTYPE = _np.dtype({
+        'names': ['EntryType', 'Score1', 'Score2', 'CrawfordApply',
+                  'PosInit', 'GameNumber', 'InProgress',
+                  'CommentHeaderGame', 'CommentFooterGame',
+                  'NumberOfAutoDoubles'],
+        'formats': ['u1', '<i4', '<i4', 'u1', ('i1', 26), '<i4', 'u1',
+                    '<i4', '<i4', '<i4'],
+        'offsets': [8, 12, 16, 20, 21, 48, 52, 56, 60, 64],
+        'itemsize': FRAMESIZE})
+
+    DOUBLEACTION_DTYPE = _np.dtype({
+        'names': ['Pos', 'Level', 'Score', 'Cube', 'CubePos', 'Jacoby',
+                  'Crawford', 'met', 'FlagDouble', 'isBeaver', 'Eval',
+                  'equB', 'equDouble', 'equDrop', 'LevelRequest',
+                  'DoubleChoice3', 'EvalDouble'],
+        'formats': [('i1', 26), '<i4', ('<i4', 2), '<i4', '<i4', '<i4',
+                    '<i2', '<i2', '<i2', '<i2', ('<f4', 7), '<f4', '<f4',
+                    '<f4', '<i2', '<i2', ('<f4', 7)],
+        'offsets': [0, 28, 32, 40, 44, 48, 52, 54, 56, 58, 60, 88, 92, 96,
+                    100, 102, 104],
+        'itemsize': _xgstruct.EngineStructDoubleAction.SIZEOFREC})
+
+    # DiceRolled is the raw 3 byte Delphi shortstring
+    CUBEENTRY_DTYPE = _np.dtype({
+        'names': ['EntryType', 'ActiveP', 'Double', 'Take', 'BeaverR',
+                  'RaccoonR', 'CubeB', 'Position', 'Doubled', 'ErrCube',
+                  'DiceRolled', 'ErrTake', 'RolloutIndexD', 'CompChoiceD',
+                  'AnalyzeC', 'ErrBeaver', 'ErrRaccoon', 'AnalyzeCR',
+                  'isValid', 'TutorCube', 'TutorTake', 'ErrTutorCube',
+                  'ErrTutorTake', 'FlaggedDouble', 'CommentCube',
+                  'EditedCube', 'TimeDelayCube', 'TimeDelayCubeDone',
+                  'NumberOfAutoDoubleCube', 'TimeBot', 'TimeTop'],
+        'formats': ['u1', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4',
+                    ('i1', 26), DOUBLEACTION_DTYPE, '<f8', ('u1', 3), '<f8',
+                    '<i4', '<i4', '<i4', '<f8', '<f8', '<i4', '<i4', 'i1',
+                    'i1', '<f8', '<f8', 'u1', '<i4', 'u1', 'u1', 'u1', '<i4',
+                    '<i4', '<i4'],
+        'offsets': [8, 12, 16, 20, 24, 28, 32, 36, 64, 200, 208, 216, 224,
+                    228, 232, 240, 248, 256, 260, 264, 265, 272, 280, 288,
+                    292, 296, 297, 298, 300, 304, 308],
+        'itemsize': FRAMESIZE})
+
+    ROLLOUT_DTYPE = _np.dtype({
+        'names': ['Truncated', 'ErrorLimited', 'Truncate', 'MinRoll',
+                  'ErrorLimit', 'MaxRoll', 'Level1', 'Level2', 'LevelCut',
+                  'Variance', 'Cubeless', 'Time', 'Level1C', 'Level2C',
+                  'TimeLimit', 'TruncateBO', 'RandomSeed', 'RandomSeedI',
+                  'RollBoth', 'SearchInterval', 'met', 'FirstRoll',
+                  'DoDouble', 'Extent', 'Rolled', 'DoubleFirst', 'Sum1',
+                  'SumSquare1', 'Sum2', 'SumSquare2', 'Stdev1', 'Stdev2',
+                  'RolledD', 'Error1', 'Error2', 'Result1', 'Result2',
+                  'Mwc1', 'Mwc2', 'PrevLevel', 'PrevEval', 'PrevND', 'PrevD',
+                  'Duration', 'LevelTrunc', 'Rolled2', 'MultipleMin',
+                  'MultipleStopAll', 'MultipleStopOne',
+                  'MultipleStopAllValue', 'MultipleStopOneValue', 'AsTake',
+                  'Rotation', 'UserInterrupted', 'VerMaj', 'VerMin'],
+        'formats': ['u1', 'u1', '<i4', '<i4', '<f8', '<i4', '<i4', '<i4',
+                    '<i4', 'u1', 'u1', 'u1', '<i4', '<i4', '<u4', '<i4',
+                    '<i4', '<i4', 'u1', '<f4', '<i4', 'u1', 'u1', 'u1',
+                    '<i4', 'u1', ('<f8', 37), ('<f8', 37), ('<f8', 37),
+                    ('<f8', 37), ('<f8', 37), ('<f8', 37), ('<i4', 37),
+                    '<f4', '<f4', ('<f4', 7), ('<f4', 7), '<f4', '<f4',
+                    '<i4', ('<f4', 7), '<i4', '<i4', '<i4', '<i4', '<i4',
+                    '<i4', 'u1', 'u1', '<f4', '<f4', 'u1', '<i4', 'u1',
+                    '<u2', '<u2'],
+        'offsets': [0, 1, 4, 8, 16, 24, 28, 32, 36, 40, 41, 42, 44, 48, 52,
+                    56, 60, 64, 68, 72, 76, 80, 81, 82, 84, 88, 96, 392, 688,
+                    984, 1280, 1576, 1872, 2020, 2024, 2028, 2056, 2084,
+                    2088, 2092, 2096, 2124, 2128, 2132, 2136, 2140, 2144,
+                    2148, 2149, 2152, 2156, 2160, 2164, 2168, 2170, 2172],
+        'itemsize': _xgstruct.RolloutContextEntry.SIZEOFREC})
+
+
+class BestMoveArrays(object):
+
+    """ Candidate move analysis of one EngineStructBestMoveRecord as
+    NumPy arrays sliced to the NMoves candidates that were evaluated:
+    PosPlayed (n, 26) int8, Moves (n, 8) int8, Level (n,) int16,
+    isDouble (n,) bool and Eval (n, 7) float32. The arrays are views of
+    the raw block, nothing is copied.
+    """
+
+    def __init__(self, block):
+        _requirenumpy()
+        rec = _np.frombuffer(block, dtype=BESTMOVE_DTYPE, count=1)[0]
+        nmoves = max(0, min(int(rec['NMoves']), 32))
+        self.record = rec
+        self.NMoves = nmoves
+        self.Pos = rec['Pos']
+        self.Dice = rec['Dice']
+        self.PosPlayed = rec['PosPlayed'][:nmoves]
+        self.Moves = rec['Moves'][:nmoves]
+        self.Level = rec['EvalLevel']['Level'][:nmoves]
+        self.isDouble = rec['EvalLevel']['isDouble'][:nmoves].view(bool)
+        self.Eval = rec['Eval'][:nmoves]
+
+    @classmethod
+    def frommoveframe(cls, frame):
+        """Create from the raw 2560 byte frame of a MoveEntry"""
+        start = MOVEENTRY_DTYPE.fields['DataMoves'][1]
+        return cls(memoryview(frame)[
+            start:start + _xgstruct.EngineStructBestMoveRecord.SIZEOFREC])
+
+
+def frames(data):
+    """Return the raw temp.xg data as a (n, 2560) uint8 array"""
+    _requirenumpy()
+    return _np.frombuffer(data, dtype=_np.uint8,
+                          count=(len(data) // FRAMESIZE) * FRAMESIZE
+                          ).reshape(-1, FRAMESIZE)
+
+
+def entries(data, entrytype, dtype):
+    """Return the records of the given entry type in raw temp.xg data
+    as a structured array of dtype.
+    """
+    rawframes = frames(data)
+    mask = rawframes[:, ENTRYTYPE_OFFSET] == entrytype
+    return rawframes[mask].copy().view(dtype).reshape(-1)
+
+
+def field(rawframes, dtype, name):
+    """Return the field name of dtype from each row of a (n, 2560) frame
+    array. Only the bytes of that field are copied.
+    """
+    fielddtype, offset = dtype.fields[name][:2]
+    block = _np.ascontiguousarray(
+        rawframes[:, offset:offset + fielddtype.itemsize])
+    return block.view(fielddtype.base).reshape(
+        (len(rawframes),) + fielddtype.shape)
+
+
+def moveentries(data):
+    """Return every MoveEntry in raw temp.xg data as an array of
+    MOVEENTRY_DTYPE.
+    """
+    _requirenumpy()
+    return entries(data, _xgstruct.GameFileRecord.ENTRYTYPE_MOVE,
+                   MOVEENTRY_DTYPE)
+
+
+def cubeentries(data):
+    """Return every CubeEntry in raw temp.xg data as an array of
+    CUBEENTRY_DTYPE.
+    """
+    _requirenumpy()
+    return entries(data, _xgstruct.GameFileRecord.ENTRYTYPE_CUBE,
+                   CUBEENTRY_DTYPE)
+
+
+def rollouts(data):
+    """Return the rollouts in raw temp.xgr data as an array of
+    ROLLOUT_DTYPE. The array is a read only view of data.
+    """
+    _requirenumpy()
+    return _np.frombuffer(data, dtype=ROLLOUT_DTYPE,
+                          count=len(data) // ROLLOUT_DTYPE.itemsize)
+
+
+def gamenumbers(data):
+    """Return the GameNumber of the game each frame of raw temp.xg data
+    belongs to (0 for frames before the first game header).
+    """
+    rawframes = frames(data)
+    isheader = rawframes[:, ENTRYTYPE_OFFSET] == \
+        _xgstruct.GameFileRecord.ENTRYTYPE_HEADERGAME
+    headers = rawframes.view(HEADERGAME_DTYPE).reshape(-1)['GameNumber']
+    # Forward fill the index of the last game header seen
+    last = _np.where(isheader, _np.arange(len(rawframes)), -1)
+    last = _np.maximum.accumulate(last) if len(last) else last
+    return _np.where(last >= 0, headers[_np.maximum(last, 0)], 0)
+
+
+def candidatemask(moves):
+    """Return an (n, 32) bool array, True for the candidates of each
+    move that were evaluated (index < NMoves).
+    """
+    nmoves = _np.clip(moves['DataMoves']['NMoves'], 0, 32)
+    return _np.arange(32)[_np.newaxis, :] < nmoves[:, _np.newaxis]
+
+
+def playedcandidate(moves):
+    """Return the index of the candidate whose resulting position is the
+    position played (PositionEnd) for each move, -1 if it isn't among
+    the evaluated candidates.
+    """
+    dm = moves['DataMoves']
+    same = (dm['PosPlayed'] ==
+            moves['PositionEnd'][:, _np.newaxis, :]).all(axis=2)
+    same &= candidatemask(moves)
+    played = same.argmax(axis=1)
+    played[~same.any(axis=1)] = -1
+    return played
+
+
+def equitygaps(moves):
+    """Return the best candidate equity, the played candidate equity
+    and their difference for every move in one vectorized step. Moves
+    whose played candidate can't be found are NaN.
+    """
+    equities = moves['DataMoves']['Eval'][:, :, 6].astype(_np.float64)
+    mask = candidatemask(moves)
+    best = _np.where(mask, equities, -_np.inf).max(axis=1, initial=-_np.inf)
+    played = playedcandidate(moves)
+    playedeq = _np.where(played >= 0,
+                         equities[_np.arange(len(moves)),
+                                  _np.maximum(played, 0)], _np.nan)
+    best[~_np.isfinite(best)] = _np.nan
+    return best, playedeq, best - playedeq
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,393 @@
+#
+#   xgbench.py - Micro-benchmarks of the XG decoding stages
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Every stage of reading an XG file is timed on its own: the archive
+#   CRC, inflating a segment, parsing the archive records, each xgstruct
+#   record's fromstream and the xgutils converters. The inputs are fixed:
+#   one match made by xggen from a fixed seed, so numbers taken on the
+#   same machine can be compared from one change to the next.
+#
+#   Each benchmark is run in loops long enough to take mintime seconds,
+#   repeat times, and the fastest loop is kept (the others were slowed
+#   down by something else). Results are operations and bytes per
+#   second. Saved results can be given as a baseline to a later run,
+#   which then reports the change of every benchmark and fails when one
+#   got slower than the threshold allows.
+#
+
+import os as _os
+import io as _io
+import sys as _sys
+import json as _json
+import time as _time
+import timeit as _timeit
+import platform as _platform
+import xgutils as _xgutils
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgimport as _xgimport
+import xggen as _xggen
+
+DEFAULT_MINTIME = 0.1
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.10
+SEED = 0
+
+_SEGMENT = _xgimport.Import.Segment
+_RECORD = _xgstruct.GameFileRecord
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG benchmark: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class Benchmark(object):
+
+    """ One benchmark: func does one operation on nbytes bytes of input.
+    """
+
+    def __init__(self, name, func, nbytes):
+        self.name = name
+        self.func = func
+        self.nbytes = nbytes
+
+    def run(self, mintime=DEFAULT_MINTIME, repeat=DEFAULT_REPEAT):
+        """Return the result dictionary of the benchmark"""
+        func = self.func
+        timer = _timeit.default_timer
+
+        def timeloops(loops):
+            start = timer()
+            for loop in range(loops):
+                func()
+            return timer() - start
+
+        # Double the number of loops until a run takes mintime
+        loops = 1
+        while timeloops(loops) < mintime:
+            loops *= 2
+        best = min(timeloops(loops) for run in range(repeat)) / loops
+        return {'seconds_per_op': best,
+                'ops_per_sec': 1.0 / best if best else float('inf'),
+                'bytes_per_sec': self.nbytes / best if best else float('inf'),
+                'bytes': self.nbytes, 'loops': loops, 'repeat': repeat}
+
+
+def _fromstream(cls, data, version=_xggen.MAX_VERSION):
+    # A benchmark function decoding data with a new cls record
+    stream = _io.BytesIO(data)
+
+    def decode():
+        stream.seek(0)
+        record = cls()
+        record.Version = version
+        record.fromstream(stream)
+    return decode
+
+
+def benchmarks(seed=SEED):
+    """Return the list of Benchmarks, with inputs made from a match
+    generated with seed.
+    """
+    segdata = _xggen.MatchGenerator(seed=seed, games=4, analysis=True,
+                                    rollouts=True).generate()
+    gamefile = segdata[_SEGMENT.XG_GAMEFILE]
+    rollouts = segdata[_SEGMENT.XG_ROLLOUTS]
+
+    # The match as an XG file in memory
+    gdfheader = _xgstruct.GameDataFormatHdrRecord(
+        GameGUID='01234567-89ab-cdef-0123-456789abcdef', GameName='Bench')
+    xgfile = _io.BytesIO()
+    gdfheader.tostream(xgfile)
+    _xgzarc.writearchive(xgfile, [('temp.xgr', rollouts),
+                                  ('temp.xg', gamefile)])
+    xgdata = xgfile.getvalue()
+    archive = _xgzarc.ZlibArchive(_io.BytesIO(xgdata))
+    filerec = [rec for rec in archive.arcregistry
+               if rec.name == 'temp.xg'][0]
+    registrydata = xgdata[-_xgzarc.ArchiveRecord.SIZEOFREC -
+                          archive.arcrec.registrysize:
+                          -_xgzarc.ArchiveRecord.SIZEOFREC]
+    filerecdata = _io.BytesIO()
+    filerec.tostream(filerecdata)
+    filerecdata = filerecdata.getvalue()
+
+    # The first record of every type
+    frames = {}
+    recsize = _xgstruct.HeaderMatchEntry.SIZEOFREC
+    for start in range(0, len(gamefile), recsize):
+        frames.setdefault(bytearray(gamefile[start + 8:start + 9])[0],
+                          gamefile[start:start + recsize])
+    move = _io.BytesIO(frames[_RECORD.ENTRYTYPE_MOVE])
+    move.seek(124)
+    bestmove = move.read(_xgstruct.EngineStructBestMoveRecord.SIZEOFREC)
+    cube = frames[_RECORD.ENTRYTYPE_CUBE]
+    header = _xgstruct.HeaderMatchEntry().fromstream(_io.BytesIO(
+        frames[_RECORD.ENTRYTYPE_HEADERMATCH]))
+    headerdata = header.tobuffer()
+    delphidate = _xgutils.datetimetodelphi(header.Date)
+    player = _xgutils.strtoutf16intarray(header.Player1, 129)
+    splayer = _xgutils.strtodelphishortstr(header.SPlayer1, 41)
+
+    def streamcrc32():
+        _xgutils.streamcrc32(_io.BytesIO(gamefile))
+
+    def extractsegment():
+        archive.stream.seek(filerec.start + archive.startofarcdata)
+        filename = archive._ZlibArchive__extractsegment(
+            iscompressed=filerec.compressed, numbytes=filerec.csize)
+        _os.unlink(filename)
+
+    def readfiledata():
+        _xgzarc.readfiledata(archive.stream, filerec, archive.startofarcdata)
+
+    def zlibarchive():
+        _xgzarc.ZlibArchive(_io.BytesIO(xgdata))
+
+    def readregistry():
+        _xgzarc.readregistry(_io.BytesIO(xgdata))
+
+    def gamefilerecords():
+        stream = _io.BytesIO(gamefile)
+        version = -1
+        while True:
+            record = _RECORD(version=version).fromstream(stream)
+            if record is None:
+                break
+            if isinstance(record, _xgstruct.HeaderMatchEntry):
+                version = record.Version
+
+    result = [
+        Benchmark('xgutils.streamcrc32', streamcrc32, len(gamefile)),
+        Benchmark('xgzarc.extractsegment', extractsegment, len(gamefile)),
+        Benchmark('xgzarc.readfiledata', readfiledata, len(gamefile)),
+        Benchmark('xgzarc.ZlibArchive', zlibarchive, len(xgdata)),
+        Benchmark('xgzarc.readregistry', readregistry, len(registrydata)),
+        Benchmark('xgzarc.ArchiveRecord.fromstream',
+                  _fromstream(_xgzarc.ArchiveRecord,
+                              xgdata[-_xgzarc.ArchiveRecord.SIZEOFREC:]),
+                  _xgzarc.ArchiveRecord.SIZEOFREC),
+        Benchmark('xgzarc.FileRecord.fromstream',
+                  _fromstream(_xgzarc.FileRecord, filerecdata),
+                  _xgzarc.FileRecord.SIZEOFREC),
+        Benchmark('xgstruct.GameDataFormatHdrRecord.fromstream',
+                  _fromstream(_xgstruct.GameDataFormatHdrRecord,
+                              gdfheader.tobuffer()),
+                  _xgstruct.GameDataFormatHdrRecord.SIZEOFREC),
+        Benchmark('xgstruct.HeaderMatchEntry.fromstream',
+                  _fromstream(_xgstruct.HeaderMatchEntry, headerdata),
+                  _xgstruct.HeaderMatchEntry.SIZEOFREC),
+        Benchmark('xgstruct.TimeSettingRecord.fromstream',
+                  _fromstream(_xgstruct.TimeSettingRecord,
+                              header.TimeSetting.tobuffer()),
+                  _xgstruct.TimeSettingRecord.SIZEOFREC),
+        Benchmark('xgstruct.EvalLevelRecord.fromstream',
+                  _fromstream(_xgstruct.EvalLevelRecord,
+                              _xgstruct.EvalLevelRecord(Level=3).tobuffer()),
+                  _xgstruct.EvalLevelRecord.SIZEOFREC),
+        Benchmark('xgstruct.EngineStructBestMoveRecord.fromstream',
+                  _fromstream(_xgstruct.EngineStructBestMoveRecord,
+                              bestmove),
+                  _xgstruct.EngineStructBestMoveRecord.SIZEOFREC),
+        Benchmark('xgstruct.EngineStructDoubleAction.fromstream',
+                  _fromstream(_xgstruct.EngineStructDoubleAction,
+                              cube[64:64 + _xgstruct.EngineStructDoubleAction.
+                                   SIZEOFREC]),
+                  _xgstruct.EngineStructDoubleAction.SIZEOFREC),
+        Benchmark('xgstruct.RolloutContextEntry.fromstream',
+                  _fromstream(_xgstruct.RolloutContextEntry,
+                              rollouts[:_xgstruct.RolloutContextEntry.
+                                       SIZEOFREC]),
+                  _xgstruct.RolloutContextEntry.SIZEOFREC),
+        Benchmark('xgstruct.GameFileRecord.fromstream (temp.xg)',
+                  gamefilerecords, len(gamefile)),
+        Benchmark('xgutils.utf16intarraytostr',
+                  lambda: _xgutils.utf16intarraytostr(player), 258),
+        Benchmark('xgutils.delphishortstrtostr',
+                  lambda: _xgutils.delphishortstrtostr(splayer), 41),
+        Benchmark('xgutils.delphidatetimeconv',
+                  lambda: _xgutils.delphidatetimeconv(delphidate), 8),
+        Benchmark('xgutils.strtoutf16intarray',
+                  lambda: _xgutils.strtoutf16intarray(header.Player1, 129),
+                  258),
+        Benchmark('xgutils.strtodelphishortstr',
+                  lambda: _xgutils.strtodelphishortstr(header.SPlayer1, 41),
+                  41),
+        Benchmark('xgutils.datetimetodelphi',
+                  lambda: _xgutils.datetimetodelphi(header.Date), 8),
+        ]
+
+    # The game file records, each decoded by its own class
+    for entrytype, cls in [
+            (_RECORD.ENTRYTYPE_HEADERGAME, _xgstruct.HeaderGameEntry),
+            (_RECORD.ENTRYTYPE_CUBE, _xgstruct.CubeEntry),
+            (_RECORD.ENTRYTYPE_MOVE, _xgstruct.MoveEntry),
+            (_RECORD.ENTRYTYPE_FOOTERGAME, _xgstruct.FooterGameEntry),
+            (_RECORD.ENTRYTYPE_FOOTERMATCH, _xgstruct.FooterMatchEntry)]:
+        result.append(Benchmark('xgstruct.%s.fromstream' % cls.__name__,
+                                _fromstream(cls, frames[entrytype]),
+                                cls.SIZEOFREC))
+    result.append(Benchmark('xgstruct.MissingEntry.fromstream',
+                            _fromstream(_xgstruct.MissingEntry,
+                                        _xgstruct.MissingEntry().tobuffer()),
+                            _xgstruct.MissingEntry.SIZEOFREC))
+    return result
+
+
+def runbenchmarks(benchmarklist, mintime=DEFAULT_MINTIME,
+                  repeat=DEFAULT_REPEAT, progress=None):
+    """Run the benchmarks and return the results as a dictionary that
+    can be saved with saveresults. progress, if given, is called with
+    every benchmark name and result.
+    """
+    results = {}
+    for benchmark in benchmarklist:
+        results[benchmark.name] = benchmark.run(mintime=mintime,
+                                                repeat=repeat)
+        if progress is not None:
+            progress(benchmark.name, results[benchmark.name])
+    return {'python': _platform.python_version(),
+            'implementation': _platform.python_implementation(),
+            'machine': _platform.machine(),
+            'date': _time.strftime('%Y-%m-%d %H:%M:%S'),
+            'mintime': mintime, 'repeat': repeat, 'seed': SEED,
+            'results': results}
+
+
+def saveresults(filename, results):
+    with open(filename, 'w') as resultfile:
+        _json.dump(results, resultfile, indent=1, sort_keys=True)
+
+
+def loadresults(filename):
+    try:
+        with open(filename) as resultfile:
+            results = _json.load(resultfile)
+    except ValueError as e:
+        raise Error("%s isn't a benchmark result file: %s" % (filename, e))
+    if 'results' not in results:
+        raise Error("%s isn't a benchmark result file" % filename)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare results with baseline (both as returned by runbenchmarks)
+    and return a list of (name, ops_per_sec, baseline ops_per_sec,
+    change, regressed) tuples for the benchmarks found in both. change
+    is the relative change of ops_per_sec, regressed is True if it is
+    below -threshold.
+    """
+    comparison = []
+    for name in sorted(results['results']):
+        if name not in baseline['results']:
+            continue
+        current = results['results'][name]['ops_per_sec']
+        previous = baseline['results'][name]['ops_per_sec']
+        change = current / previous - 1.0 if previous else 0.0
+        comparison.append((name, current, previous, change,
+                           change < -threshold))
+    return comparison
+
+
+def _rate(value):
+    # ops or bytes per second with a unit prefix
+    for unit in ['', 'k', 'M', 'G']:
+        if abs(value) < 1000.0:
+            return '%7.2f%s' % (value, unit or ' ')
+        value /= 1000.0
+    return '%7.2fT' % value
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Time each stage of decoding XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-t", metavar='SECONDS', dest="mintime", type=float,
+                        help="Minimum time of a timed loop "
+                        "(Default %s)\n" % DEFAULT_MINTIME,
+                        default=DEFAULT_MINTIME)
+    parser.add_argument("-r", metavar='REPEAT', dest="repeat", type=int,
+                        help="Timed loops per benchmark, the fastest is "
+                        "kept (Default %d)\n" % DEFAULT_REPEAT,
+                        default=DEFAULT_REPEAT)
+    parser.add_argument("-o", metavar='FILE', dest="output",
+                        help="Save the results as JSON to FILE\n",
+                        default=None)
+    parser.add_argument("-b", metavar='FILE', dest="baseline",
+                        help="Compare with the results saved in FILE\n",
+                        default=None)
+    parser.add_argument("--threshold", metavar='PERCENT', dest="threshold",
+                        type=float, help="Slowdown against the baseline "
+                        "reported as a regression\n(Default %d)\n" %
+                        (DEFAULT_THRESHOLD * 100),
+                        default=DEFAULT_THRESHOLD * 100)
+    parser.add_argument("-l", "--list", dest="list", action='store_true',
+                        help="List the benchmarks and exit\n")
+    parser.add_argument('patterns', metavar='PATTERN', type=str, nargs='*',
+                        help='Only run the benchmarks whose name contains '
+                        'one of the PATTERNs')
+    args = parser.parse_args()
+
+    try:
+        baseline = loadresults(args.baseline) if args.baseline else None
+    except (IOError, OSError, Error) as e:
+        _sys.stderr.write('%s\n' % getattr(e, 'value', e))
+        _sys.exit(2)
+
+    selected = [benchmark for benchmark in benchmarks()
+                if not args.patterns or
+                any(pattern in benchmark.name for pattern in args.patterns)]
+    if args.list:
+        for benchmark in selected:
+            print(benchmark.name)
+        _sys.exit(0)
+
+    print('%-50s %9s %9s' % ('Benchmark', 'ops/s', 'bytes/s'))
+
+    def progress(name, result):
+        print('%-50s %9s %9s' % (name, _rate(result['ops_per_sec']),
+                                 _rate(result['bytes_per_sec'])))
+        _sys.stdout.flush()
+
+    results = runbenchmarks(selected, mintime=args.mintime,
+                            repeat=args.repeat, progress=progress)
+    if args.output is not None:
+        saveresults(args.output, results)
+
+    if baseline is not None:
+        comparison = compare(results, baseline, args.threshold / 100.0)
+        print('\n%-50s %9s %9s %8s' % ('Against baseline', 'ops/s',
+                                       'baseline', 'change'))
+        for name, current, previous, change, regressed in comparison:
+            print('%-50s %9s %9s %+7.1f%%%s' % (
+                name, _rate(current), _rate(previous), change * 100,
+                ' REGRESSION' if regressed else ''))
+        regressions = sum(1 for entry in comparison if entry[4])
+        if regressions:
+            print('%d of %d benchmarks regressed by more than %g%%' %
+                  (regressions, len(comparison), args.threshold))
+            _sys.exit(1)
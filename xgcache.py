@@ -0,0 +1,356 @@
+#
+#   xgcache.py - Persistent cache of inflated XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A cache entry holds the game data format header and the inflated
+#   archive files of one XG file, keyed by the archive CRC from the
+#   ZlibArchive trailer, the file size and PARSER_VERSION. Looking an
+#   entry up only reads the 36 byte trailer of the XG file, so a warm
+#   open is that read plus one read of the cache file: the archive isn't
+#   inflated or CRC checked again. Note the key trusts the CRC stored in
+#   the trailer.
+#
+#   The segments are kept as they were inflated (temp.xg is already a
+#   compact array of fixed size records) and CachedFile decodes records
+#   on demand, so a caller that needs a few records, or reads the raw
+#   data through xgarray, never pays for decoding the rest. Decoded
+#   pickles turned out several times larger than the records and barely
+#   faster to load than xgstruct decoding them.
+#
+#   A cache file is a header (magic, parser version, segment count)
+#   followed by each segment as its type, its length and its data. The
+#   least recently used files are removed once the cache grows beyond
+#   its maximum size.
+#
+
+import io as _io
+import os as _os
+import sys as _sys
+import struct as _struct
+import tempfile as _tempfile
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgcomment as _xgcomment
+
+# Bump whenever the cached data or the way it is decoded changes so
+# stale entries are no longer found
+PARSER_VERSION = 1
+
+CACHE_MAGIC = b'XGRC'
+CACHE_HEADER = '<4sLL'
+CACHE_HEADER_SIZE = _struct.calcsize(CACHE_HEADER)
+SEGMENT_HEADER = '<LQ'
+SEGMENT_HEADER_SIZE = _struct.calcsize(SEGMENT_HEADER)
+CACHE_EXTENSION = '.xgcache'
+
+CACHED_SEGMENTS = [_xgimport.Import.Segment.GDF_HDR,
+                   _xgimport.Import.Segment.XG_GAMEHDR,
+                   _xgimport.Import.Segment.XG_GAMEFILE,
+                   _xgimport.Import.Segment.XG_ROLLOUTS,
+                   _xgimport.Import.Segment.XG_COMMENT]
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG record cache: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def readsegments(filename):
+    """Return a dictionary mapping the segment types in CACHED_SEGMENTS
+    to their data, read and inflated from an XG file.
+    """
+    with open(filename, 'rb') as xgfile:
+        gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(xgfile)
+        if gdfheader is None:
+            raise _xgimport.Error("Not a game data format file", filename)
+        xgfile.seek(0)
+        gdfdata = xgfile.read(gdfheader.HeaderSize)
+
+    segdata = _xgimport.Import(filename).getsegmentdata(CACHED_SEGMENTS)
+    segdata[_xgimport.Import.Segment.GDF_HDR] = gdfdata
+    return segdata
+
+
+class CachedFile(object):
+
+    """ The segments of one XG file (segdata, as returned by
+    Import.getsegmentdata) with on demand decoding of its records.
+    """
+
+    def __init__(self, segdata):
+        self.segdata = segdata
+        self.__version = None
+
+    def gdfheader(self):
+        """Return the GameDataFormatHdrRecord"""
+        return _xgstruct.GameDataFormatHdrRecord().fromstream(_io.BytesIO(
+            self.segdata.get(_xgimport.Import.Segment.GDF_HDR, b'')))
+
+    def __records(self, segtype):
+        segment = _xgimport.Import.Segment(type=segtype, delete=False)
+        segment.fd = _io.BytesIO(self.segdata.get(segtype, b''))
+        return segment.records()
+
+    def records(self):
+        """Generator returning the decoded temp.xg records, see
+        Import.Segment.records.
+        """
+        return self.__records(_xgimport.Import.Segment.XG_GAMEFILE)
+
+    def rollouts(self):
+        """Generator returning the decoded temp.xgr records"""
+        return self.__records(_xgimport.Import.Segment.XG_ROLLOUTS)
+
+    def __len__(self):
+        return len(self.segdata.get(_xgimport.Import.Segment.XG_GAMEFILE,
+                                    b'')) // _xgstruct.MoveEntry.SIZEOFREC
+
+    def record(self, index):
+        """Decode and return the index'th temp.xg record only"""
+        data = self.segdata.get(_xgimport.Import.Segment.XG_GAMEFILE, b'')
+        if self.__version is None:
+            header = _xgstruct.GameFileRecord().fromstream(
+                _io.BytesIO(data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]))
+            self.__version = header.Version \
+                if isinstance(header, _xgstruct.HeaderMatchEntry) else -1
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        start = index * _xgstruct.MoveEntry.SIZEOFREC
+        return _xgstruct.GameFileRecord(version=self.__version).fromstream(
+            _io.BytesIO(data[start:start + _xgstruct.MoveEntry.SIZEOFREC]))
+
+    def comments(self):
+        """Return an xgcomment.CommentFile of the comments"""
+        return _xgcomment.CommentFile(stream=_io.BytesIO(
+            self.segdata.get(_xgimport.Import.Segment.XG_COMMENT, b'')))
+
+
+def cachekey(filename):
+    """Return the (archive CRC, file size, parser version) key of an XG
+    file, reading only the archive trailer.
+    """
+    with open(filename, 'rb') as xgfile:
+        size = _os.fstat(xgfile.fileno()).st_size
+        arcrec = _xgzarc.readarchiverecord(xgfile)
+    return arcrec.crc, size, PARSER_VERSION
+
+
+def _unpacksegments(data):
+    # Parse a cache file, None if it is truncated or not a cache file
+    if len(data) < CACHE_HEADER_SIZE:
+        return None
+    magic, version, count = _struct.unpack_from(CACHE_HEADER, data)
+    if magic != CACHE_MAGIC or version != PARSER_VERSION:
+        return None
+    segdata = {}
+    pos = CACHE_HEADER_SIZE
+    for index in range(count):
+        if pos + SEGMENT_HEADER_SIZE > len(data):
+            return None
+        segtype, length = _struct.unpack_from(SEGMENT_HEADER, data, pos)
+        pos += SEGMENT_HEADER_SIZE
+        if pos + length > len(data):
+            return None
+        segdata[segtype] = data[pos:pos + length]
+        pos += length
+    return segdata if pos == len(data) else None
+
+
+class RecordCache(object):
+
+    """ Directory of cached XG files bounded to maxsize bytes. The
+    modification time of a cache file is its last use and the oldest
+    files are evicted first.
+    """
+
+    DEFAULT_MAXSIZE = 1 << 30
+
+    def __init__(self, directory, maxsize=DEFAULT_MAXSIZE):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Size of the cache at the last scan and bytes put since then
+        self.__scanned = None
+        self.__added = 0
+        if not _os.path.isdir(directory):
+            _os.makedirs(directory)
+
+    def __path(self, key):
+        return _os.path.join(self.directory,
+                             '%08x-%d-%d%s' % (key + (CACHE_EXTENSION,)))
+
+    def get(self, filename):
+        """Return the cached CachedFile of an XG file or None"""
+        path = self.__path(cachekey(filename))
+        try:
+            with open(path, 'rb') as cachefile:
+                data = cachefile.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        segdata = _unpacksegments(data)
+        if segdata is None:
+            # Truncated or foreign file: drop it
+            self.__unlink(path)
+            self.misses += 1
+            return None
+
+        try:
+            _os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return CachedFile(segdata)
+
+    def put(self, filename, segdata):
+        """Store the segments of an XG file and evict old entries if the
+        cache has grown beyond its maximum size.
+        """
+        fd, tmpname = _tempfile.mkstemp(prefix='tmpXGC',
+                                        dir=self.directory)
+        try:
+            with _os.fdopen(fd, 'wb') as cachefile:
+                cachefile.write(_struct.pack(CACHE_HEADER, CACHE_MAGIC,
+                                             PARSER_VERSION, len(segdata)))
+                for segtype in sorted(segdata):
+                    cachefile.write(_struct.pack(SEGMENT_HEADER, segtype,
+                                                 len(segdata[segtype])))
+                    cachefile.write(segdata[segtype])
+                size = cachefile.tell()
+            _xgutils.replacefile(tmpname, self.__path(cachekey(filename)))
+        except:
+            self.__unlink(tmpname)
+            raise
+
+        # Scanning the directory costs a stat per entry, so only rescan
+        # once the cache may have outgrown maxsize. Other processes
+        # sharing the directory aren't counted: rescanning every
+        # sixteenth of maxsize put bounds what they can add unnoticed.
+        self.__added += size
+        if self.__scanned is None or \
+                self.__scanned + self.__added > self.maxsize or \
+                self.__added > self.maxsize // 16:
+            self.evict()
+
+    def load(self, filename):
+        """Return the CachedFile of an XG file, reading and storing it
+        first if it isn't cached.
+        """
+        cached = self.get(filename)
+        if cached is None:
+            segdata = readsegments(filename)
+            self.put(filename, segdata)
+            cached = CachedFile(segdata)
+        return cached
+
+    def getsegmentdata(self, filename, segtypes):
+        """Cached equivalent of Import.getsegmentdata"""
+        segdata = self.load(filename).segdata
+        return dict((segtype, data) for segtype, data in segdata.items()
+                    if segtype in segtypes)
+
+    def __entries(self):
+        # (mtime, size, path) of every cache file
+        entries = []
+        for name in _os.listdir(self.directory):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = _os.path.join(self.directory, name)
+            try:
+                st = _os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        """Return the total size of the cache files in bytes"""
+        return sum(size for mtime, size, path in self.__entries())
+
+    def evict(self, maxsize=None):
+        """Remove the least recently used entries until the cache holds
+        at most maxsize (default the cache's maximum size) bytes.
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+        entries = sorted(self.__entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= maxsize:
+                break
+            self.__unlink(path)
+            total -= size
+        self.__scanned = total
+        self.__added = 0
+
+    def clear(self):
+        """Remove every entry"""
+        self.evict(0)
+
+    @staticmethod
+    def __unlink(path):
+        try:
+            _os.unlink(path)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Fill or manage a cache of XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-s", metavar='MB', dest="maxsize", type=int,
+                        help="Maximum cache size in MB (Default is %d)\n"
+                        % (RecordCache.DEFAULT_MAXSIZE >> 20),
+                        default=RecordCache.DEFAULT_MAXSIZE >> 20)
+    parser.add_argument("--clear", dest="clear", action='store_true',
+                        help="Remove every entry first\n")
+    parser.add_argument('directory', metavar='DIR', type=str,
+                        help='Cache directory')
+    parser.add_argument('files', metavar='FILE', type=str, nargs='*',
+                        help='XG files to load through the cache')
+    args = parser.parse_args()
+
+    cache = RecordCache(args.directory, maxsize=args.maxsize << 20)
+    if args.clear:
+        cache.clear()
+
+    for filename in args.files:
+        start = time.time()
+        try:
+            cached = cache.load(filename)
+        except (_xgimport.Error, _xgzarc.Error) as e:
+            _sys.stderr.write('%s\n' % e.value)
+            continue
+        print('%s: %d records in %.3fs' % (filename, len(cached),
+                                           time.time() - start))
+
+    print('%d hits, %d misses, cache size %d bytes' %
+          (cache.hits, cache.misses, cache.size()))
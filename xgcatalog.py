@@ -0,0 +1,344 @@
+#
+#   xgcatalog.py - SQLite catalog of the matches in a collection of XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A catalog entry is read from the game data format header and
+#   temp.xgi only: the archive index is read (without checking the CRC
+#   of the whole archive) and temp.xgi, a few hundred bytes, is the only
+#   file inflated. temp.xgi holds the start of the HeaderMatchEntry, so
+#   names are the ANSI ones (SPlayer1, SEvent, ...).
+#
+#   The game count, the final score and the unicode names need temp.xg
+#   itself: with games=True (-g) it is inflated too, the frames are
+#   counted by entry type without decoding them and only the match
+#   header and the last match footer are decoded.
+#
+#   Files are (re)read when their size or modification time changed
+#   since they were cataloged. player1, player2 (case insensitive) and
+#   date are indexed; dates are stored as 'YYYY-MM-DD HH:MM:SS' text so
+#   ranges compare as strings.
+#
+
+import io as _io
+import os as _os
+import sys as _sys
+import sqlite3 as _sqlite3
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgcorpus as _xgcorpus
+
+GAMEHDR_NAME = 'temp.xgi'
+GAMEFILE_NAME = 'temp.xg'
+
+# Catalog columns after path, mtime and size
+COLUMNS = [('guid', 'TEXT'), ('gamename', 'TEXT'), ('savename', 'TEXT'),
+           ('player1', 'TEXT COLLATE NOCASE'),
+           ('player2', 'TEXT COLLATE NOCASE'),
+           ('event', 'TEXT'), ('location', 'TEXT'), ('round', 'TEXT'),
+           ('date', 'TEXT'), ('matchlength', 'INTEGER'),
+           ('variation', 'INTEGER'), ('elo1', 'REAL'), ('elo2', 'REAL'),
+           ('exp1', 'INTEGER'), ('exp2', 'INTEGER'), ('version', 'INTEGER'),
+           ('games', 'INTEGER'), ('score1', 'INTEGER'),
+           ('score2', 'INTEGER'), ('winner', 'INTEGER')]
+COLUMN_NAMES = [name for name, decl in COLUMNS]
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG catalog: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _fullheader(gamefile, filename):
+    # Decode the match header of temp.xg with its version
+    header = _xgimport.decodematchheader(gamefile)
+    if header is None:
+        raise _xgimport.Error("Not a valid XG gamefile", filename)
+    return _xgstruct.HeaderMatchEntry(
+        version=header.Version).fromstream(_io.BytesIO(gamefile))
+
+
+def _entry(gdfheader, header):
+    return {'guid': gdfheader.GameGUID,
+            'gamename': _xgutils.utf8bytestostr(gdfheader.GameName),
+            'savename': _xgutils.utf8bytestostr(gdfheader.SaveName),
+            'player1': _xgutils.utf8bytestostr(header.Player1 or
+                                              header.SPlayer1),
+            'player2': _xgutils.utf8bytestostr(header.Player2 or
+                                              header.SPlayer2),
+            'event': _xgutils.utf8bytestostr(header.Event or header.SEvent),
+            'location': _xgutils.utf8bytestostr(header.Location or
+                                               header.SLocation),
+            'round': _xgutils.utf8bytestostr(header.Round or header.SRound),
+            'date': header.Date, 'matchlength': header.MatchLength,
+            'variation': header.Variation, 'elo1': header.Elo1,
+            'elo2': header.Elo2, 'exp1': header.Exp1, 'exp2': header.Exp2,
+            'version': header.Version, 'games': None, 'score1': None,
+            'score2': None, 'winner': None}
+
+
+def _addgames(entry, gamefile):
+    # Count the game headers and decode the last match footer only
+    recsize = _xgstruct.MoveEntry.SIZEOFREC
+    entrytypes = bytearray(gamefile[8::recsize])
+    entry['games'] = entrytypes.count(
+        _xgstruct.GameFileRecord.ENTRYTYPE_HEADERGAME)
+    for index in range(len(entrytypes) - 1, -1, -1):
+        if entrytypes[index] == _xgstruct.GameFileRecord.ENTRYTYPE_FOOTERMATCH:
+            footer = _xgstruct.FooterMatchEntry().fromstream(_io.BytesIO(
+                gamefile[index * recsize:(index + 1) * recsize]))
+            entry['score1'] = footer.Score1m
+            entry['score2'] = footer.Score2m
+            entry['winner'] = footer.WinnerM
+            break
+    return entry
+
+
+def catalogentry(filename, games=False):
+    """Return the catalog columns (COLUMN_NAMES) of an XG file as a
+    dictionary. games, score1, score2 and winner are None unless games
+    is set.
+    """
+    with open(filename, 'rb') as xgfile:
+        gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(xgfile)
+        if gdfheader is None:
+            raise _xgimport.Error("Not a game data format file", filename)
+        arcrec, filerecs, startofarcdata = _xgzarc.readregistry(xgfile)
+        byname = dict((filerec.name, filerec) for filerec in filerecs)
+
+        header = None
+        gamefile = None
+        if GAMEHDR_NAME in byname and not games:
+            header = _xgimport.decodematchheader(_xgzarc.readfiledata(
+                xgfile, byname[GAMEHDR_NAME], startofarcdata))
+        if header is None:
+            if GAMEFILE_NAME not in byname:
+                raise _xgimport.Error("No game file in archive", filename)
+            gamefile = _xgzarc.readfiledata(xgfile, byname[GAMEFILE_NAME],
+                                            startofarcdata)
+            header = _fullheader(gamefile, filename)
+
+    entry = _entry(gdfheader, header)
+    if games:
+        _addgames(entry, gamefile)
+    return entry
+
+
+def segmententry(segdata, filename=None):
+    """Return the catalog columns, game count and final score included,
+    of an XG file already read into segments (a dictionary holding at
+    least GDF_HDR and XG_GAMEFILE, see xgcache.readsegments).
+    """
+    gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(_io.BytesIO(
+        segdata[_xgimport.Import.Segment.GDF_HDR]))
+    if gdfheader is None:
+        raise _xgimport.Error("Not a game data format file", filename)
+    gamefile = segdata[_xgimport.Import.Segment.XG_GAMEFILE]
+    return _addgames(_entry(gdfheader, _fullheader(gamefile, filename)),
+                     gamefile)
+
+
+class _CatalogWorker(object):
+
+    # catalogentry with the games option bound, picklable for mapfiles
+
+    def __init__(self, games):
+        self.games = games
+
+    def __call__(self, filename):
+        return catalogentry(filename, self.games)
+
+
+class Catalog(object):
+
+    """ SQLite catalog with one row per XG file. Files are cataloged
+    incrementally: a file is only (re)read when its size or modification
+    time has changed since it was last cataloged.
+    """
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.conn = _sqlite3.connect(dbname, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS matches ('
+                          'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                          '%s)' % ', '.join('%s %s' % column
+                                            for column in COLUMNS))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_player1 '
+                          'ON matches (player1, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_player2 '
+                          'ON matches (player2, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_date '
+                          'ON matches (date)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def stale(self, filenames, games=False):
+        """Generator returning the files in filenames that aren't
+        cataloged or have changed since they were cataloged. With games,
+        files cataloged without their game count are stale too.
+        """
+        for filename in filenames:
+            path = _os.path.abspath(filename)
+            st = _os.stat(path)
+            row = self.conn.execute('SELECT mtime, size, games FROM matches '
+                                    'WHERE path = ?', (path,)).fetchone()
+            if row is None or row[0] != st.st_mtime or \
+                    row[1] != st.st_size or games and row[2] is None:
+                yield filename
+
+    def update(self, entries):
+        """Add or replace the rows of a list of (filename, entry) pairs,
+        entry as returned by catalogentry, in one transaction.
+        """
+        rows = []
+        for filename, entry in entries:
+            path = _os.path.abspath(filename)
+            st = _os.stat(path)
+            rows.append([path, st.st_mtime, st.st_size] +
+                        [entry[name] for name in COLUMN_NAMES])
+        self.conn.execute('BEGIN')
+        try:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO matches VALUES (%s)' %
+                ', '.join(['?'] * (len(COLUMNS) + 3)), rows)
+            self.conn.execute('COMMIT')
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def prune(self):
+        """Remove the rows of cataloged files that no longer exist"""
+        paths = [row[0] for row in
+                 self.conn.execute('SELECT path FROM matches')]
+        missing = [(path,) for path in paths if not _os.path.exists(path)]
+        self.conn.executemany('DELETE FROM matches WHERE path = ?', missing)
+        return len(missing)
+
+    def find(self, player=None, since=None, until=None):
+        """Return the rows (as dictionaries) of the matches player (case
+        insensitive) played on or after the date since and before the
+        date until, dates being 'YYYY[-MM[-DD]]' strings. Every argument
+        is optional.
+        """
+        where = []
+        params = []
+        if since is not None:
+            where.append('date >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('date < ?')
+            params.append(until)
+        query = 'SELECT * FROM matches'
+        if player is not None:
+            # One indexed lookup per player column
+            conditions = ' AND '.join(where)
+            query = ' UNION '.join(
+                'SELECT * FROM matches WHERE %s = ?%s' %
+                (column, ' AND ' + conditions if conditions else '')
+                for column in ('player1', 'player2'))
+            params = [player] + params + [player] + params
+        elif where:
+            query += ' WHERE ' + ' AND '.join(where)
+        cursor = self.conn.execute(query + ' ORDER BY date, path', params)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Build or search a catalog of the matches in XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("-g", "--games", dest="games", action='store_true',
+                        help="build: also read the game files for the game "
+                        "count and\nfinal score\n")
+    parser.add_argument("--prune", dest="prune", action='store_true',
+                        help="build: drop the rows of files that no longer "
+                        "exist\n")
+    parser.add_argument("-p", "--player", metavar='NAME', dest="player",
+                        help="find: matches of player NAME\n", default=None)
+    parser.add_argument("--since", metavar='DATE', dest="since",
+                        help="find: matches played on or after DATE "
+                        "(YYYY[-MM[-DD]])\n", default=None)
+    parser.add_argument("--until", metavar='DATE', dest="until",
+                        help="find: matches played before DATE\n",
+                        default=None)
+    parser.add_argument("-y", "--year", metavar='YEAR', dest="year", type=int,
+                        help="find: matches played in YEAR\n", default=None)
+    parser.add_argument('database', metavar='DB', type=str,
+                        help='SQLite catalog database')
+    parser.add_argument('command', choices=['build', 'find'],
+                        help='build: catalog the XG files in PATH\n'
+                        'find: list the cataloged matches\n')
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='*',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    with Catalog(args.database) as catalog:
+        if args.command == 'build':
+            if args.prune:
+                print('Pruned %d files' % catalog.prune())
+            filenames = list(catalog.stale(
+                _xgcorpus.findfiles(args.paths, skip=skip), args.games))
+            entries = []
+            for filename, entry, error in _xgcorpus.mapfiles(
+                    _CatalogWorker(args.games), filenames,
+                    workers=args.workers, chunksize=16):
+                if error is not None:
+                    _sys.stderr.write('%s\n' % error)
+                    continue
+                entries.append((filename, entry))
+                if len(entries) >= 1000:
+                    catalog.update(entries)
+                    entries = []
+            catalog.update(entries)
+            print('Cataloged %d files' % len(filenames))
+        else:
+            since, until = args.since, args.until
+            if args.year is not None:
+                since, until = '%04d' % args.year, '%04d' % (args.year + 1)
+            for row in catalog.find(args.player, since, until):
+                print('%s\t%s vs %s\t%s\t%s\t%s' % (
+                    row['date'], row['player1'], row['player2'],
+                    'unlimited' if row['matchlength'] == 99999
+                    else '%d points' % row['matchlength'],
+                    row['event'], row['path']))
@@ -0,0 +1,355 @@
+#
+#   xgclock.py - Clock and time usage analytics of timed XG matches
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Timed matches (file version 25 and later) carry the clock settings in
+#   HeaderMatchEntry.TimeSetting, and from version 28 every CubeEntry
+#   records the time left on both clocks (TimeBot for player 1, TimeTop
+#   for player 2) when the turn started. Between a CubeEntry and the
+#   next one of the same game each player's clock drops by the time
+#   that player used: the player of the CubeEntry for that turn, and
+#   the opponent for the turns in between that have no CubeEntry (no
+#   access to the cube, Crawford game, dead cube), which are found from
+#   their MoveEntry records. The time used is the drop plus the Fischer
+#   increment or, once the clock ran, the Bronstein delay of each checker
+#   play. A Bronstein clock that didn't drop only tells that the turn
+#   took at most the delay: such turns are flagged withindelay. The
+#   turns after the last CubeEntry of each game aren't measured, nor are
+#   takes (they fall in the taker's following turn when it has no
+#   CubeEntry).
+#
+#   The error of a turn is the sum of the analyzed cube and checker play
+#   errors its player made in that turn. Turns are returned as compact
+#   arrays (see TURN_ARRAYS), and TimeCurve bins them by time used, with
+#   the turns within the Bronstein delay in a bin of their own, into
+#   sums that can be merged across files and workers.
+#
+
+import io as _io
+import sys as _sys
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgarray as _xgarray
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+CLOCK_NONE = _xgstruct.TimeSettingRecord.CLOCK_NONE
+CLOCK_FISCHER = _xgstruct.TimeSettingRecord.CLOCK_FISCHER
+CLOCK_BRONSTEIN = _xgstruct.TimeSettingRecord.CLOCK_BRONSTEIN
+CLOCK_VERSION = 28
+NOT_ANALYZED = -1000
+
+TURN_ARRAYS = [('game', '<i4'), ('player', 'i1'), ('frame', '<i4'),
+               ('timeleft', '<f4'), ('timeused', '<f4'), ('error', '<f4'),
+               ('decisions', 'i1'), ('withindelay', 'i1')]
+
+# Upper edges (in seconds) of the time used bins of a TimeCurve; the
+# last bin is open ended and followed by the bin of the turns within
+# the Bronstein delay
+DEFAULT_BINS = [1, 2, 3, 5, 8, 12, 20, 30, 45, 60, 90, 120, 180, 300]
+
+CURVE_STATS = ['turns', 'decisions', 'error', 'errorsquare', 'timeused']
+CURVE_TURNS, CURVE_DECISIONS, CURVE_ERROR, CURVE_ERRORSQUARE, \
+    CURVE_TIMEUSED = range(len(CURVE_STATS))
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG clock: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _emptyturns():
+    return dict((name, _np.zeros(0, dtype=dtype))
+                for name, dtype in TURN_ARRAYS)
+
+
+class FileClock(object):
+
+    """ Clock settings and measured turns of one XG file. turns is a
+    dictionary of equally long arrays named as in TURN_ARRAYS.
+    """
+
+    def __init__(self, filename, players, timesetting, turns):
+        self.filename = filename
+        self.players = players
+        self.timesetting = timesetting
+        self.turns = turns
+
+    def games(self):
+        """Generator returning (game, turns) for each game, where turns
+        holds the slices of the arrays belonging to that game.
+        """
+        game = self.turns['game']
+        bounds = _np.r_[0, _np.nonzero(_np.diff(game))[0] + 1, len(game)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start < end:
+                yield int(game[start]), dict(
+                    (name, values[start:end])
+                    for name, values in self.turns.items())
+
+
+def fileclock(filename):
+    """Return the FileClock of an XG file. Files without a clock or
+    older than version 28 have no turns.
+    """
+    if _np is None:
+        raise Error("numpy is required")
+    data = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE]).get(
+        _xgimport.Import.Segment.XG_GAMEFILE, b'')
+
+    header = _xgstruct.GameFileRecord().fromstream(_io.BytesIO(
+        data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]))
+    if not isinstance(header, _xgstruct.HeaderMatchEntry):
+        raise _xgimport.Error("No match header", filename)
+    players = (_xgutils.utf8bytestostr(header.Player1 or header.SPlayer1),
+               _xgutils.utf8bytestostr(header.Player2 or header.SPlayer2))
+    timesetting = header.TimeSetting
+    if timesetting is None or timesetting.ClockType == CLOCK_NONE or \
+            header.Version < CLOCK_VERSION:
+        return FileClock(filename, players, timesetting, _emptyturns())
+
+    rawframes = _xgarray.frames(data)
+    entrytypes = rawframes[:, _xgarray.ENTRYTYPE_OFFSET]
+    games = _xgarray.gamenumbers(data)
+
+    cubeframes = _np.nonzero(
+        entrytypes == _xgstruct.GameFileRecord.ENTRYTYPE_CUBE)[0]
+    cubes = rawframes[cubeframes]
+    active = (_xgarray.field(cubes, _xgarray.CUBEENTRY_DTYPE, 'ActiveP')
+              != 1).astype(_np.intp)
+    clocks = _np.column_stack([
+        _xgarray.field(cubes, _xgarray.CUBEENTRY_DTYPE, 'TimeBot'),
+        _xgarray.field(cubes, _xgarray.CUBEENTRY_DTYPE, 'TimeTop')]
+        ).astype(_np.float64)
+    rows = _np.arange(len(cubes))
+
+    # Readings followed by one in the same game, and the drop of both
+    # clocks up to it
+    measured = _np.zeros(len(cubes), dtype=bool)
+    measured[:-1] = games[cubeframes[:-1]] == games[cubeframes[1:]]
+    drops = _np.zeros((len(cubes), 2))
+    drops[:-1] = clocks[:-1] - clocks[1:]
+
+    # The checker plays between measured readings, by whether they were
+    # made by the player of the reading or by the opponent
+    moveframes = _np.nonzero(
+        entrytypes == _xgstruct.GameFileRecord.ENTRYTYPE_MOVE)[0]
+    moves = rawframes[moveframes]
+    reading = _np.searchsorted(cubeframes, moveframes, side='right') - 1
+    errmove = _xgarray.field(moves, _xgarray.MOVEENTRY_DTYPE, 'ErrMove')
+    mover = (_xgarray.field(moves, _xgarray.MOVEENTRY_DTYPE, 'ActiveP')
+             != 1).astype(_np.intp)
+    inside = reading >= 0
+    inside[inside] = measured[reading[inside]]
+    own = inside.copy()
+    own[inside] = active[reading[inside]] == mover[inside]
+    other = inside & ~own
+
+    def turnsof(player, selected, error, decisions):
+        # The per reading arrays of the turns of player (one per
+        # reading) made of the checker plays selected
+        analyzed = selected & (errmove > NOT_ANALYZED + 1)
+        plays = _np.bincount(reading[selected], minlength=len(cubes))
+        drop = drops[rows, player]
+        timeused, withindelay = _timeused(timesetting, drop, plays)
+        return {'game': games[cubeframes], 'player': player,
+                'timeleft': clocks[rows, player], 'timeused': timeused,
+                'withindelay': withindelay, 'plays': plays,
+                'error': error + _np.bincount(
+                    reading[analyzed], weights=_np.abs(errmove[analyzed]),
+                    minlength=len(cubes)),
+                'decisions': decisions + _np.bincount(
+                    reading[analyzed], minlength=len(cubes))}
+
+    # The turns of the CubeEntry player: the cube decision and the checker
+    # plays up to the next reading
+    errcube = _xgarray.field(cubes, _xgarray.CUBEENTRY_DTYPE, 'ErrCube')
+    analyzed = errcube > NOT_ANALYZED + 1
+    cubeturns = turnsof(active, own,
+                        _np.where(analyzed, _np.abs(errcube), 0.0),
+                        analyzed.astype(_np.int64))
+    cubeturns['frame'] = cubeframes
+
+    # The turns of the opponent without a CubeEntry, starting at their
+    # first checker play
+    moveturns = turnsof(1 - active, other, 0.0, 0)
+    moveturns['frame'] = _np.zeros(len(cubes), dtype=_np.int64)
+    otherplays = _np.nonzero(other)[0]
+    readings, first = _np.unique(reading[otherplays], return_index=True)
+    moveturns['frame'][readings] = moveframes[otherplays[first]]
+
+    selected = [measured, measured & (moveturns['plays'] > 0)]
+    turns = dict((name, _np.concatenate([
+        _np.broadcast_to(arrays[name], len(cubes))[mask]
+        for arrays, mask in zip([cubeturns, moveturns], selected)]))
+        for name, dtype in TURN_ARRAYS)
+    order = _np.argsort(turns['frame'], kind='stable')
+    return FileClock(filename, players, timesetting, dict(
+        (name, turns[name][order].astype(dtype))
+        for name, dtype in TURN_ARRAYS))
+
+
+def _timeused(timesetting, drop, plays):
+    # Time used by turns whose player's clock dropped by drop while
+    # making plays checker plays, and whether they were within the
+    # Bronstein delay (the time used is then the delay, an upper bound)
+    withindelay = _np.zeros(len(drop), dtype=bool)
+    if timesetting.ClockType == CLOCK_FISCHER:
+        return drop + timesetting.Time2 * plays, withindelay
+    if timesetting.ClockType == CLOCK_BRONSTEIN:
+        withindelay = drop <= 0
+        return _np.where(withindelay, timesetting.Time2,
+                         drop + timesetting.Time2 * plays), withindelay
+    return drop, withindelay
+
+
+class TimeCurve(object):
+
+    """ Time against error: analyzed turns binned by the time used, with
+    the sums in CURVE_STATS for each bin, overall (totals, an (nbins,
+    len(CURVE_STATS)) array) and per player name. The last bin holds the
+    turns within the Bronstein delay, whatever their time used.
+    """
+
+    def __init__(self, bins=DEFAULT_BINS):
+        if _np is None:
+            raise Error("numpy is required")
+        self.bins = _np.asarray(bins, dtype=_np.float64)
+        self.totals = self.__zeros()
+        self.players = {}
+        self.filecount = 0
+
+    def __zeros(self):
+        return _np.zeros((len(self.bins) + 2, len(CURVE_STATS)))
+
+    def __sums(self, turns):
+        # Bin the analyzed turns of one player
+        analyzed = turns['decisions'] > 0
+        binindex = _np.searchsorted(self.bins, turns['timeused'][analyzed],
+                                    side='right')
+        nbins = len(self.bins) + 2
+        binindex[turns['withindelay'][analyzed] != 0] = nbins - 1
+        sums = self.__zeros()
+        error = turns['error'][analyzed].astype(_np.float64)
+        for stat, weights in [
+                (CURVE_TURNS, None),
+                (CURVE_DECISIONS, turns['decisions'][analyzed]),
+                (CURVE_ERROR, error), (CURVE_ERRORSQUARE, error * error),
+                (CURVE_TIMEUSED, turns['timeused'][analyzed])]:
+            sums[:, stat] = _np.bincount(binindex, weights=weights,
+                                         minlength=nbins)
+        return sums
+
+    def add(self, clock):
+        """Add the turns of a FileClock"""
+        for player in range(2):
+            mine = clock.turns['player'] == player
+            sums = self.__sums(dict((name, values[mine]) for name, values
+                                    in clock.turns.items()))
+            self.__addplayer(clock.players[player], sums)
+            self.totals += sums
+        self.filecount += 1
+
+    def __addplayer(self, name, sums):
+        if name in self.players:
+            self.players[name] += sums
+        else:
+            self.players[name] = sums.copy()
+
+    def merge(self, other):
+        """Add the sums of another TimeCurve with the same bins"""
+        if not _np.array_equal(self.bins, other.bins):
+            raise Error("Can't merge time curves with different bins")
+        self.totals += other.totals
+        for name, sums in other.players.items():
+            self.__addplayer(name, sums)
+        self.filecount += other.filecount
+
+    @staticmethod
+    def curve(sums):
+        """Return the mean time used, error per decision and error per
+        turn of each bin of an array of sums (NaN for empty bins).
+        """
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            turns = sums[:, CURVE_TURNS]
+            return {'timeused': sums[:, CURVE_TIMEUSED] / turns,
+                    'errorrate': sums[:, CURVE_ERROR] /
+                    sums[:, CURVE_DECISIONS],
+                    'turnerror': sums[:, CURVE_ERROR] / turns}
+
+
+def _printcurve(out, title, bins, sums):
+    curve = TimeCurve.curve(sums)
+    out.write('%s\n%-12s %8s %9s %9s %10s\n' % (title, 'Time used', 'Turns',
+                                                'Mean (s)', 'Err/dec',
+                                                'Err/turn'))
+    labels = ['%g-%g' % edges for edges in zip([0] + list(bins), bins)] + \
+        ['%g-' % bins[-1], '<= delay']
+    for row in range(len(labels)):
+        out.write('%-12s %8d %9.1f %9.5f %10.5f\n' % (
+            labels[row], sums[row, CURVE_TURNS],
+            curve['timeused'][row], curve['errorrate'][row],
+            curve['turnerror'][row]))
+    out.write('\n')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Time used against errors in timed XG matches',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("-p", "--players", dest="players",
+                        action='store_true',
+                        help="Also report the curve of each player\n")
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    curve = TimeCurve()
+    for filename, clock, error in _xgcorpus.mapfiles(
+            fileclock, _xgcorpus.findfiles(args.paths, skip=skip),
+            workers=args.workers):
+        if error is not None:
+            _sys.stderr.write('%s\n' % error)
+            continue
+        curve.add(clock)
+
+    _printcurve(_sys.stdout, 'All (%d files)' % curve.filecount,
+                curve.bins, curve.totals)
+    if args.players:
+        for name in sorted(curve.players):
+            _printcurve(_sys.stdout, name, curve.bins, curve.players[name])
@@ -0,0 +1,310 @@
+#
+#   xgcolumnar.py - Columnar export of XG moves and cube decisions
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Three tables are written: matches, moves and cubes. Moves and cubes
+#   refer to their match by match_id (the order in which the files were
+#   added) and carry the name of the player on roll so the common
+#   queries need no join. Equities are the 7th element (index 6) of the
+#   XG evaluation arrays.
+#
+#   With pyarrow installed each table is a Parquet file
+#   (<basename>_<table>.parquet) with one row group per rowgroupsize
+#   rows. Otherwise each row group is written as a compressed NumPy
+#   shard (<basename>_<table>_<shard>.npz); readcolumns() concatenates
+#   the shards of a table back together.
+#
+
+import sys as _sys
+import glob as _glob
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+try:
+    import pyarrow as _pa
+    import pyarrow.parquet as _pq
+except ImportError:
+    _pa = None
+else:
+    _PATYPES = {'i1': _pa.int8(), 'i2': _pa.int16(), 'i4': _pa.int32(),
+                'f4': _pa.float32(), 'f8': _pa.float64(),
+                'str': _pa.string()}
+
+# Column types: integer and float widths as NumPy type strings, 'str'
+# for text
+TABLES = [
+    ('matches', [
+        ('match_id', 'i4'), ('filename', 'str'), ('guid', 'str'),
+        ('player1', 'str'), ('player2', 'str'), ('event', 'str'),
+        ('date', 'str'), ('match_length', 'i4'), ('elo1', 'f8'),
+        ('elo2', 'f8'), ('site_id', 'i4'), ('version', 'i4')]),
+    ('moves', [
+        ('match_id', 'i4'), ('game', 'i4'), ('seq', 'i4'),
+        ('player', 'i1'), ('player_name', 'str'), ('dice1', 'i1'),
+        ('dice2', 'i1'), ('cube', 'i1'), ('cube_value', 'i4'),
+        ('n_candidates', 'i1'), ('err_move', 'f8'), ('err_luck', 'f8'),
+        ('init_eq', 'f8'), ('best_equity', 'f4'),
+        ('analyze_level', 'i4')]),
+    ('cubes', [
+        ('match_id', 'i4'), ('game', 'i4'), ('seq', 'i4'),
+        ('player', 'i1'), ('player_name', 'str'), ('dice1', 'i1'),
+        ('dice2', 'i1'), ('cube', 'i1'), ('cube_value', 'i4'),
+        ('double', 'i1'), ('take', 'i1'), ('err_cube', 'f8'),
+        ('err_take', 'f8'), ('eq_no_double', 'f4'),
+        ('eq_double_take', 'f4'), ('eq_double_drop', 'f4'),
+        ('analyze_level', 'i4')])
+    ]
+
+FORMATS = []
+if _pa is not None:
+    FORMATS.append('parquet')
+if _np is not None:
+    FORMATS.append('npz')
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG columnar export: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _cubevalue(cubepos):
+    # Cube position is +/- log2 of the cube value, 0 when centered
+    return 1 << abs(cubepos)
+
+
+def _dicerolled(dice):
+    # Dice rolled at a cube decision are a 2 character string ('' if
+    # the game ended on the cube)
+    if len(dice) == 2 and dice.isdigit():
+        return int(dice[0]), int(dice[1])
+    return 0, 0
+
+
+class ColumnarExporter(object):
+
+    """ Write the moves and cube decisions of XG files as columns.
+    Rows are buffered per table and written out every rowgroupsize
+    rows, so memory use is bounded regardless of the number of files.
+    """
+
+    DEFAULT_ROWGROUPSIZE = 1 << 17
+
+    def __init__(self, basename, format=None,
+                 rowgroupsize=DEFAULT_ROWGROUPSIZE):
+        if format is None:
+            if not FORMATS:
+                raise Error("pyarrow or numpy is required")
+            format = FORMATS[0]
+        if format not in FORMATS:
+            raise Error("%s format is not available" % format)
+
+        self.basename = basename
+        self.format = format
+        self.rowgroupsize = rowgroupsize
+        self.matchcount = 0
+        self.rowcount = 0
+
+        self.__columns = dict(TABLES)
+        self.__rows = dict((table, []) for table, columns in TABLES)
+        self.__shards = dict((table, 0) for table, columns in TABLES)
+        self.__writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __extend(self, table, newrows):
+        rows = self.__rows[table]
+        rows.extend(newrows)
+        while len(rows) >= self.rowgroupsize:
+            self.__rows[table] = rows[self.rowgroupsize:]
+            self.__flushrows(table, rows[:self.rowgroupsize])
+            rows = self.__rows[table]
+
+    def __flushtable(self, table):
+        rows = self.__rows[table]
+        self.__rows[table] = []
+        if rows:
+            self.__flushrows(table, rows)
+
+    def __flushrows(self, table, rows):
+        columns = self.__columns[table]
+        values = list(zip(*rows))
+        if self.format == 'parquet':
+            self.__writeparquet(table, columns, values)
+        else:
+            self.__writenpz(table, columns, values)
+        self.rowcount += len(rows)
+
+    def __writeparquet(self, table, columns, values):
+        arrays = [_pa.array(column, type=_PATYPES[kind])
+                  for (name, kind), column in zip(columns, values)]
+        batch = _pa.Table.from_arrays(arrays,
+                                      [name for name, kind in columns])
+        writer = self.__writers.get(table)
+        if writer is None:
+            writer = _pq.ParquetWriter('%s_%s.parquet' %
+                                       (self.basename, table), batch.schema)
+            self.__writers[table] = writer
+        writer.write_table(batch, row_group_size=len(values[0]))
+
+    def __writenpz(self, table, columns, values):
+        arrays = {}
+        for (name, kind), column in zip(columns, values):
+            arrays[name] = _np.array(column, dtype='U' if kind == 'str'
+                                     else kind)
+        _np.savez_compressed('%s_%s_%05d.npz' % (self.basename, table,
+                                                 self.__shards[table]),
+                             **arrays)
+        self.__shards[table] += 1
+
+    def addfile(self, filename):
+        """Add the match in XG file filename"""
+        matchid = self.matchcount
+        guid = ''
+        # Rows are only added once the whole file has been read
+        # successfully
+        rows = dict((table, []) for table, columns in TABLES)
+        for segment in _xgimport.Import(filename).getfilesegment():
+            if segment.type == _xgimport.Import.Segment.GDF_HDR:
+                segment.file.seek(0)
+                guid = _xgstruct.GameDataFormatHdrRecord().fromstream(
+                    segment.file).GameGUID
+            elif segment.type == _xgimport.Import.Segment.XG_GAMEFILE:
+                self.__addgamefile(segment, matchid, filename, guid, rows)
+        for table, columns in TABLES:
+            self.__extend(table, rows[table])
+        self.matchcount += 1
+        return matchid
+
+    def __addgamefile(self, segment, matchid, filename, guid, rows):
+        moves = rows['moves']
+        cubes = rows['cubes']
+        players = ('', '', '', '')
+        game = 0
+        for seq, rec in enumerate(segment.records()):
+            entrytype = rec.EntryType
+            if entrytype == _xgstruct.GameFileRecord.ENTRYTYPE_MOVE:
+                moves.append((
+                    matchid, game, seq, rec.ActiveP, players[rec.ActiveP],
+                    rec.Dice[0], rec.Dice[1], rec.CubeA,
+                    _cubevalue(rec.CubeA), rec.NMoveEval, rec.ErrMove,
+                    rec.ErrLuck, rec.InitEq, rec.DataMoves.Eval[0][6],
+                    rec.AnalyzeM))
+            elif entrytype == _xgstruct.GameFileRecord.ENTRYTYPE_CUBE:
+                dice = _dicerolled(rec.DiceRolled)
+                doubled = rec.Doubled
+                cubes.append((
+                    matchid, game, seq, rec.ActiveP, players[rec.ActiveP],
+                    dice[0], dice[1], rec.CubeB, _cubevalue(rec.CubeB),
+                    rec.Double, rec.Take, rec.ErrCube, rec.ErrTake,
+                    doubled.equB, doubled.equDouble, doubled.equDrop,
+                    rec.AnalyzeC))
+            elif entrytype == _xgstruct.GameFileRecord.ENTRYTYPE_HEADERGAME:
+                game = rec.GameNumber
+            elif entrytype == _xgstruct.GameFileRecord.ENTRYTYPE_HEADERMATCH:
+                # Indexed by ActiveP (1 or 2), anything else maps to ''
+                players = ('',
+                           _xgutils.utf8bytestostr(
+                               rec.Player1 or rec.SPlayer1),
+                           _xgutils.utf8bytestostr(
+                               rec.Player2 or rec.SPlayer2),
+                           '')
+                rows['matches'].append((
+                    matchid, filename, guid, players[1], players[2],
+                    _xgutils.utf8bytestostr(rec.Event or rec.SEvent), rec.Date,
+                    rec.MatchLength, rec.Elo1, rec.Elo2, rec.SiteId,
+                    rec.Version))
+
+    def close(self):
+        """Write out the remaining rows and close the output files"""
+        for table, columns in TABLES:
+            self.__flushtable(table)
+        for writer in self.__writers.values():
+            writer.close()
+        self.__writers = {}
+
+
+def readcolumns(basename, table):
+    """Return a dictionary of NumPy arrays holding all the columns of
+    table written by ColumnarExporter in npz format.
+    """
+    if _np is None:
+        raise Error("numpy is required")
+    shards = sorted(_glob.glob('%s_%s_[0-9]*.npz' % (basename, table)))
+    columns = dict(TABLES)[table]
+    parts = dict((name, []) for name, kind in columns)
+    for shard in shards:
+        with _np.load(shard) as data:
+            for name, kind in columns:
+                parts[name].append(data[name])
+    return dict((name, _np.concatenate(parts[name]) if parts[name] else
+                 _np.zeros(0, dtype='U' if kind == 'str' else kind))
+                for name, kind in columns)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Export XG moves and cube decisions as columns',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--format", dest="format", choices=FORMATS,
+                        help="Output format (Default is %s)\n" %
+                        (FORMATS[0] if FORMATS else None), default=None)
+    parser.add_argument("-r", metavar='ROWS', dest="rowgroupsize", type=int,
+                        help="Rows per row group or shard (Default is %d)\n"
+                        % ColumnarExporter.DEFAULT_ROWGROUPSIZE,
+                        default=ColumnarExporter.DEFAULT_ROWGROUPSIZE)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument('basename', metavar='BASENAME', type=str,
+                        help='Path and prefix of the output files')
+    parser.add_argument('files', metavar='FILE', type=str, nargs='+',
+                        help='An XG files to import')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    try:
+        exporter = ColumnarExporter(args.basename, format=args.format,
+                                    rowgroupsize=args.rowgroupsize)
+    except Error as e:
+        parser.error(e.value)
+
+    with exporter:
+        for xgfilename in _xgcorpus.skipfiles(args.files, skip):
+            try:
+                exporter.addfile(xgfilename)
+            except (_xgimport.Error, _xgzarc.Error) as e:
+                _sys.stderr.write('%s\n' % e.value)
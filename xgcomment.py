@@ -0,0 +1,290 @@
+#
+#   xgcomment.py - XG comment segment (temp.xgc) module
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   temp.xgc is a text file of RTF comments, one comment per line with
+#   CRLF separating the comments. CRLFs inside a comment are stored as
+#   #1#2 and must be translated back after reading the line. Records in
+#   temp.xg refer to a comment by its (zero based) line number.
+#
+
+import re as _re
+import mmap as _mmap
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG comment file: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class CommentFile(object):
+
+    """ Random access to the comments in a temp.xgc stream. The line
+    offset index is built lazily: a lookup only scans as far as the
+    requested line and nothing is decoded until a comment is asked for.
+    """
+
+    EOL = b'\r\n'
+    INNER_EOL = b'\x01\x02'
+    ENCODING = 'cp1252'
+
+    # Record fields that hold an index into temp.xgc
+    COMMENT_FIELDS = ['CommentHeaderMatch', 'CommentFooterMatch',
+                      'CommentHeaderGame', 'CommentFooterGame',
+                      'CommentCube', 'CommentMove']
+
+    def __init__(self, stream=None, filename=None):
+        self.filename = filename
+        self.stream = stream
+        self.__ownstream = stream is None
+        if stream is None:
+            self.stream = open(filename, 'rb')
+
+        self.__data = self.__mapstream(self.stream)
+        self.__ends = []
+        self.__scanpos = 0
+        self.__complete = len(self.__data) == 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @staticmethod
+    def __mapstream(stream):
+        # Memory map real files so that the data is paged in on demand.
+        # Streams without a file descriptor (or empty files, which can't
+        # be mapped) are read into memory instead.
+        try:
+            return _mmap.mmap(stream.fileno(), 0, access=_mmap.ACCESS_READ)
+        except (AttributeError, IOError, OSError, ValueError):
+            stream.seek(0)
+            return stream.read()
+
+    def close(self):
+        if isinstance(self.__data, _mmap.mmap):
+            self.__data.close()
+        self.__data = b''
+        if self.__ownstream and self.stream is not None:
+            self.stream.close()
+        self.stream = None
+
+    def __scanto(self, index):
+        # Extend the line index until it covers line 'index' or the
+        # end of the data is reached. None scans the whole file.
+        data = self.__data
+        ends = self.__ends
+        eol = self.EOL
+        scanpos = self.__scanpos
+        while (index is None or len(ends) <= index) and \
+                not self.__complete:
+            pos = data.find(eol, scanpos)
+            if pos < 0:
+                # Last line has no trailing CRLF
+                ends.append(len(data))
+                scanpos = len(data)
+                self.__complete = True
+            else:
+                ends.append(pos)
+                scanpos = pos + len(eol)
+                if scanpos >= len(data):
+                    self.__complete = True
+        self.__scanpos = scanpos
+
+    def __len__(self):
+        self.__scanto(None)
+        return len(self.__ends)
+
+    def getrawcomment(self, index):
+        """Return comment number index as the raw bytes of the line with
+        #1#2 translated back to CRLF. Return None for a negative index
+        (no comment) and raise an Error if the index is out of range.
+        """
+        if index is None or index < 0:
+            return None
+        self.__scanto(index)
+        if index >= len(self.__ends):
+            raise Error("Comment index %d out of range" % index)
+        start = self.__ends[index - 1] + len(self.EOL) if index > 0 else 0
+        line = self.__data[start:self.__ends[index]]
+        return line.replace(self.INNER_EOL, self.EOL)
+
+    def getcomment(self, index):
+        """Return comment number index as an RTF string"""
+        rawcomment = self.getrawcomment(index)
+        if rawcomment is None:
+            return None
+        return rawcomment.decode(self.ENCODING, 'replace')
+
+    def gettext(self, index):
+        """Return comment number index converted to plain text"""
+        rtfcomment = self.getcomment(index)
+        if rtfcomment is None:
+            return None
+        return rtftotext(rtfcomment)
+
+    def forrecord(self, rec, plaintext=False):
+        """Return a dictionary mapping each comment field set in record
+        rec to its comment.
+        """
+        getter = self.gettext if plaintext else self.getcomment
+        comments = {}
+        for field in self.COMMENT_FIELDS:
+            index = rec.get(field, -1)
+            if index is not None and index >= 0:
+                comments[field] = getter(index)
+        return comments
+
+    def __getitem__(self, index):
+        return self.getcomment(index)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self.__scanto(index)
+            if index >= len(self.__ends):
+                return
+            yield self.getcomment(index)
+            index += 1
+
+
+# RTF tokens: a control word with optional numeric parameter, a hex
+# escaped character, an escaped special character or symbol, a group
+# delimiter, a line break or a run of plain text.
+_RTF_TOKEN = _re.compile(
+    r"\\([a-zA-Z]+)(-?\d+)? ?|\\'([0-9a-fA-F]{2})|\\([^a-zA-Z])|"
+    r"([{}])|[\r\n]+|([^\\{}\r\n]+)")
+
+# Destinations whose content is not part of the visible text
+_RTF_DESTINATIONS = frozenset([
+    'aftncn', 'aftnsep', 'aftnsepc', 'annotation', 'atnauthor', 'atndate',
+    'atnicn', 'atnid', 'atnparent', 'atnref', 'atntime', 'atrfend',
+    'atrfstart', 'author', 'background', 'bkmkend', 'bkmkstart', 'buptim',
+    'category', 'colortbl', 'comment', 'company', 'creatim', 'datafield',
+    'do', 'doccomm', 'docvar', 'dptxbxtext', 'falt', 'fchars', 'ffdeftext',
+    'ffentrymcr', 'ffexitmcr', 'ffformat', 'ffhelptext', 'ffl', 'ffname',
+    'ffstattext', 'field', 'file', 'filetbl', 'fldinst', 'fldtype', 'fname',
+    'fontemb', 'fontfile', 'fonttbl', 'footer', 'footerf', 'footerl',
+    'footerr', 'footnote', 'ftncn', 'ftnsep', 'ftnsepc', 'generator',
+    'header', 'headerf', 'headerl', 'headerr', 'hlinkbase', 'info',
+    'keywords', 'lchars', 'levelnumbers', 'leveltext', 'lfolevel',
+    'listlevel', 'listname', 'listoverride', 'listoverridetable',
+    'listtable', 'manager', 'nonshppict', 'objalias', 'objclass', 'objdata',
+    'object', 'objname', 'objsect', 'objtime', 'operator', 'pict', 'pn',
+    'pnseclvl', 'pntext', 'pntxta', 'pntxtb', 'printim', 'private',
+    'pxe', 'revtbl', 'revtim', 'rsidtbl', 'rxe', 'shp', 'shpinst',
+    'stylesheet', 'subject', 'tc', 'template', 'title', 'txe', 'xe'])
+
+_RTF_SPECIALS = {
+    'par': u'\n', 'sect': u'\n\n', 'page': u'\n\n', 'line': u'\n',
+    'tab': u'\t', 'emdash': u'\u2014', 'endash': u'\u2013',
+    'emspace': u'\u2003', 'enspace': u'\u2002', 'qmspace': u'\u2005',
+    'bullet': u'\u2022', 'lquote': u'\u2018', 'rquote': u'\u2019',
+    'ldblquote': u'\u201c', 'rdblquote': u'\u201d'}
+
+
+def rtftotext(rtf, encoding=CommentFile.ENCODING):
+    """Strip the RTF markup from rtf and return the plain text. Handles
+    groups, ignorable destinations, \\uN unicode escapes (honouring
+    \\ucN) and \\'hh escapes. Pictures, fields and other embedded
+    objects are dropped. Input that doesn't look like RTF is returned
+    unchanged.
+    """
+    if not rtf.startswith('{\\rtf'):
+        return rtf
+
+    stack = []
+    ignorable = False       # Whether this group (and all inside it) are ignored
+    ucskip = 1              # Number of ASCII characters to skip after a unicode
+    curskip = 0             # Number of ASCII characters left to skip
+    out = []
+
+    for match in _RTF_TOKEN.finditer(rtf):
+        word, arg, hexcode, char, brace, text = match.groups()
+        if brace:
+            curskip = 0
+            if brace == '{':
+                stack.append((ucskip, ignorable))
+            elif stack:
+                ucskip, ignorable = stack.pop()
+        elif char:
+            curskip = 0
+            if char == '*':
+                ignorable = True
+            elif not ignorable:
+                if char in '\\{}':
+                    out.append(char)
+                elif char == '~':
+                    out.append(u'\xa0')
+                elif char == '_':
+                    out.append(u'\u2011')
+                elif char in '\r\n':
+                    out.append(u'\n')
+        elif word:
+            curskip = 0
+            if word in _RTF_DESTINATIONS:
+                ignorable = True
+            elif ignorable:
+                pass
+            elif word in _RTF_SPECIALS:
+                out.append(_RTF_SPECIALS[word])
+            elif word == 'uc':
+                # Comments are user authored: a missing argument means
+                # the default of 1
+                ucskip = int(arg) if arg is not None else 1
+            elif word == 'u' and arg is not None:
+                # \u takes a signed 16 bit value, anything else is
+                # malformed
+                code = int(arg)
+                if code < 0:
+                    code += 0x10000
+                out.append(_unichr(code) if 0 <= code <= 0xffff else
+                           u'\ufffd')
+                curskip = ucskip
+        elif hexcode:
+            if curskip > 0:
+                curskip -= 1
+            elif not ignorable:
+                out.append(bytearray([int(hexcode, 16)]).decode(
+                    encoding, 'replace'))
+        elif text:
+            if curskip > 0:
+                if curskip >= len(text):
+                    curskip -= len(text)
+                    continue
+                text = text[curskip:]
+                curskip = 0
+            if not ignorable:
+                out.append(text)
+
+    return u''.join(out).strip()
+
+
+if __name__ == '__main__':
+    pass
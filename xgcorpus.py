@@ -0,0 +1,122 @@
+#
+#   xgcorpus.py - Helpers for processing collections of XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os as _os
+import multiprocessing as _multiprocessing
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+
+XG_EXTENSION = '.xg'
+
+# Errors a worker reports back instead of raising
+FILE_ERRORS = (_xgimport.Error, _xgzarc.Error, IOError, OSError)
+
+
+def readskiplist(filename):
+    """Return the set of absolute paths listed in a skip list: a text
+    file with one path per line. Blank lines and lines starting with #
+    are ignored.
+    """
+    skip = set()
+    with open(filename) as skipfile:
+        for line in skipfile:
+            line = line.rstrip('\r\n')
+            if line.strip() and not line.startswith('#'):
+                skip.add(_os.path.abspath(line))
+    return skip
+
+
+def skipfiles(filenames, skip):
+    """Generator returning the files in filenames whose absolute path
+    isn't in skip (see readskiplist).
+    """
+    for filename in filenames:
+        if not skip or _os.path.abspath(filename) not in skip:
+            yield filename
+
+
+def findfiles(paths, extension=XG_EXTENSION, skip=None):
+    """Generator returning the XG files named in paths. Directories are
+    searched recursively for files with the given extension (matched
+    case insensitively); files named explicitly are always returned.
+    Files whose absolute path is in skip are left out.
+    """
+    for path in paths:
+        if _os.path.isdir(path):
+            for dirpath, dirnames, filenames in _os.walk(path):
+                dirnames.sort()
+                for filename in skipfiles(
+                        [_os.path.join(dirpath, filename)
+                         for filename in sorted(filenames)
+                         if _os.path.splitext(filename)[1].lower() ==
+                         extension], skip):
+                    yield filename
+        else:
+            for filename in skipfiles([path], skip):
+                yield filename
+
+
+class _Worker(object):
+
+    # Wrap func so that file errors come back as results. Defined at
+    # module level so it can be pickled for the worker processes.
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, filename):
+        try:
+            return filename, self.func(filename), None
+        except FILE_ERRORS as e:
+            return filename, None, getattr(e, 'value', str(e))
+
+
+def mapfiles(func, filenames, workers=None, chunksize=1):
+    """Generator applying func to every file in filenames and returning
+    (filename, result, error) tuples as they complete. error is None on
+    success, otherwise result is None and error is the message of the
+    XG import error raised by func. With more than one worker the files
+    are processed by a process pool (func must then be picklable, i.e.
+    a module level function) and results arrive out of order. workers
+    defaults to the number of CPUs.
+    """
+    if workers is None:
+        workers = _multiprocessing.cpu_count()
+
+    worker = _Worker(func)
+    if workers <= 1:
+        for filename in filenames:
+            yield worker(filename)
+        return
+
+    pool = _multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(worker, filenames, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+if __name__ == '__main__':
+    pass
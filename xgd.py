@@ -0,0 +1,409 @@
+#
+#   xgd.py - Long running XG import service
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   The service listens on a Unix domain socket (or HOST:PORT where there
+#   are no Unix sockets; HOST must be a loopback address since requests
+#   name the files to read and the directories to write). Every request
+#   is one line of JSON and gets one line of JSON back:
+#
+#     {"op": "import", "files": [...], "outdir": DIR}
+#         read the files through the record cache, catalog them and, if
+#         outdir is given, write their segments there as extractxgdata
+#         names them
+#     {"op": "scan", "paths": [...]}
+#         import the XG files below paths that are new or changed since
+#         they were cataloged
+#     {"op": "query", "player": NAME, "since": DATE, "until": DATE}
+#         the catalog rows, see xgcatalog.Catalog.find
+#     {"op": "status"}
+#
+#   Replies have "ok" and either the result or "error". Files are read by
+#   a process pool created once, whose workers keep their modules loaded
+#   and share an xgcache.RecordCache, so a file that was seen before
+#   isn't inflated again. At most maxqueue files are in flight: a file
+#   that can't get a slot within wait seconds is answered with the
+#   "busy" error and should be sent again later, and so are the files
+#   of the same request after it that don't find a slot free at once,
+#   so that a request waits wait seconds at most.
+#
+
+import os as _os
+import sys as _sys
+import json as _json
+import time as _time
+import socket as _socket
+import threading as _threading
+import multiprocessing as _multiprocessing
+import xgimport as _xgimport
+import xgcache as _xgcache
+import xgcatalog as _xgcatalog
+import xgcorpus as _xgcorpus
+
+try:
+    import socketserver as _socketserver
+except ImportError:
+    import SocketServer as _socketserver
+
+BUSY = 'busy'
+DEFAULT_MAXQUEUE = 256
+DEFAULT_WAIT = 5.0
+
+# Segments written by an import with outdir (the thumbnail isn't cached)
+_OUTPUT_SEGMENTS = [_xgimport.Import.Segment.GDF_HDR,
+                    _xgimport.Import.Segment.XG_GAMEHDR,
+                    _xgimport.Import.Segment.XG_GAMEFILE,
+                    _xgimport.Import.Segment.XG_ROLLOUTS,
+                    _xgimport.Import.Segment.XG_COMMENT]
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG service: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+# Per worker process state, set up once by _initworker
+_cache = None
+
+
+def _initworker(cachedir, cachesize):
+    global _cache
+    if cachedir is not None:
+        _cache = _xgcache.RecordCache(cachedir, maxsize=cachesize)
+
+
+def _importfile(filename, outdir):
+    # Runs in a worker: return (result, error) for one file
+    try:
+        hits = _cache.hits if _cache is not None else 0
+        if _cache is not None:
+            cached = _cache.load(filename)
+        else:
+            cached = _xgcache.CachedFile(_xgcache.readsegments(filename))
+        result = {'file': filename,
+                  'cached': _cache is not None and _cache.hits > hits,
+                  'records': len(cached),
+                  'entry': _xgcatalog.segmententry(cached.segdata, filename)}
+        if outdir is not None:
+            result['written'] = _writesegments(filename, outdir,
+                                               cached.segdata)
+        return result, None
+    except _xgcorpus.FILE_ERRORS as e:
+        return None, getattr(e, 'value', str(e))
+
+
+def _writesegments(filename, outdir, segdata):
+    # Write the segments under the names extractxgdata gives them
+    base = _os.path.splitext(_os.path.basename(filename))[0]
+    written = []
+    for segtype in _OUTPUT_SEGMENTS:
+        if segtype not in segdata:
+            continue
+        path = _os.path.abspath(_os.path.join(
+            outdir, base + _xgimport.Import.Segment.EXTENSIONS[segtype]))
+        with open(path, 'wb') as segfile:
+            segfile.write(segdata[segtype])
+        written.append(path)
+    return written
+
+
+class Service(object):
+
+    """ The state shared by the request handlers: the process pool, the
+    slots bounding the files in flight and the catalog database.
+    """
+
+    def __init__(self, catalogdb, cachedir=None,
+                 cachesize=_xgcache.RecordCache.DEFAULT_MAXSIZE,
+                 workers=None, maxqueue=DEFAULT_MAXQUEUE, wait=DEFAULT_WAIT):
+        self.catalogdb = catalogdb
+        self.maxqueue = maxqueue
+        self.wait = wait
+        self.slots = _threading.BoundedSemaphore(maxqueue)
+        self.lock = _threading.Lock()
+        self.inflight = 0
+        self.processed = 0
+        self.errors = 0
+        self.rejected = 0
+        self.cachehits = 0
+        self.started = _time.time()
+        # Create the catalog tables before any handler needs them
+        _xgcatalog.Catalog(catalogdb).close()
+        self.pool = _multiprocessing.Pool(
+            workers, initializer=_initworker, initargs=(cachedir, cachesize))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __release(self, result):
+        with self.lock:
+            self.inflight -= 1
+        self.slots.release()
+
+    def importfiles(self, filenames, outdir=None):
+        """Import filenames through the pool and catalog them. Returns a
+        list with a result or an error per file, in order.
+        """
+        pending = []
+        waiting = True
+        for filename in filenames:
+            if waiting:
+                acquired = self.slots.acquire(True, self.wait)
+            else:
+                acquired = self.slots.acquire(False)
+            if not acquired:
+                waiting = False
+                with self.lock:
+                    self.rejected += 1
+                pending.append((filename, None))
+                continue
+            with self.lock:
+                self.inflight += 1
+            pending.append((filename, self.pool.apply_async(
+                _importfile, (_os.path.abspath(filename), outdir),
+                callback=self.__release,
+                error_callback=self.__release)))
+
+        replies = []
+        entries = []
+        for filename, asyncresult in pending:
+            if asyncresult is None:
+                replies.append({'file': filename, 'error': BUSY})
+                continue
+            try:
+                result, error = asyncresult.get()
+            except Exception as e:
+                # A file the decoders choked on; keep serving
+                result, error = None, '%s: %s' % (filename, e)
+            with self.lock:
+                self.processed += 1
+                self.errors += error is not None
+                self.cachehits += result is not None and result['cached']
+            if error is not None:
+                replies.append({'file': filename, 'error': error})
+                continue
+            entries.append((result['file'], result.pop('entry')))
+            replies.append(result)
+
+        if entries:
+            with _xgcatalog.Catalog(self.catalogdb) as catalog:
+                catalog.update(entries)
+        return replies
+
+    def scan(self, paths):
+        """Import the XG files in paths that are new or changed since they
+        were cataloged.
+        """
+        with _xgcatalog.Catalog(self.catalogdb) as catalog:
+            filenames = list(catalog.stale(_xgcorpus.findfiles(paths),
+                                           games=True))
+        return self.importfiles(filenames)
+
+    def query(self, player=None, since=None, until=None):
+        with _xgcatalog.Catalog(self.catalogdb) as catalog:
+            return catalog.find(player, since, until)
+
+    def status(self):
+        with self.lock:
+            return {'inflight': self.inflight, 'maxqueue': self.maxqueue,
+                    'processed': self.processed, 'errors': self.errors,
+                    'rejected': self.rejected, 'cachehits': self.cachehits,
+                    'uptime': _time.time() - self.started}
+
+    def handle(self, request):
+        """Return the reply to a request (both dictionaries)"""
+        op = request.get('op')
+        if op == 'import':
+            result = self.importfiles(request.get('files', []),
+                                      request.get('outdir'))
+        elif op == 'scan':
+            result = self.scan(request.get('paths', []))
+        elif op == 'query':
+            result = self.query(request.get('player'), request.get('since'),
+                                request.get('until'))
+        elif op == 'status':
+            result = self.status()
+        else:
+            return {'ok': False, 'error': 'unknown op %r' % op}
+        return {'ok': True, 'result': result}
+
+
+class _Handler(_socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = _json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise ValueError('not an object')
+            except ValueError as e:
+                reply = {'ok': False, 'error': 'bad request: %s' % e}
+            else:
+                try:
+                    reply = self.server.service.handle(request)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+            try:
+                line = _json.dumps(reply)
+            except (TypeError, ValueError) as e:
+                line = _json.dumps({'ok': False, 'error': str(e)})
+            self.wfile.write(line.encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def _address(address):
+    # 'HOST:PORT' for TCP, anything else is a Unix socket path
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return _socket.AF_INET, (host or 'localhost', int(port))
+    return getattr(_socket, 'AF_UNIX', None), address
+
+
+def _isloopback(host):
+    try:
+        return _socket.gethostbyname(host).startswith('127.')
+    except _socket.error:
+        return False
+
+
+def serve(address, service):
+    """Serve requests on address until interrupted"""
+    family, addr = _address(address)
+    if family is None:
+        raise Error("Unix domain sockets aren't supported, use HOST:PORT")
+    if family == _socket.AF_INET and not _isloopback(addr[0]):
+        raise Error("%s isn't a loopback address" % addr[0])
+    if family == _socket.AF_INET:
+        server = _socketserver.ThreadingTCPServer(addr, _Handler)
+    else:
+        if _os.path.exists(addr):
+            _os.unlink(addr)
+        server = _socketserver.ThreadingUnixStreamServer(addr, _Handler)
+    server.daemon_threads = True
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family != _socket.AF_INET:
+            _os.unlink(addr)
+
+
+def request(address, message):
+    """Send one request to a running service and return its reply"""
+    family, addr = _address(address)
+    sock = _socket.socket(family, _socket.SOCK_STREAM)
+    try:
+        sock.connect(addr)
+        stream = sock.makefile('rwb')
+        stream.write(_json.dumps(message).encode('utf-8') + b'\n')
+        stream.flush()
+        line = stream.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise Error("connection closed by the service")
+    return _json.loads(line.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run or talk to the XG import service',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-s", metavar='ADDRESS', dest="address",
+                        help="Unix socket path or HOST:PORT "
+                        "(Default is xgd.sock)\n", default='xgd.sock')
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="serve: number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("-q", metavar='N', dest="maxqueue", type=int,
+                        help="serve: maximum files in flight (Default is "
+                        "%d)\n" % DEFAULT_MAXQUEUE, default=DEFAULT_MAXQUEUE)
+    parser.add_argument("-w", metavar='SECONDS', dest="wait", type=float,
+                        help="serve: wait for a slot before answering busy "
+                        "(Default is %g)\n" % DEFAULT_WAIT,
+                        default=DEFAULT_WAIT)
+    parser.add_argument("--catalog", metavar='DB', dest="catalog",
+                        help="serve: catalog database (Default is "
+                        "xgd.db)\n", default='xgd.db')
+    parser.add_argument("--cache", metavar='DIR', dest="cache",
+                        help="serve: record cache directory (Default is no "
+                        "cache)\n", default=None)
+    parser.add_argument("-d", metavar='DIR', dest="outdir",
+                        help="import: write the segments to DIR\n",
+                        default=None)
+    parser.add_argument("-p", "--player", metavar='NAME', dest="player",
+                        help="query: matches of player NAME\n", default=None)
+    parser.add_argument("--since", metavar='DATE', dest="since",
+                        help="query: matches played on or after DATE\n",
+                        default=None)
+    parser.add_argument("--until", metavar='DATE', dest="until",
+                        help="query: matches played before DATE\n",
+                        default=None)
+    parser.add_argument('command',
+                        choices=['serve', 'import', 'scan', 'query',
+                                 'status'])
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='*',
+                        help='XG files (import) or directories (scan)')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        import signal
+        service = Service(args.catalog, cachedir=args.cache,
+                          workers=args.workers, maxqueue=args.maxqueue,
+                          wait=args.wait)
+        # Shut down cleanly when terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: _sys.exit(0))
+        try:
+            serve(args.address, service)
+        except KeyboardInterrupt:
+            pass
+        except Error as e:
+            _sys.stderr.write('%s\n' % e.value)
+            _sys.exit(1)
+        finally:
+            service.close()
+        _sys.exit(0)
+
+    message = {'op': args.command}
+    if args.command == 'import':
+        message['files'] = [_os.path.abspath(path) for path in args.paths]
+        if args.outdir is not None:
+            message['outdir'] = _os.path.abspath(args.outdir)
+    elif args.command == 'scan':
+        message['paths'] = [_os.path.abspath(path) for path in args.paths]
+    elif args.command == 'query':
+        message.update(player=args.player, since=args.since,
+                       until=args.until)
+    try:
+        reply = request(args.address, message)
+    except (Error, _socket.error) as e:
+        _sys.stderr.write('%s\n' % getattr(e, 'value', e))
+        _sys.exit(1)
+    if not reply.get('ok'):
+        _sys.stderr.write('%s\n' % reply.get('error'))
+        _sys.exit(1)
+    print(_json.dumps(reply['result'], indent=1, sort_keys=True))
@@ -0,0 +1,226 @@
+#
+#   xgdedup.py - Find duplicate matches in a collection of XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A match is fingerprinted from the identity fields of its
+#   HeaderMatchEntry (players, match length, date, event, ...) and the
+#   size and CRC32 of its inflated temp.xg. The ZlibArchive index
+#   already holds that CRC, so a fingerprint costs reading the game data
+#   format header, the archive index and inflating temp.xgi (the first
+#   556 bytes of the match header); temp.xg is only inflated if temp.xgi
+#   isn't a match header. Files with the same fingerprint are the same
+#   match with the same analysis, whatever they are named.
+#
+#   The GameGUID is kept when a match is saved under another name but
+#   not necessarily when it is exported again, so by default it isn't
+#   part of the fingerprint; sameguid=True makes it so. verify=True
+#   confirms every cluster with a SHA-1 of the inflated temp.xg, at the
+#   cost of inflating the clustered files.
+#
+#   The first file (by path) of every cluster is kept, the others are
+#   written to a skip list that xgcorpus.readskiplist reads and the
+#   batch tools take with --skip.
+#
+
+import os as _os
+import sys as _sys
+import hashlib as _hashlib
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgcorpus as _xgcorpus
+
+IDENTITY_FIELDS = ['SPlayer1', 'SPlayer2', 'MatchLength', 'Variation',
+                   'Date', 'SEvent', 'GameId', 'SLocation', 'SRound']
+
+GAMEHDR_NAME = 'temp.xgi'
+GAMEFILE_NAME = 'temp.xg'
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG dedup: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _identity(data):
+    # The identity fields of the match header data starts with, if any
+    header = _xgimport.decodematchheader(data)
+    if header is None:
+        return None
+    return tuple(header[field] for field in IDENTITY_FIELDS)
+
+
+class Fingerprint(object):
+
+    """ Fingerprint of one XG file: guid is its GameGUID, identity the
+    values of IDENTITY_FIELDS, gamesize and gamecrc the size and CRC32
+    of its inflated temp.xg.
+    """
+
+    def __init__(self, filename, guid, identity, gamesize, gamecrc):
+        self.filename = filename
+        self.guid = guid
+        self.identity = identity
+        self.gamesize = gamesize
+        self.gamecrc = gamecrc
+
+    def key(self, sameguid=False):
+        """Return the hex digest that duplicates share"""
+        parts = [str(value) for value in self.identity]
+        parts += [str(self.gamesize), '%08x' % self.gamecrc]
+        if sameguid:
+            parts.append(self.guid)
+        return _hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def fingerprint(filename):
+    """Return the Fingerprint of an XG file"""
+    with open(filename, 'rb') as xgfile:
+        gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(xgfile)
+        if gdfheader is None:
+            raise _xgimport.Error("Not a game data format file", filename)
+        arcrec, filerecs, startofarcdata = _xgzarc.readregistry(xgfile)
+        byname = dict((filerec.name, filerec) for filerec in filerecs)
+        gamefile = byname.get(GAMEFILE_NAME)
+        if gamefile is None:
+            raise _xgimport.Error("No game file in archive", filename)
+
+        identity = None
+        if GAMEHDR_NAME in byname:
+            identity = _identity(_xgzarc.readfiledata(
+                xgfile, byname[GAMEHDR_NAME], startofarcdata))
+        if identity is None:
+            identity = _identity(_xgzarc.readfiledata(
+                xgfile, gamefile, startofarcdata))
+        if identity is None:
+            raise _xgimport.Error("Not a valid XG gamefile", filename)
+
+    return Fingerprint(filename, gdfheader.GameGUID, identity,
+                       gamefile.osize, gamefile.crc)
+
+
+def contenthash(filename):
+    """Return the SHA-1 hex digest of the inflated temp.xg of an XG file"""
+    with open(filename, 'rb') as xgfile:
+        arcrec, filerecs, startofarcdata = _xgzarc.readregistry(xgfile)
+        for filerec in filerecs:
+            if filerec.name == GAMEFILE_NAME:
+                return _hashlib.sha1(_xgzarc.readfiledata(
+                    xgfile, filerec, startofarcdata)).hexdigest()
+    raise _xgimport.Error("No game file in archive", filename)
+
+
+def clusters(fingerprints, sameguid=False, verify=False):
+    """Return the clusters of duplicates among fingerprints: a list of
+    lists of Fingerprints with the same key, each sorted by filename and
+    holding at least two files. With verify the files of a cluster are
+    split further by contenthash.
+    """
+    bykey = {}
+    for fp in fingerprints:
+        bykey.setdefault(fp.key(sameguid), []).append(fp)
+
+    result = []
+    for key in sorted(bykey):
+        group = bykey[key]
+        if len(group) < 2:
+            continue
+        if verify:
+            byhash = {}
+            for fp in group:
+                byhash.setdefault(contenthash(fp.filename), []).append(fp)
+            groups = list(byhash.values())
+        else:
+            groups = [group]
+        result.extend(sorted(part, key=lambda fp: fp.filename)
+                      for part in groups if len(part) > 1)
+    result.sort(key=lambda cluster: cluster[0].filename)
+    return result
+
+
+def writeskiplist(filename, clusters):
+    """Write the files to skip (all but the first of every cluster) in
+    the format read by xgcorpus.readskiplist.
+    """
+    with open(filename, 'w') as skipfile:
+        skipfile.write('# Duplicate XG files written by xgdedup\n')
+        for cluster in clusters:
+            skipfile.write('# same as %s\n' %
+                           _os.path.abspath(cluster[0].filename))
+            for fp in cluster[1:]:
+                skipfile.write('%s\n' % _os.path.abspath(fp.filename))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Find XG files holding the same match',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("-o", metavar='FILE', dest="skiplist",
+                        help="Write the duplicates to skip to FILE\n",
+                        default=None)
+    parser.add_argument("-g", "--guid", dest="sameguid", action='store_true',
+                        help="Only files with the same GameGUID are "
+                        "duplicates\n")
+    parser.add_argument("--verify", dest="verify", action='store_true',
+                        help="Confirm duplicates by hashing their inflated "
+                        "game files\n")
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+
+    fingerprints = []
+    for filename, result, error in _xgcorpus.mapfiles(
+            fingerprint, _xgcorpus.findfiles(args.paths),
+            workers=args.workers):
+        if error is not None:
+            _sys.stderr.write('%s\n' % error)
+            continue
+        fingerprints.append(result)
+
+    try:
+        found = clusters(fingerprints, sameguid=args.sameguid,
+                         verify=args.verify)
+    except _xgcorpus.FILE_ERRORS as e:
+        _sys.stderr.write('%s\n' % getattr(e, 'value', str(e)))
+        _sys.exit(1)
+
+    for cluster in found:
+        first = cluster[0]
+        print('%s vs %s, %s, %d files%s' % (
+            first.identity[0], first.identity[1], first.identity[4],
+            len(cluster), '' if len(set(fp.guid for fp in cluster)) == 1
+            else ' (GameGUIDs differ)'))
+        print('  keep %s' % first.filename)
+        for fp in cluster[1:]:
+            print('  skip %s' % fp.filename)
+    print('%d files, %d duplicates in %d clusters' %
+          (len(fingerprints), sum(len(cluster) - 1 for cluster in found),
+           len(found)))
+
+    if args.skiplist is not None:
+        writeskiplist(args.skiplist, found)
@@ -0,0 +1,317 @@
+#
+#   xgdice.py - Dice distribution and luck audit over XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Rolls are tallied into 36 outcomes, index (die1 - 1) * 6 + die2 - 1
+#   with the dice in the order XG stored them. Since that order carries
+#   no meaning the chi-square tests fold the tally into the 21 distinct
+#   rolls (doubles 1/36, others 2/36) and into the 12 die faces.
+#
+#   The opening roll of each game can't be a double, so the first move
+#   of every game is left out of the tallies. By default the rolls come
+#   from MoveEntry.Dice; CubeEntry.DiceRolled (the roll that followed a
+#   cube decision) can be audited instead. Luck is always the sum of
+#   MoveEntry.ErrLuck over the rolls whose luck was analyzed.
+#
+#   Only the Dice, ActiveP and ErrLuck bytes of each frame are read and
+#   tallies are plain arrays, so file tallies computed by workers are
+#   merged by adding them.
+#
+
+import io as _io
+import sys as _sys
+import math as _math
+import functools as _functools
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgarray as _xgarray
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+SOURCE_MOVES, SOURCE_CUBES = range(2)
+SOURCE_NAMES = ['moves', 'cubes']
+
+NOT_ANALYZED = -1000
+
+# Luck sums: total luck and the number of rolls it covers
+LUCK_SUM, LUCK_ROLLS = range(2)
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG dice audit: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _tally(players, die1, die2):
+    # (2, 36) outcome counts of the valid rolls of each player
+    valid = (die1 >= 1) & (die1 <= 6) & (die2 >= 1) & (die2 <= 6)
+    index = players[valid] * 36 + (die1[valid] - 1) * 6 + die2[valid] - 1
+    return _np.bincount(index, minlength=72).reshape(2, 36)
+
+
+class FileTally(object):
+
+    """ Dice and luck tallies of one XG file: dice is a (2, 36) array of
+    outcome counts and luck a (2, 2) array of luck sums, one row for
+    each player.
+    """
+
+    def __init__(self, filename, players, siteid, dice, luck):
+        self.filename = filename
+        self.players = players
+        self.siteid = siteid
+        self.dice = dice
+        self.luck = luck
+
+
+def filetally(filename, source=SOURCE_MOVES):
+    """Compute the FileTally of an XG file"""
+    if _np is None:
+        raise Error("numpy is required")
+    data = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE]).get(
+        _xgimport.Import.Segment.XG_GAMEFILE, b'')
+
+    header = _xgstruct.GameFileRecord().fromstream(_io.BytesIO(
+        data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]))
+    if not isinstance(header, _xgstruct.HeaderMatchEntry):
+        raise _xgimport.Error("No match header", filename)
+    players = (_xgutils.utf8bytestostr(header.Player1 or header.SPlayer1),
+               _xgutils.utf8bytestostr(header.Player2 or header.SPlayer2))
+
+    rawframes = _xgarray.frames(data)
+    entrytypes = rawframes[:, _xgarray.ENTRYTYPE_OFFSET]
+    ismove = entrytypes == _xgstruct.GameFileRecord.ENTRYTYPE_MOVE
+
+    # Number the games by counting game headers, then drop the first
+    # move of each game (the opening roll)
+    gameids = _np.cumsum(entrytypes ==
+                         _xgstruct.GameFileRecord.ENTRYTYPE_HEADERGAME)
+    moveframes = _np.nonzero(ismove)[0]
+    opening = _np.zeros(len(rawframes), dtype=bool)
+    opening[moveframes[_np.unique(gameids[moveframes],
+                                  return_index=True)[1]]] = True
+
+    moves = rawframes[ismove]
+    active = (_xgarray.field(moves, _xgarray.MOVEENTRY_DTYPE, 'ActiveP')
+              != 1).astype(_np.intp)
+    errluck = _xgarray.field(moves, _xgarray.MOVEENTRY_DTYPE, 'ErrLuck')
+    analyzed = errluck > NOT_ANALYZED + 1
+    luck = _np.zeros((2, 2))
+    luck[:, LUCK_SUM] = _np.bincount(active[analyzed],
+                                     weights=errluck[analyzed], minlength=2)
+    luck[:, LUCK_ROLLS] = _np.bincount(active[analyzed], minlength=2)
+
+    if source == SOURCE_MOVES:
+        rolls = rawframes[ismove & ~opening]
+        dice = _xgarray.field(rolls, _xgarray.MOVEENTRY_DTYPE, 'Dice')
+        rollers = _xgarray.field(rolls, _xgarray.MOVEENTRY_DTYPE, 'ActiveP')
+        die1, die2 = dice[:, 0], dice[:, 1]
+    else:
+        # DiceRolled is a shortstring such as '64'; the ActiveP of the
+        # cube decision is the player who then rolled
+        rolls = rawframes[entrytypes ==
+                          _xgstruct.GameFileRecord.ENTRYTYPE_CUBE]
+        dice = _xgarray.field(rolls, _xgarray.CUBEENTRY_DTYPE,
+                              'DiceRolled').astype(_np.intp)
+        rollers = _xgarray.field(rolls, _xgarray.CUBEENTRY_DTYPE, 'ActiveP')
+        dice[dice[:, 0] != 2] = 0
+        die1, die2 = dice[:, 1] - ord('0'), dice[:, 2] - ord('0')
+    tally = _tally((rollers != 1).astype(_np.intp), die1, die2)
+
+    return FileTally(filename, players, header.SiteId, tally, luck)
+
+
+def _chi2sf(x, dof):
+    # Upper tail probability of the chi-square distribution: the
+    # regularized upper incomplete gamma function Q(dof / 2, x / 2)
+    a, x = dof / 2.0, x / 2.0
+    if x <= 0:
+        return 1.0
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * _math.exp(-x + a * _math.log(x) -
+                                                _math.lgamma(a)))
+    # Continued fraction (modified Lentz)
+    b = x + 1.0 - a
+    c = 1.0 / 1e-300
+    d = 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2.0
+        d = an * d + b
+        d = 1.0 / d if abs(d) > 1e-300 else 1e300
+        c = b + an / c
+        c = c if abs(c) > 1e-300 else 1e-300
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-15:
+            break
+    return h * _math.exp(-x + a * _math.log(x) - _math.lgamma(a))
+
+
+def _chi2(observed, expected):
+    observed = _np.asarray(observed, dtype=_np.float64)
+    stat = float((((observed - expected) ** 2) / expected).sum())
+    return stat, _chi2sf(stat, len(observed) - 1)
+
+
+def summarize(counts):
+    """Return a dictionary of summary statistics of a 36 outcome tally:
+    rolls, doubles, doublesrate, chi-square statistic and p-value over
+    the 21 distinct rolls (chi2, p) and over the die faces (faceschi2,
+    facesp). Tests are NaN for an empty tally.
+    """
+    counts = _np.asarray(counts, dtype=_np.int64).reshape(6, 6)
+    rolls = int(counts.sum())
+    doubles = int(_np.trace(counts))
+    summary = {'rolls': rolls, 'doubles': doubles,
+               'doublesrate': doubles / float(rolls) if rolls else _np.nan,
+               'chi2': _np.nan, 'p': _np.nan,
+               'faceschi2': _np.nan, 'facesp': _np.nan}
+    if rolls:
+        folded = counts + counts.T
+        upper = _np.triu_indices(6)
+        # The diagonal was counted twice by the fold
+        distinct = _np.where(upper[0] == upper[1], _np.diag(counts)[
+            upper[0]], folded[upper])
+        expected = _np.where(upper[0] == upper[1], 1.0, 2.0) * rolls / 36.0
+        summary['chi2'], summary['p'] = _chi2(distinct, expected)
+        faces = counts.sum(axis=0) + counts.sum(axis=1)
+        summary['faceschi2'], summary['facesp'] = _chi2(
+            faces, _np.full(6, rolls * 2 / 6.0))
+    return summary
+
+
+class Audit(object):
+
+    """ Merged dice tallies (36 int64 counts) and luck sums (LUCK_SUM,
+    LUCK_ROLLS) per player name and per SiteId, plus corpus totals.
+    """
+
+    def __init__(self):
+        self.dice = _np.zeros(36, dtype=_np.int64)
+        self.luck = _np.zeros(2)
+        self.players = {}           # name: (dice, luck)
+        self.sites = {}             # siteid: (dice, luck)
+        self.filecount = 0
+
+    @staticmethod
+    def __addto(table, key, dice, luck):
+        if key in table:
+            table[key][0][:] += dice
+            table[key][1][:] += luck
+        else:
+            table[key] = (dice.astype(_np.int64), luck.astype(_np.float64))
+
+    def add(self, tally):
+        """Add the FileTally of one file"""
+        for player in range(2):
+            self.__addto(self.players, tally.players[player],
+                         tally.dice[player], tally.luck[player])
+        self.__addto(self.sites, tally.siteid, tally.dice.sum(axis=0),
+                     tally.luck.sum(axis=0))
+        self.dice += tally.dice.sum(axis=0)
+        self.luck += tally.luck.sum(axis=0)
+        self.filecount += 1
+
+    def merge(self, other):
+        """Add the tallies of another Audit"""
+        for table, othertable in [(self.players, other.players),
+                                  (self.sites, other.sites)]:
+            for key, (dice, luck) in othertable.items():
+                self.__addto(table, key, dice, luck)
+        self.dice += other.dice
+        self.luck += other.luck
+        self.filecount += other.filecount
+
+
+def _printsummary(out, label, dice, luck):
+    summary = summarize(dice)
+    out.write('%-30s %9d %7.4f %9.2f %7.4f %9.2f %7.4f %10.3f\n' % (
+        label[:30], summary['rolls'], summary['doublesrate'],
+        summary['chi2'], summary['p'], summary['faceschi2'],
+        summary['facesp'], luck[LUCK_SUM]))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Audit the dice and luck in XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("-s", "--source", dest="source",
+                        choices=SOURCE_NAMES, default=SOURCE_NAMES[0],
+                        help="Audit the dice of the moves or the rolls "
+                        "recorded with cube\ndecisions (Default is %s)\n"
+                        % SOURCE_NAMES[0])
+    parser.add_argument("--rolls", dest="rolls", action='store_true',
+                        help="Print the 36 outcome tally of the corpus\n")
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    audit = Audit()
+    for filename, tally, error in _xgcorpus.mapfiles(
+            _functools.partial(filetally,
+                               source=SOURCE_NAMES.index(args.source)),
+            _xgcorpus.findfiles(args.paths, skip=skip), workers=args.workers):
+        if error is not None:
+            _sys.stderr.write('%s\n' % error)
+            continue
+        audit.add(tally)
+
+    out = _sys.stdout
+    out.write('%-30s %9s %7s %9s %7s %9s %7s %10s\n' % (
+        '', 'Rolls', 'Dbl', 'Chi2(20)', 'p', 'Chi2(5)', 'p', 'Luck'))
+    _printsummary(out, 'All (%d files)' % audit.filecount, audit.dice,
+                  audit.luck)
+    for name in sorted(audit.players):
+        _printsummary(out, name, *audit.players[name])
+    for siteid in sorted(audit.sites):
+        _printsummary(out, 'SiteId %d' % siteid, *audit.sites[siteid])
+
+    if args.rolls:
+        out.write('\n    ' + ''.join(['%9d' % die for die in range(1, 7)]))
+        for die, row in enumerate(audit.dice.reshape(6, 6)):
+            out.write('\n%3d ' % (die + 1) +
+                      ''.join(['%9d' % count for count in row]))
+        out.write('\n')
@@ -0,0 +1,218 @@
+#
+#   xgdiff.py - Record level differences between two versions of a match
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   temp.xg and temp.xgr are arrays of fixed size records (2560 and 2184
+#   bytes), so two saves of the same match are compared by hashing every
+#   raw record and aligning the two lists of hashes with difflib. Runs
+#   of records replaced by the same number of records are reported as
+#   changed (analysis or rollouts added to a decision), the rest as added
+#   or removed. Only the records reported need to be decoded to bring a
+#   downstream store up to date.
+#
+
+import io as _io
+import sys as _sys
+import difflib as _difflib
+import hashlib as _hashlib
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgrollout as _xgrollout
+import xgcache as _xgcache
+
+GAMEFILE_RECSIZE = _xgstruct.MoveEntry.SIZEOFREC
+ROLLOUT_RECSIZE = _xgstruct.RolloutContextEntry.SIZEOFREC
+
+ENTRYTYPE_NAMES = ['HeaderMatch', 'HeaderGame', 'Cube', 'Move', 'FooterGame',
+                   'FooterMatch', 'Missing', 'Unimplemented']
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG diff: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def recordhashes(data, recsize):
+    """Return a list with the digest of every recsize byte record in
+    data (a trailing partial record is ignored).
+    """
+    view = memoryview(data)
+    return [_hashlib.sha1(view[start:start + recsize]).digest()
+            for start in range(0, len(data) - recsize + 1, recsize)]
+
+
+class SegmentDiff(object):
+
+    """ Differences between the records of two versions of a segment:
+    changed is a list of (old index, new index) pairs, added a list of
+    new indices and removed a list of old indices. unchanged counts the
+    records found in both.
+    """
+
+    def __init__(self):
+        self.changed = []
+        self.added = []
+        self.removed = []
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self.changed) + len(self.added) + len(self.removed)
+
+
+def diffsegment(olddata, newdata, recsize):
+    """Compare two versions of a fixed record size segment and return
+    a SegmentDiff.
+    """
+    diff = SegmentDiff()
+    oldhashes = recordhashes(olddata, recsize)
+    newhashes = recordhashes(newdata, recsize)
+    matcher = _difflib.SequenceMatcher(None, oldhashes, newhashes,
+                                       autojunk=False)
+    for tag, oldstart, oldend, newstart, newend in matcher.get_opcodes():
+        if tag == 'equal':
+            diff.unchanged += oldend - oldstart
+            continue
+        # Pair up replaced records, anything left over was added or
+        # removed
+        paired = min(oldend - oldstart, newend - newstart)
+        diff.changed.extend(zip(range(oldstart, oldstart + paired),
+                                range(newstart, newstart + paired)))
+        diff.removed.extend(range(oldstart + paired, oldend))
+        diff.added.extend(range(newstart + paired, newend))
+    return diff
+
+
+class MatchDiff(object):
+
+    """ Differences between two versions of an XG file: gamefile and
+    rollouts are the SegmentDiffs of temp.xg and temp.xgr, oldsegdata
+    and newsegdata the segments compared. sameguid tells whether both
+    files have the same GameGUID, i.e. are saves of the same match.
+    """
+
+    def __init__(self, oldsegdata, newsegdata, sameguid):
+        self.oldsegdata = oldsegdata
+        self.newsegdata = newsegdata
+        self.sameguid = sameguid
+        self.gamefile = diffsegment(
+            oldsegdata.get(_xgimport.Import.Segment.XG_GAMEFILE, b''),
+            newsegdata.get(_xgimport.Import.Segment.XG_GAMEFILE, b''),
+            GAMEFILE_RECSIZE)
+        self.rollouts = diffsegment(
+            oldsegdata.get(_xgimport.Import.Segment.XG_ROLLOUTS, b''),
+            newsegdata.get(_xgimport.Import.Segment.XG_ROLLOUTS, b''),
+            ROLLOUT_RECSIZE)
+
+    def entrytype(self, index, new=True):
+        """Return the entry type of a temp.xg record of either version"""
+        data = (self.newsegdata if new else self.oldsegdata)[
+            _xgimport.Import.Segment.XG_GAMEFILE]
+        return bytearray(data[index * GAMEFILE_RECSIZE + 8:
+                              index * GAMEFILE_RECSIZE + 9])[0]
+
+    def records(self):
+        """Generator returning (index, record) for the added and changed
+        temp.xg records of the new version, decoded, in file order.
+        """
+        cached = _xgcache.CachedFile(self.newsegdata)
+        indices = sorted(self.gamefile.added +
+                         [new for old, new in self.gamefile.changed])
+        for index in indices:
+            yield index, cached.record(index)
+
+    def rolloutrecords(self):
+        """Generator returning (index, RolloutContextEntry) for the added
+        and changed rollouts of the new version, in file order.
+        """
+        rollouts = _xgrollout.RolloutFile(stream=_io.BytesIO(
+            self.newsegdata.get(_xgimport.Import.Segment.XG_ROLLOUTS, b'')),
+            cachesize=0)
+        indices = sorted(self.rollouts.added +
+                         [new for old, new in self.rollouts.changed])
+        for index in indices:
+            yield index, rollouts.getrollout(index)
+
+
+def _guid(segdata):
+    return _xgstruct.GameDataFormatHdrRecord().fromstream(_io.BytesIO(
+        segdata[_xgimport.Import.Segment.GDF_HDR])).GameGUID
+
+
+def difffiles(oldfilename, newfilename, cache=None):
+    """Compare two XG files and return a MatchDiff. cache is an optional
+    xgcache.RecordCache to read the files through.
+    """
+    segdata = []
+    for filename in (oldfilename, newfilename):
+        if cache is not None:
+            segdata.append(cache.load(filename).segdata)
+        else:
+            segdata.append(_xgcache.readsegments(filename))
+    return MatchDiff(segdata[0], segdata[1],
+                     _guid(segdata[0]) == _guid(segdata[1]))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Show the records that differ between two versions of '
+        'an XG file',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('oldfile', metavar='OLD', type=str,
+                        help='Previous version of the XG file')
+    parser.add_argument('newfile', metavar='NEW', type=str,
+                        help='New version of the XG file')
+    args = parser.parse_args()
+
+    try:
+        diff = difffiles(args.oldfile, args.newfile)
+    except (_xgimport.Error, _xgzarc.Error) as e:
+        _sys.stderr.write('%s\n' % e.value)
+        _sys.exit(1)
+
+    if not diff.sameguid:
+        _sys.stderr.write('Warning: the files are not the same match '
+                          '(GameGUIDs differ)\n')
+
+    def typename(index, new=True):
+        entrytype = diff.entrytype(index, new)
+        if entrytype < len(ENTRYTYPE_NAMES):
+            return ENTRYTYPE_NAMES[entrytype]
+        return str(entrytype)
+
+    for old, new in diff.gamefile.changed:
+        print('changed  record %d -> %d (%s)' % (old, new, typename(new)))
+    for new in diff.gamefile.added:
+        print('added    record %d (%s)' % (new, typename(new)))
+    for old in diff.gamefile.removed:
+        print('removed  record %d (%s)' % (old, typename(old, False)))
+    for old, new in diff.rollouts.changed:
+        print('changed  rollout %d -> %d' % (old, new))
+    for new in diff.rollouts.added:
+        print('added    rollout %d' % new)
+    for old in diff.rollouts.removed:
+        print('removed  rollout %d' % old)
+    print('%d records and %d rollouts unchanged' %
+          (diff.gamefile.unchanged, diff.rollouts.unchanged))
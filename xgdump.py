@@ -0,0 +1,197 @@
+#
+#   xgdump.py - XG record output module
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import sys as _sys
+import io as _io
+import math as _math
+import json as _json
+import pprint as _pprint
+import gzip as _gzip
+import bz2 as _bz2
+
+try:
+    import lzma as _lzma
+except ImportError:
+    _lzma = None
+
+try:
+    import msgpack as _msgpack
+except ImportError:
+    _msgpack = None
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG record output: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _jsondefault(obj):
+    # Strings converted from UTF16 arrays are UTF-8 encoded bytes under
+    # Python 3.x
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8', 'replace')
+    raise TypeError("%r is not JSON serializable" % (obj,))
+
+
+def _jsonfinite(obj):
+    # JSON has no NaN or infinity (unused evaluation slots may hold
+    # them): map them to null
+    if isinstance(obj, float):
+        return obj if not (_math.isnan(obj) or _math.isinf(obj)) else None
+    if isinstance(obj, dict):
+        return dict((key, _jsonfinite(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [_jsonfinite(value) for value in obj]
+    return obj
+
+
+def _pprintlegacy(rec):
+    # The pprint output keeps the field names MoveEntry and its
+    # EngineStructBestMoveRecord had before they were fixed ('Name:' and
+    # 'Cubepos', next to a 'CubePos' that was always 0), scripts parse it
+    if rec.get('Name') != 'Move' or 'Name:' in rec:
+        return rec
+    legacy = dict(rec)
+    legacy['Name:'] = legacy.pop('Name')
+    datamoves = legacy.get('DataMoves')
+    if isinstance(datamoves, dict) and 'CubePos' in datamoves:
+        datamoves = dict(datamoves)
+        datamoves['Cubepos'] = datamoves['CubePos']
+        datamoves['CubePos'] = 0
+        legacy['DataMoves'] = datamoves
+    return legacy
+
+
+class RecordWriter(object):
+
+    """ Write decoded XG records to a file (or stdout) in one of the
+    supported FORMATS. 'jsonl' writes one JSON object per line with the
+    keys sorted so field order is stable between runs, 'msgpack' writes
+    a stream of MessagePack maps (requires the msgpack module) and
+    'pprint' is the traditional human readable output, with the field
+    names of earlier releases. NaN and infinite floats are written as
+    null in JSON Lines. Output goes
+    through a large write buffer and can be compressed on the fly.
+    """
+
+    FORMATS = ['pprint', 'jsonl']
+    if _msgpack is not None:
+        FORMATS.append('msgpack')
+
+    COMPRESSORS = {'gzip': lambda f: _gzip.GzipFile(fileobj=f, mode='wb'),
+                   'bz2': lambda f: _bz2.BZ2File(f, mode='wb')}
+    if _lzma is not None:
+        COMPRESSORS['xz'] = lambda f: _lzma.LZMAFile(f, mode='wb')
+
+    DEFAULT_BUFSIZE = 1 << 20
+
+    def __init__(self, filename=None, format='pprint', compress=None,
+                 bufsize=DEFAULT_BUFSIZE):
+        if format not in self.FORMATS:
+            raise Error("%s is not a supported output format" % format)
+        if compress is not None and compress not in self.COMPRESSORS:
+            raise Error("%s is not a supported compression" % compress)
+
+        self.filename = filename
+        self.format = format
+        # Plain pprint output to stdout goes through print so that it
+        # stays in sequence with the other messages written to stdout
+        self.__textout = filename is None and compress is None and \
+            format == 'pprint'
+        self.__rawstream = None
+        if self.__textout:
+            self.stream = None
+        else:
+            if filename is None:
+                _sys.stdout.flush()
+                stream = _io.open(_sys.stdout.fileno(), 'wb',
+                                  buffering=bufsize, closefd=False)
+            else:
+                stream = _io.open(filename, 'wb', buffering=bufsize)
+            self.__rawstream = stream
+            if compress is not None:
+                compressor = self.COMPRESSORS[compress](stream)
+                stream = _io.BufferedWriter(compressor, buffer_size=bufsize)
+            self.stream = stream
+
+        if format == 'jsonl':
+            self.__encoder = _json.JSONEncoder(
+                separators=(',', ':'), sort_keys=True, default=_jsondefault,
+                allow_nan=False)
+            self.__encode = self.__encodejson
+        elif format == 'msgpack':
+            self.__packer = _msgpack.Packer(use_bin_type=True)
+            self.__encode = self.__packer.pack
+        else:
+            self.__encode = self.__encodepprint
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __encodejson(self, rec):
+        try:
+            text = self.__encoder.encode(rec)
+        except ValueError:
+            text = self.__encoder.encode(_jsonfinite(rec))
+        return (text + '\n').encode('utf-8')
+
+    def __encodepprint(self, rec):
+        return (_pprint.pformat(_pprintlegacy(rec), width=160) +
+                '\n').encode('utf-8')
+
+    def write(self, rec):
+        """Write a single record"""
+        if self.__textout:
+            _pprint.pprint(_pprintlegacy(rec), width=160)
+        else:
+            self.stream.write(self.__encode(rec))
+
+    def writefile(self, filename):
+        """Write a marker record identifying the file the records that
+        follow were read from. Nothing is written in pprint format.
+        """
+        if self.format != 'pprint':
+            self.write({'Name': 'File', 'FileName': filename})
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def close(self):
+        # Closing the compressor flushes it but leaves the underlying
+        # file open. stdout itself is never closed.
+        if self.stream is not None:
+            if self.stream is not self.__rawstream:
+                self.stream.close()
+            self.__rawstream.close()
+            self.stream = None
+            self.__rawstream = None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,632 @@
+#
+#   xggen.py - Generate synthetic XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A MatchGenerator plays random but legal backgammon games and records
+#   them with the xgstruct writers, giving XG files of any size and
+#   version to test and benchmark the readers with. Everything is drawn
+#   from a random.Random seeded by the caller, so a seed always gives the
+#   same file.
+#
+#   Positions are kept from the point of view of the player on roll:
+#   index 1..24 are the points that player moves down towards 1, 25 is
+#   that player's bar and 0 the bar of the opponent, whose checkers are
+#   negative. Moves are (from, to) pairs of those points, 25 being the
+#   bar and 0 off, terminated by -1. Every play uses as many dice as it
+#   can (the larger one if only one of them can be used).
+#
+#   Cube decisions are recorded before every roll at which the player on
+#   roll may double, less and less often as the cube gets higher and
+#   never past MAX_MONEY_CUBE in money play. Evaluations are random but
+#   consistent: equities are derived from the outcome probabilities,
+#   candidates are sorted by equity and errors are the equity lost
+#   against the best choice. Without analysis the errors are left at
+#   -1000 (not analyzed).
+#
+#   Timed matches (clock set, file version 25 and later) get a Fischer or
+#   Bronstein TimeSetting whose clocks are reset every game. Every turn
+#   takes a random thinking time, taken off the clock of its player as
+#   the clock type says, and from version 28 every CubeEntry records
+#   both clocks at the start of its turn. Takes use the taker's clock.
+#
+
+import os as _os
+import random as _random
+import datetime as _datetime
+import uuid as _uuid
+import io as _io
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+
+MIN_VERSION = 21
+MAX_VERSION = 30
+CLOCK_VERSION = 25                  # HeaderMatchEntry.TimeSetting
+
+UNLIMITED = 99999
+NOT_ANALYZED = -1000
+ANALYSIS_LEVEL = 3
+MAX_CANDIDATES = 32
+ROLLOUT_CANDIDATES = 3
+ROLLOUT_RATE = 0.1
+ROLLOUT_GAMES = 1296
+MAX_MONEY_CUBE = 64
+
+TERMINATION_DROP = 0
+TERMINATION_RESIGN = 100
+
+# The starting position from the point of view of either player
+START_POSITION = (0, -2, 0, 0, 0, 0, 5, 0, 3, 0, 0, 0, -5,
+                  5, 0, 0, 0, -3, 0, -5, 0, 0, 0, 0, 2, 0)
+
+PLAYERS = ['Anna', 'Bart', 'Chen', 'Dora', 'Emil', 'Fumiko', 'Gustav',
+           'Hana', 'Ivo', 'Jasmin', 'Kofi', 'Lena', 'Marek', 'Nadia']
+EVENTS = ['Club Night', 'Open Championship', 'Online Session',
+          'League Round', 'Friendly']
+LOCATIONS = ['Monte Carlo', 'London', 'Copenhagen', 'Tokyo', 'Online']
+
+_RECORD = _xgstruct.GameFileRecord
+_SEGMENT = _xgimport.Import.Segment
+_TIMESETTING = _xgstruct.TimeSettingRecord
+
+CLOCKS = {'fischer': _TIMESETTING.CLOCK_FISCHER,
+          'bronstein': _TIMESETTING.CLOCK_BRONSTEIN}
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG generator: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def flip(position):
+    """Return position from the point of view of the other player"""
+    return tuple([-position[25 - point] for point in range(26)])
+
+
+def checkermoves(position, die):
+    """Generator returning (from, to, position) for every legal move of
+    a single checker of the player on roll by die.
+    """
+    if position[25] > 0:
+        sources = [25]
+    else:
+        sources = [point for point in range(24, 0, -1) if position[point] > 0]
+    bearoff = position[25] <= 0 and \
+        all(position[point] <= 0 for point in range(7, 25))
+
+    for source in sources:
+        target = source - die
+        newposition = list(position)
+        newposition[source] -= 1
+        if target >= 1:
+            if position[target] < -1:
+                continue
+            if position[target] == -1:
+                # Hit a blot
+                newposition[target] = 1
+                newposition[0] -= 1
+            else:
+                newposition[target] += 1
+        else:
+            # Bearing off with a larger die than needed is only allowed
+            # from the highest occupied point
+            if not bearoff or (target < 0 and any(
+                    position[point] > 0 for point in range(source + 1, 7))):
+                continue
+            target = 0
+        yield source, target, tuple(newposition)
+
+
+def legalplays(position, dice):
+    """Return the legal plays of the player on roll as a list of (moves,
+    position) tuples, one per distinct resulting position. moves is the
+    8 element move list. No play at all is returned as a single play
+    without moves.
+    """
+    if dice[0] == dice[1]:
+        orders = [[dice[0]] * 4]
+    else:
+        orders = [sorted(dice, reverse=True), sorted(dice)]
+
+    plays = {}
+    mostused = 0
+    for order in orders:
+        stage = {position: ()}
+        used = 0
+        for die in order:
+            nextstage = {}
+            for current, moves in stage.items():
+                for source, target, newposition in \
+                        checkermoves(current, die):
+                    if newposition not in nextstage:
+                        nextstage[newposition] = moves + (source, target)
+            if not nextstage:
+                break
+            stage = nextstage
+            used += 1
+        # With a single usable die the larger one has to be played, it
+        # is tried first
+        if used > mostused or (used == mostused and used > 1):
+            if used > mostused:
+                plays = {}
+            mostused = used
+            for newposition, moves in stage.items():
+                plays.setdefault(newposition, moves)
+
+    if not plays:
+        plays = {position: ()}
+    return [(list(moves) + [-1] * (8 - len(moves)), newposition)
+            for newposition, moves in sorted(plays.items(),
+                                             key=lambda play: play[1])]
+
+
+def _cubeowner(owner, player):
+    # Cube owner (0 centered, 1 or 2) as seen by player: 0 centered, 1
+    # owned by player, -1 owned by the opponent
+    return 0 if owner == 0 else (1 if owner == player else -1)
+
+
+def _cubepos(value, owner, player):
+    # Cube position as seen by player: +/- log2 of the cube value
+    # (positive if player owns it), 0 when centered
+    return _cubeowner(owner, player) * (value.bit_length() - 1)
+
+
+class MatchGenerator(object):
+
+    """ Generate a match (matchlength points) or a money session
+    (matchlength None) of XG file version version. games is the number
+    of games of a session and the maximum number of games of a match,
+    moves the maximum number of moves of a game after which the player
+    on roll resigns (None to play every game to the end). clock is the
+    TimeSettingRecord clock type of a timed match (CLOCK_NONE for an
+    untimed one), files older than CLOCK_VERSION are never timed.
+    """
+
+    def __init__(self, seed=None, games=1, moves=None, matchlength=None,
+                 analysis=True, rollouts=False, version=MAX_VERSION,
+                 clock=_TIMESETTING.CLOCK_NONE):
+        if not MIN_VERSION <= version <= MAX_VERSION:
+            raise Error("version must be from %d to %d" %
+                        (MIN_VERSION, MAX_VERSION))
+        self.rng = _random.Random(seed)
+        self.games = games
+        self.moves = moves
+        self.matchlength = matchlength
+        self.analysis = analysis
+        self.rollouts = rollouts and analysis
+        self.version = version
+        self.clock = clock if version >= CLOCK_VERSION else \
+            _TIMESETTING.CLOCK_NONE
+
+    def generate(self):
+        """Return the segment data of a new match, as returned by
+        xgimport.Import.getsegmentdata.
+        """
+        self.records = []
+        self.rolloutrecs = []
+        self.scores = [0, 0]
+        header = self._matchheader()
+        self._add(header)
+
+        crawforddone = False
+        for gamenumber in range(1, self.games + 1):
+            crawford = self.matchlength is not None and \
+                not crawforddone and \
+                max(self.scores) == self.matchlength - 1
+            crawforddone = crawforddone or crawford
+            self._game(gamenumber, crawford)
+            if self.matchlength is not None and \
+                    max(self.scores) >= self.matchlength:
+                break
+
+        if self.scores[0] == self.scores[1]:
+            winner = 0
+        else:
+            winner = 1 if self.scores[0] > self.scores[1] else -1
+        self._add(_xgstruct.FooterMatchEntry(
+            Score1m=self.scores[0], Score2m=self.scores[1], WinnerM=winner,
+            Elo1m=header.Elo1 + winner * 4.0,
+            Elo2m=header.Elo2 - winner * 4.0,
+            Exp1m=header.Exp1 + (self.matchlength or 1),
+            Exp2m=header.Exp2 + (self.matchlength or 1),
+            Datem=self.date + _datetime.timedelta(
+                minutes=3 * len(self.records) // 10)))
+
+        stream = _io.BytesIO()
+        for record in self.records:
+            _RECORD(version=self.version, Record=record).tostream(stream)
+        rollouts = _io.BytesIO()
+        for record in self.rolloutrecs:
+            _xgstruct.RolloutFileRecord(Record=record).tostream(rollouts)
+        return {_SEGMENT.XG_GAMEFILE: stream.getvalue(),
+                _SEGMENT.XG_ROLLOUTS: rollouts.getvalue(),
+                _SEGMENT.XG_COMMENT: b''}
+
+    def writefile(self, filename):
+        """Generate a new match and write it to the XG file filename"""
+        segdata = self.generate()
+        gdfheader = _xgstruct.GameDataFormatHdrRecord(
+            GameGUID=str(_uuid.UUID(int=self.rng.getrandbits(128),
+                                    version=4)),
+            GameName='%s vs %s' % (self.player1, self.player2),
+            SaveName=_os.path.basename(filename), LevelName='',
+            Comments='')
+        _xgimport.writesegmentdata(filename, segdata, gdfheader=gdfheader)
+
+    def _add(self, record):
+        record.Version = self.version
+        self.records.append(record)
+
+    def _matchheader(self):
+        rng = self.rng
+        self.player1, self.player2 = rng.sample(PLAYERS, 2)
+        event = rng.choice(EVENTS)
+        location = rng.choice(LOCATIONS)
+        rnd = 'Round %d' % rng.randint(1, 7)
+        self.date = _datetime.datetime(2010, 1, 1) + _datetime.timedelta(
+            seconds=rng.randrange(5 * 365 * 86400))
+        self.timesetting = _xgstruct.TimeSettingRecord()
+        if self.clock != _TIMESETTING.CLOCK_NONE:
+            gametime = rng.choice([300, 600, 900])
+            self.timesetting = _xgstruct.TimeSettingRecord(
+                ClockType=self.clock, PerGame=True, Time1=gametime,
+                Time2=rng.choice([8, 10, 12, 15]), Penalty=1,
+                TimeLeft1=gametime, TimeLeft2=gametime, PenaltyMoney=1)
+        return _xgstruct.HeaderMatchEntry(
+            version=self.version, SPlayer1=self.player1,
+            SPlayer2=self.player2, Player1=self.player1,
+            Player2=self.player2,
+            MatchLength=self.matchlength or UNLIMITED,
+            Crawford=self.matchlength is not None,
+            Jacoby=self.matchlength is None, Beaver=False,
+            Elo1=float(rng.randint(1400, 2100)),
+            Elo2=float(rng.randint(1400, 2100)),
+            Exp1=rng.randint(0, 5000), Exp2=rng.randint(0, 5000),
+            Date=self.date, SEvent=event, Event=event,
+            GameId=rng.randint(1, 0x7fffffff), SLocation=location,
+            Location=location, SRound=rnd, Round=rnd,
+            TimeSetting=self.timesetting, Transcriber='')
+
+    def _game(self, gamenumber, crawford):
+        rng = self.rng
+        self._add(_xgstruct.HeaderGameEntry(
+            Score1=self.scores[0], Score2=self.scores[1],
+            CrawfordApply=crawford, PosInit=START_POSITION,
+            GameNumber=gamenumber))
+
+        # The opening roll decides who plays first, with that roll
+        dice = rng.sample(range(1, 7), 2)
+        player = 1 if dice[0] > dice[1] else 2
+        position = START_POSITION if player == 1 else flip(START_POSITION)
+        cubevalue, cubeowner = 1, 0
+        nmoves = 0
+        self.clocks = [self.timesetting.Time1] * 2
+        while True:
+            if nmoves and not crawford and cubeowner in (0, player) and \
+                    self._cubealive(player, cubevalue):
+                dice = rng.randint(1, 6), rng.randint(1, 6)
+                doubled, taken = self._cube(player, position, cubevalue,
+                                            cubeowner, dice)
+                if doubled:
+                    self._useclock(3 - player, moved=False)
+                if doubled and not taken:
+                    winner, points, termination = \
+                        player, cubevalue, TERMINATION_DROP
+                    break
+                if doubled:
+                    cubevalue, cubeowner = cubevalue * 2, 3 - player
+            elif nmoves:
+                dice = rng.randint(1, 6), rng.randint(1, 6)
+
+            if self.moves is not None and nmoves >= self.moves:
+                # The player on roll resigns a single game
+                winner, points, termination = \
+                    3 - player, cubevalue, TERMINATION_RESIGN + 1
+                break
+
+            position = self._move(player, position, dice, cubevalue,
+                                  cubeowner, crawford)
+            self._useclock(player)
+            nmoves += 1
+            if all(count <= 0 for count in position):
+                winner = player
+                termination = self._gammons(position)
+                points = cubevalue * termination
+                if self.matchlength is None and cubevalue == 1:
+                    # Jacoby: gammons only count once the cube is turned
+                    points = cubevalue
+                break
+            player = 3 - player
+            position = flip(position)
+
+        if self.matchlength is not None:
+            # Nothing is won past the points needed to win the match
+            points = min(points,
+                         self.matchlength - self.scores[winner - 1])
+        self.scores[winner - 1] += points
+        self._add(_xgstruct.FooterGameEntry(
+            Score1g=self.scores[0], Score2g=self.scores[1],
+            CrawfordApplyg=self.matchlength is not None and not crawford and
+            max(self.scores) == self.matchlength - 1,
+            Winner=1 if winner == 1 else -1, PointsWon=points,
+            Termination=termination, ErrResign=NOT_ANALYZED,
+            ErrTakeResign=NOT_ANALYZED, Eval=(0.0,) * 7, EvalLevel=0))
+
+    def _useclock(self, player, moved=True):
+        # Take a turn's thinking time off the clock of player. A Fischer
+        # clock gets the increment back and a Bronstein clock only runs
+        # once the delay is used up, for moves.
+        if self.clock == _TIMESETTING.CLOCK_NONE:
+            return
+        seconds = int(self.rng.lognormvariate(1.8, 0.8))
+        if moved and self.clock == _TIMESETTING.CLOCK_FISCHER:
+            seconds -= self.timesetting.Time2
+        elif moved and self.clock == _TIMESETTING.CLOCK_BRONSTEIN:
+            seconds = max(seconds - self.timesetting.Time2, 0)
+        self.clocks[player - 1] = max(self.clocks[player - 1] - seconds, 0)
+
+    def _cubealive(self, player, cubevalue):
+        # In a match doubling past the points needed is pointless
+        if self.matchlength is None:
+            return cubevalue < MAX_MONEY_CUBE
+        return self.scores[player - 1] + cubevalue < self.matchlength
+
+    def _gammons(self, position):
+        # 1, 2 or 3 for a single, gammon or backgammon win, position
+        # being the winner's with all checkers borne off
+        if sum(count for count in position if count < 0) > -15:
+            return 1
+        if position[0] < 0 or any(position[point] < 0
+                                  for point in range(1, 7)):
+            return 3
+        return 2
+
+    def _evaluation(self, win=None):
+        # Outcome probabilities and cubeless equity: lose backgammon,
+        # lose gammon, lose, win, win gammon, win backgammon, equity
+        rng = self.rng
+        if win is None:
+            win = rng.betavariate(4, 4)
+        win = min(max(win, 0.0), 1.0)
+        wingammon = win * rng.uniform(0.0, 0.3)
+        winbg = wingammon * rng.uniform(0.0, 0.1)
+        losegammon = (1.0 - win) * rng.uniform(0.0, 0.3)
+        losebg = losegammon * rng.uniform(0.0, 0.1)
+        equity = 2.0 * win - 1.0 + wingammon + winbg - losegammon - losebg
+        return (losebg, losegammon, 1.0 - win, win, wingammon, winbg, equity)
+
+    def _score(self, player):
+        if self.matchlength is None:
+            return (0, 0)
+        return (self.scores[player - 1], self.scores[2 - player])
+
+    def _rollout(self, evaluation):
+        # A rollout (no double line only) ending close to evaluation:
+        # ROLLOUT_GAMES games spread over the 36 first rolls, games
+        # having a standard deviation of about one point
+        rng = self.rng
+        pergame = ROLLOUT_GAMES // 36
+        means = [evaluation[6] + rng.gauss(0.0, 0.15) for roll in range(36)]
+        stdevs = [rng.uniform(0.8, 1.2) for roll in range(36)]
+        sums = [pergame * mean for mean in means]
+        squares = [pergame * (mean * mean + stdev * stdev)
+                   for mean, stdev in zip(means, stdevs)]
+        equity = sum(sums) / (36 * pergame)
+        result = tuple([max(value + rng.gauss(0.0, 0.005), 0.0)
+                        for value in evaluation[:6]]) + (equity,)
+        self.rolloutrecs.append(_xgstruct.RolloutContextEntry(
+            Truncated=False, MinRoll=ROLLOUT_GAMES, MaxRoll=ROLLOUT_GAMES,
+            Level1=ANALYSIS_LEVEL, Level2=ANALYSIS_LEVEL,
+            Level1C=ANALYSIS_LEVEL, Level2C=ANALYSIS_LEVEL, Variance=True,
+            RandomSeed=rng.getrandbits(31), RandomSeedI=rng.getrandbits(31),
+            SearchInterval=1.0, Rolled=36 * pergame, Sum1=sums,
+            SumSquare1=squares, Stdev1=stdevs, RolledD=[pergame] * 36,
+            Error1=1.96 * sum(stdevs) / 36 / (36 * pergame) ** 0.5,
+            Result1=result, Result2=(0.0,) * 7, Mwc1=0.5 + equity / 4,
+            Mwc2=0.0,
+            PrevLevel=ANALYSIS_LEVEL, PrevEval=evaluation,
+            Duration=rng.randint(5, 120),
+            VerMaj=2, VerMin=10))
+        return len(self.rolloutrecs) - 1
+
+    def _cube(self, player, position, cubevalue, cubeowner, dice):
+        # Record a cube decision, return whether the player doubled and
+        # the opponent took
+        rng = self.rng
+        cube = _xgstruct.CubeEntry(
+            ActiveP=player, CubeB=_cubepos(cubevalue, cubeowner, player),
+            Position=position, ErrCube=NOT_ANALYZED, ErrTake=NOT_ANALYZED,
+            RolloutIndexD=-1, ErrBeaver=NOT_ANALYZED,
+            ErrRaccoon=NOT_ANALYZED, ErrTutorCube=NOT_ANALYZED,
+            ErrTutorTake=NOT_ANALYZED, TimeBot=self.clocks[0],
+            TimeTop=self.clocks[1])
+
+        # Cubeful equities in units of the current cube: doubling gives
+        # up access to the cube
+        nodouble = self._evaluation()
+        doubletake = tuple(nodouble[:6]) + (2.0 * nodouble[6] - 0.4,)
+        equb, equdouble, equdrop = nodouble[6], doubletake[6], 1.0
+        shoulddouble = min(equdouble, equdrop) > equb
+        shouldtake = equdouble <= equdrop
+        # Redoubles are rarer the higher the cube
+        cube.Double = int(rng.random() < (0.7 if shoulddouble else 0.02) /
+                          cubevalue ** 2)
+        if cube.Double:
+            cube.Take = int(rng.random() < (0.95 if shouldtake else 0.1))
+        if not cube.Double or cube.Take:
+            cube.DiceRolled = '%d%d' % dice
+
+        if self.analysis:
+            cube.Doubled = _xgstruct.EngineStructDoubleAction(
+                Pos=position, Level=ANALYSIS_LEVEL,
+                Score=self._score(player), Cube=cubevalue,
+                CubePos=_cubeowner(cubeowner, player),
+                Jacoby=int(self.matchlength is None), Crawford=0,
+                FlagDouble=int(shoulddouble), isBeaver=0, Eval=nodouble,
+                equB=equb, equDouble=equdouble, equDrop=equdrop,
+                LevelRequest=ANALYSIS_LEVEL,
+                DoubleChoice3=int(shoulddouble) + 2 * int(shouldtake),
+                EvalDouble=doubletake)
+            best = max(equb, min(equdouble, equdrop))
+            chosen = min(equdouble, equdrop) if cube.Double else equb
+            cube.ErrCube = chosen - best
+            if cube.Double:
+                # The opponent's equity is -equdouble after a take
+                cube.ErrTake = (-equdouble if cube.Take else -equdrop) - \
+                    max(-equdouble, -equdrop)
+            cube.AnalyzeC = cube.AnalyzeCR = ANALYSIS_LEVEL
+            cube.CompChoiceD = cube.Doubled.DoubleChoice3
+            if self.rollouts and rng.random() < ROLLOUT_RATE:
+                cube.RolloutIndexD = self._rollout(nodouble)
+
+        self._add(cube)
+        return bool(cube.Double), bool(cube.Take)
+
+    def _move(self, player, position, dice, cubevalue, cubeowner,
+              crawford):
+        # Record a move, return the position played
+        rng = self.rng
+        plays = legalplays(position, dice)
+        move = _xgstruct.MoveEntry(
+            PositionI=position, ActiveP=player, Dice=dice,
+            CubeA=_cubepos(cubevalue, cubeowner, player),
+            ErrMove=NOT_ANALYZED, ErrLuck=NOT_ANALYZED,
+            RolloutIndexM=(-1,) * 32, ErrTutorMove=NOT_ANALYZED,
+            DataMoves=_xgstruct.EngineStructBestMoveRecord())
+
+        if not self.analysis:
+            moves, played = rng.choice(plays)
+        else:
+            candidates = plays
+            if len(candidates) > MAX_CANDIDATES:
+                candidates = rng.sample(candidates, MAX_CANDIDATES)
+            # Candidates trail the best one by a few hundredths
+            win = rng.betavariate(4, 4)
+            evaluations = sorted([(self._evaluation(
+                win - rng.expovariate(50.0)), play) for play in candidates],
+                key=lambda candidate: -candidate[0][6])
+            # The best play most of the time, one of the next ones
+            # otherwise
+            choice = 0 if rng.random() < 0.6 else \
+                rng.randrange(min(len(evaluations), 4))
+            moves, played = evaluations[choice][1]
+
+            move.NMoveEval = len(evaluations)
+            move.DataMoves = _xgstruct.EngineStructBestMoveRecord(
+                Pos=position, Dice=dice, Level=ANALYSIS_LEVEL,
+                Score=self._score(player), Cube=cubevalue,
+                CubePos=_cubeowner(cubeowner, player),
+                Crawford=int(crawford),
+                Jacoby=int(self.matchlength is None),
+                NMoves=len(evaluations),
+                PosPlayed=[play[1] for evaluation, play in evaluations],
+                Moves=[play[0] for evaluation, play in evaluations],
+                EvalLevel=[_xgstruct.EvalLevelRecord(Level=ANALYSIS_LEVEL)
+                           for evaluation in evaluations],
+                Eval=[evaluation for evaluation, play in evaluations])
+            move.ErrMove = evaluations[choice][0][6] - evaluations[0][0][6]
+            move.ErrLuck = rng.gauss(0.0, 0.1)
+            move.InitEq = evaluations[0][0][6] - move.ErrLuck
+            move.CompChoice = 0
+            move.AnalyzeM = move.AnalyzeL = ANALYSIS_LEVEL
+            move.Tutor = choice
+            if self.rollouts and rng.random() < ROLLOUT_RATE:
+                move.RolloutIndexM = tuple([
+                    self._rollout(evaluation) for evaluation, play in
+                    evaluations[:ROLLOUT_CANDIDATES]]) + \
+                    (-1,) * (32 - min(len(evaluations), ROLLOUT_CANDIDATES))
+
+        move.Moves = moves
+        move.PositionEnd = move.PositionTutor = played
+        move.Played = True
+        self._add(move)
+        return played
+
+
+def _version(value):
+    # argparse type for the file version: a number or 'mixed'
+    if value == 'mixed':
+        return value
+    version = int(value)
+    if not MIN_VERSION <= version <= MAX_VERSION:
+        raise ValueError(value)
+    return version
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic XG files of random matches',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-c", metavar='COUNT', dest="count", type=int,
+                        help="Number of files to generate (Default 1)\n",
+                        default=1)
+    parser.add_argument("-n", metavar='GAMES', dest="games", type=int,
+                        help="Games per session, or at most per match "
+                        "(Default 7)\n", default=7)
+    parser.add_argument("-m", metavar='MOVES', dest="moves", type=int,
+                        help="Resign games after MOVES moves "
+                        "(Default play them out)\n", default=None)
+    parser.add_argument("-l", metavar='LENGTH', dest="matchlength",
+                        type=int, help="Play LENGTH point matches "
+                        "(Default money sessions)\n", default=None)
+    parser.add_argument("-f", metavar='VERSION', dest="version",
+                        type=_version,
+                        help="XG file version from %d to %d, or 'mixed' "
+                        "for a random one\nper file (Default %d)\n" %
+                        (MIN_VERSION, MAX_VERSION, MAX_VERSION),
+                        default=MAX_VERSION)
+    parser.add_argument("-s", metavar='SEED', dest="seed", type=int,
+                        help="Random seed, file i uses SEED+i (Default 0)\n",
+                        default=0)
+    parser.add_argument("--no-analysis", dest="analysis",
+                        action='store_false',
+                        help="Don't record an analysis\n")
+    parser.add_argument("-r", "--rollouts", dest="rollouts",
+                        action='store_true',
+                        help="Roll out some of the analyzed decisions\n")
+    parser.add_argument("-t", "--clock", dest="clock",
+                        choices=sorted(CLOCKS),
+                        help="Play timed matches with this clock (version "
+                        "%d and later,\nclock readings from version 28)\n"
+                        % CLOCK_VERSION, default=None)
+    parser.add_argument('outdir', metavar='DIR', type=str,
+                        help='Directory to write the files to')
+    args = parser.parse_args()
+
+    if not _os.path.isdir(args.outdir):
+        _os.makedirs(args.outdir)
+    for index in range(args.count):
+        seed = args.seed + index
+        version = args.version
+        if version == 'mixed':
+            version = _random.Random(seed).randint(MIN_VERSION, MAX_VERSION)
+        filename = _os.path.join(args.outdir, 'synthetic%05d.xg' % seed)
+        MatchGenerator(seed=seed, games=args.games, moves=args.moves,
+                       matchlength=args.matchlength, analysis=args.analysis,
+                       rollouts=args.rollouts, version=version,
+                       clock=CLOCKS.get(args.clock,
+                                        _TIMESETTING.CLOCK_NONE)
+                       ).writefile(filename)
+        print(filename)
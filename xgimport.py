@@ -19,13 +19,16 @@
 #
 
 from __future__ import with_statement as _with
+import io as _io
 import tempfile as _tempfile
 import shutil as _shutil
 import struct as _struct
 import os as _os
+import timeit as _timeit
 import xgutils as _xgutils
 import xgzarc as _xgzarc
 import xgstruct as _xgstruct
+import xgmetrics as _xgmetrics
 
 
 class Import(object):
@@ -49,6 +52,7 @@ class Import(object):
             self.filename = None
             self.fd = None
             self.file = None
+            self.stats = None
             self.type = type
             self.__prefix = prefix
             self.__autodelete = delete
@@ -78,29 +82,81 @@ class Import(object):
         def copyto(self, fileto):
             _shutil.copy(self.filename, fileto)
 
+        def records(self):
+            """Generator returning the decoded records of a game file or
+            rollout segment. The file version found in the match header
+            is propagated to the records that follow it. Unimplemented
+            record types are skipped.
+            """
+            self.fd.seek(0, _os.SEEK_SET)
+            if self.type == Import.Segment.XG_GAMEFILE:
+                fileversion = -1
+                while True:
+                    rec = _xgstruct.GameFileRecord(
+                            version=fileversion,
+                            stats=self.stats).fromstream(self.fd)
+                    if rec is None:
+                        break
+                    if isinstance(rec, _xgstruct.HeaderMatchEntry):
+                        fileversion = rec.Version
+                    elif isinstance(rec, _xgstruct.UnimplementedEntry):
+                        continue
+                    yield rec
+            elif self.type == Import.Segment.XG_ROLLOUTS:
+                while True:
+                    rec = _xgstruct.RolloutFileRecord(
+                            stats=self.stats).fromstream(self.fd)
+                    if rec is None:
+                        break
+                    yield rec
+
         def createtempfile(self, mode="w+b"):
             self.fd, self.filename = _tempfile.mkstemp(prefix=self.__prefix)
             self.file = _os.fdopen(self.fd, mode)
             return self
 
-    def __init__(self, filename):
+    def __init__(self, filename, stats=None):
+        """ Import the XG file filename. stats, if given, receives the
+        time spent in each stage and the records decoded (see
+        xgmetrics).
+        """
         self.filename = filename
+        self.stats = stats
+
+    def __readgdfheader(self, xginfile):
+        # Read the Game Data Header (GDH)
+        if self.stats is not None:
+            start = _timeit.default_timer()
+        gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(xginfile)
+        if gdfheader is None:
+            raise Error("Not a game data format file", self.filename)
+        if self.stats is not None:
+            self.stats.stage(_xgmetrics.STAGE_GDFHEADER,
+                             _timeit.default_timer() - start,
+                             gdfheader.HeaderSize)
+        return gdfheader
+
+    def __writesegment(self, segment, data):
+        # Write data to the temporary file of segment
+        if self.stats is not None:
+            start = _timeit.default_timer()
+        segment.file.write(data)
+        segment.file.flush()
+        if self.stats is not None:
+            self.stats.stage(_xgmetrics.STAGE_TEMPFILE,
+                             _timeit.default_timer() - start, len(data))
 
     def getfilesegment(self):
         with open(self.filename, "rb") as xginfile:
             # Extract the uncompressed Game Data Header (GDH)
             # Note: MS Windows Vista feature
-            gdfheader = \
-                    _xgstruct.GameDataFormatHdrRecord().fromstream(xginfile)
-            if gdfheader is None:
-                raise Error("Not a game data format file", self.filename)
-            
+            gdfheader = self.__readgdfheader(xginfile)
+
             # Extract the Game Format Header to a temporary file
             with Import.Segment(type=Import.Segment.GDF_HDR) as segment:
                 xginfile.seek(0)
                 block = xginfile.read(gdfheader.HeaderSize)
-                segment.file.write(block)
-                segment.file.flush()
+                self.__writesegment(segment, block)
                 yield segment
 
             # Extract the uncompressed thumbnail JPEG from the GDF hdr
@@ -108,12 +164,11 @@ class Import(object):
                 with Import.Segment(type=Import.Segment.GDF_IMAGE) as segment:
                     xginfile.seek(gdfheader.ThumbnailOffset, _os.SEEK_CUR)
                     imgbuf = xginfile.read(gdfheader.ThumbnailSize)
-                    segment.file.write(imgbuf)
-                    segment.file.flush()
+                    self.__writesegment(segment, imgbuf)
                     yield segment
 
             # Retrieve an archive object from the stream
-            archiveobj = _xgzarc.ZlibArchive(xginfile)
+            archiveobj = _xgzarc.ZlibArchive(xginfile, stats=self.stats)
 
             # Process all the files in the archive
             for filerec in archiveobj.arcregistry:
@@ -127,6 +182,7 @@ class Import(object):
                                                 delete=False)
                 xg_filesegment.filename = seg_filename
                 xg_filesegment.fd = segment_file
+                xg_filesegment.stats = self.stats
 
                 # If we are looking at the game info file then check 
                 # the magic number to ensure it is valid
@@ -143,6 +199,120 @@ class Import(object):
 
         return
 
+    def getsegmentdata(self, segtypes):
+        """Return a dictionary mapping each of the archived segment types
+        in segtypes (XG_GAMEHDR, XG_GAMEFILE, XG_ROLLOUTS, XG_COMMENT) to
+        the segment's data. Only the requested segments are inflated.
+        """
+        segdata = {}
+        with open(self.filename, "rb") as xginfile:
+            self.__readgdfheader(xginfile)
+
+            archiveobj = _xgzarc.ZlibArchive(xginfile, stats=self.stats)
+            for filerec in archiveobj.arcregistry:
+                xg_filetype = Import.Segment.XG_FILEMAP[filerec.name]
+                if xg_filetype not in segtypes:
+                    continue
+
+                segment_file, seg_filename = \
+                    archiveobj.getarchivefile(filerec)
+                if self.stats is not None:
+                    start = _timeit.default_timer()
+                try:
+                    data = segment_file.read()
+                finally:
+                    segment_file.close()
+                    _os.unlink(seg_filename)
+                if self.stats is not None:
+                    self.stats.stage(_xgmetrics.STAGE_TEMPFILE,
+                                     _timeit.default_timer() - start,
+                                     len(data))
+
+                if xg_filetype == Import.Segment.XG_GAMEFILE:
+                    magicStr = bytearray(data[
+                        Import.Segment.XG_GAMEHDR_LEN:
+                        Import.Segment.XG_GAMEHDR_LEN + 4]).decode('ascii',
+                                                                   'replace')
+                    if magicStr != 'DMLI':
+                        raise Error("Not a valid XG gamefile", self.filename)
+
+                segdata[xg_filetype] = data
+
+        return segdata
+
+
+def decodematchheader(data):
+    """Return the HeaderMatchEntry at the start of data (a temp.xgi or
+    temp.xg segment) or None if data doesn't start with one. temp.xgi
+    only holds the first XG_GAMEHDR_LEN bytes of the record: the fields
+    past them (unicode names, SiteId, time setting, ...) decode as zeros
+    and empty strings.
+    """
+    if len(data) < Import.Segment.XG_GAMEHDR_LEN or \
+            bytearray(data[8:9])[0] != \
+            _xgstruct.GameFileRecord.ENTRYTYPE_HEADERMATCH:
+        return None
+    data = data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]
+    data += b'\0' * (_xgstruct.HeaderMatchEntry.SIZEOFREC - len(data))
+    return _xgstruct.HeaderMatchEntry().fromstream(_io.BytesIO(data))
+
+
+def readcompactsegment(filename, stats=None):
+    """Return the game file or rollout segment written to filename in the
+    compact frame format (see xgstruct.CompactFrameFile and
+    extractxgdata --compact). The segment's fd is an in memory file
+    holding the original segment data, so records() decodes it as usual.
+    """
+    with open(filename, "rb") as compactfile:
+        try:
+            compact = _xgstruct.CompactFrameFile().fromstream(compactfile)
+        except ValueError as e:
+            raise Error(e, filename)
+    if compact is None:
+        raise Error("Not a compact frame file", filename)
+    if compact.RecSize == _xgstruct.MoveEntry.SIZEOFREC:
+        segtype = Import.Segment.XG_GAMEFILE
+    elif compact.RecSize == _xgstruct.RolloutContextEntry.SIZEOFREC:
+        segtype = Import.Segment.XG_ROLLOUTS
+    else:
+        raise Error("Not a game file or rollout segment", filename)
+    segment = Import.Segment(type=segtype, delete=False)
+    segment.fd = _io.BytesIO(compact.Data)
+    segment.stats = stats
+    return segment
+
+
+def writesegmentdata(filename, segdata, gdfheader=None, thumbnail=b''):
+    """Write an XG file from segdata, a dictionary mapping segment types
+    (XG_GAMEHDR, XG_GAMEFILE, XG_ROLLOUTS, XG_COMMENT) to the segment's
+    data as returned by Import.getsegmentdata. gdfheader is the
+    GameDataFormatHdrRecord to write (a new one if None) and thumbnail
+    the JPEG data that follows it. A missing game header segment is made
+    of the first and last record of the game file, like XG does.
+    """
+    if Import.Segment.XG_GAMEFILE not in segdata:
+        raise Error("No game file to write", filename)
+    gamefile = segdata[Import.Segment.XG_GAMEFILE]
+    gamehdr = segdata.get(Import.Segment.XG_GAMEHDR)
+    if gamehdr is None:
+        recsize = _xgstruct.HeaderMatchEntry.SIZEOFREC
+        gamehdr = gamefile[:recsize] + gamefile[-recsize:]
+
+    if gdfheader is None:
+        gdfheader = _xgstruct.GameDataFormatHdrRecord()
+    gdfheader.HeaderSize = _xgstruct.GameDataFormatHdrRecord.SIZEOFREC
+    gdfheader.ThumbnailOffset = 0
+    gdfheader.ThumbnailSize = len(thumbnail)
+
+    files = [('temp.xgi', gamehdr),
+             ('temp.xgr', segdata.get(Import.Segment.XG_ROLLOUTS, b'')),
+             ('temp.xgc', segdata.get(Import.Segment.XG_COMMENT, b'')),
+             ('temp.xg', gamefile)]
+    with open(filename, "wb") as xgoutfile:
+        gdfheader.tostream(xgoutfile)
+        xgoutfile.write(thumbnail)
+        _xgzarc.writearchive(xgoutfile, files)
+
 
 class Error(Exception):
 
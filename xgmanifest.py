@@ -0,0 +1,251 @@
+#
+#   xgmanifest.py - Change detection for incremental processing of XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A manifest records, for every processed XG file, its modification
+#   time, size, archive CRC (from the ZlibArchive trailer) and the GUID
+#   of its game data format header. scan compares a directory tree with
+#   the manifest:
+#
+#     unchanged  same size and archive CRC; costs a stat and a read of
+#                the 36 byte trailer
+#     changed    a known path whose size or archive CRC differs
+#     new        an unknown path
+#     renamed    an unknown path with the size, CRC and GUID of a known
+#                path that has disappeared
+#     deleted    a known path below the scanned paths that has gone
+#
+#   Only new and changed files need processing. The manifest is a JSON
+#   file, rewritten atomically by save.
+#
+
+import os as _os
+import json as _json
+import tempfile as _tempfile
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+import xgcorpus as _xgcorpus
+
+MANIFEST_VERSION = 1
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG manifest: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def filestate(filename, guid=True):
+    """Return the manifest state of an XG file: a dictionary with its
+    mtime, size, crc (archive CRC) and, if guid is set, guid (the
+    GameGUID of its game data format header).
+    """
+    with open(filename, 'rb') as xgfile:
+        st = _os.fstat(xgfile.fileno())
+        state = {'mtime': st.st_mtime, 'size': st.st_size,
+                 'crc': _xgzarc.readarchiverecord(xgfile).crc}
+        if guid:
+            gdfheader = _xgstruct.GameDataFormatHdrRecord().fromstream(xgfile)
+            if gdfheader is None:
+                raise _xgimport.Error("Not a game data format file",
+                                      filename)
+            state['guid'] = gdfheader.GameGUID
+    return state
+
+
+class Changes(object):
+
+    """ Result of Manifest.scan. new, changed and unchanged are lists
+    of paths, renamed a list of (old path, new path) and deleted a list
+    of the paths that disappeared. states maps the new, changed and
+    renamed paths to their file states, and errors lists (path, message)
+    for the files that couldn't be read.
+    """
+
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.unchanged = []
+        self.renamed = []
+        self.deleted = []
+        self.states = {}
+        self.errors = []
+
+    def toprocess(self):
+        """Return the paths that need processing"""
+        return self.new + self.changed
+
+
+class Manifest(object):
+
+    """ The manifest kept in filename. Paths are stored absolute. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        if _os.path.exists(filename):
+            with open(filename) as manifestfile:
+                manifest = _json.load(manifestfile)
+            if manifest.get('version') != MANIFEST_VERSION:
+                raise Error("%s: unsupported manifest version" % filename)
+            self.files = manifest['files']
+
+    def save(self):
+        """Write the manifest, replacing the previous one atomically"""
+        directory = _os.path.dirname(_os.path.abspath(self.filename))
+        fd, tmpname = _tempfile.mkstemp(prefix='tmpXGM', dir=directory)
+        try:
+            with _os.fdopen(fd, 'w') as manifestfile:
+                _json.dump({'version': MANIFEST_VERSION,
+                            'files': self.files}, manifestfile,
+                           sort_keys=True, separators=(',', ':'))
+            _xgutils.replacefile(tmpname, self.filename)
+        except:
+            _os.unlink(tmpname)
+            raise
+
+    def update(self, filename, state=None):
+        """Record filename as processed, with its current state unless
+        one is given.
+        """
+        if state is None:
+            state = filestate(filename)
+        self.files[_os.path.abspath(filename)] = state
+
+    def remove(self, filename):
+        self.files.pop(_os.path.abspath(filename), None)
+
+    def rename(self, oldname, newname):
+        self.files[_os.path.abspath(newname)] = \
+            self.files.pop(_os.path.abspath(oldname))
+
+    def scan(self, paths):
+        """Compare the XG files in paths (files or directories searched
+        recursively) with the manifest and return the Changes. The
+        manifest itself is left unchanged.
+        """
+        changes = Changes()
+        seen = set()
+        unknown = []
+        for filename in _xgcorpus.findfiles(paths):
+            path = _os.path.abspath(filename)
+            seen.add(path)
+            known = self.files.get(path)
+            try:
+                state = filestate(filename, guid=False)
+            except _xgcorpus.FILE_ERRORS as e:
+                changes.errors.append((filename, getattr(e, 'value',
+                                                         str(e))))
+                continue
+            if known is None:
+                unknown.append((filename, state))
+            elif known['size'] == state['size'] and \
+                    known['crc'] == state['crc']:
+                changes.unchanged.append(filename)
+            else:
+                try:
+                    state = filestate(filename)
+                except _xgcorpus.FILE_ERRORS as e:
+                    changes.errors.append((filename, getattr(e, 'value',
+                                                             str(e))))
+                    continue
+                changes.changed.append(filename)
+                changes.states[filename] = state
+
+        # Known paths below the scanned paths that weren't found
+        roots = [_os.path.abspath(path) for path in paths]
+        missing = [path for path in self.files if path not in seen and
+                   any(path == root or path.startswith(
+                       _os.path.join(root, '')) for root in roots)]
+        byidentity = {}
+        for path in missing:
+            known = self.files[path]
+            byidentity.setdefault((known['size'], known['crc'],
+                                   known.get('guid')), []).append(path)
+
+        for filename, state in unknown:
+            try:
+                state = filestate(filename)
+            except _xgcorpus.FILE_ERRORS as e:
+                changes.errors.append((filename, getattr(e, 'value',
+                                                         str(e))))
+                continue
+            changes.states[filename] = state
+            candidates = byidentity.get((state['size'], state['crc'],
+                                         state['guid']))
+            if candidates:
+                changes.renamed.append((candidates.pop(0), filename))
+            else:
+                changes.new.append(filename)
+
+        renamed = set(oldpath for oldpath, newpath in changes.renamed)
+        changes.deleted = sorted(path for path in missing
+                                 if path not in renamed)
+        return changes
+
+    def apply(self, changes):
+        """Record the renames and deletions found by scan. New and
+        changed files are recorded with update once processed.
+        """
+        for oldpath, newpath in changes.renamed:
+            self.rename(oldpath, newpath)
+            self.files[_os.path.abspath(newpath)].update(
+                changes.states[newpath])
+        for path in changes.deleted:
+            self.remove(path)
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Show the XG files that changed since a manifest was '
+        'last updated',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-u", "--update", dest="update", action='store_true',
+                        help="Record the current state in the manifest\n")
+    parser.add_argument('manifest', metavar='MANIFEST', type=str,
+                        help='Manifest file')
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+
+    manifest = Manifest(args.manifest)
+    changes = manifest.scan(args.paths)
+    for label, paths in [('new', changes.new), ('changed', changes.changed),
+                         ('deleted', changes.deleted)]:
+        for path in paths:
+            print('%-9s %s' % (label, path))
+    for oldpath, newpath in changes.renamed:
+        print('%-9s %s -> %s' % ('renamed', oldpath, newpath))
+    for path, error in changes.errors:
+        sys.stderr.write('%s: %s\n' % (path, error))
+    print('%d unchanged' % len(changes.unchanged))
+
+    if args.update:
+        manifest.apply(changes)
+        for filename in changes.toprocess():
+            manifest.update(filename, changes.states[filename])
+        manifest.save()
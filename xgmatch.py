@@ -0,0 +1,321 @@
+#
+#   xgmatch.py - Compact in memory model of an XG match or session
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Decoding a whole temp.xg into xgstruct records costs several KB of
+#   Python dictionaries, tuples and floats per 2560 byte frame. A Match
+#   instead keeps the inflated temp.xg as one bytes object plus a few
+#   array columns built in a single pass:
+#
+#     entrytypes   the entry type of every record
+#     recordgames  the game (0 based) each record belongs to, -1 for
+#                  the match header and footer
+#     recordsoftype the record numbers of each entry type
+#     columns      per entry type, the fields in COLUMNS (scores, dice,
+#                  errors, ...) as arrays, one value per record of the type
+#
+#   Everything else is decoded on demand: a RecordView is a small handle
+#   on one record that reads its columns directly and decodes the
+#   xgstruct record only when asked. Player, event, location and round
+#   names are interned so the matches of a session share them.
+#
+
+import sys as _sys
+import array as _array
+import struct as _struct
+import io as _io
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgzarc as _xgzarc
+import xgstruct as _xgstruct
+
+FRAMESIZE = _xgstruct.MoveEntry.SIZEOFREC
+ENTRYTYPE_OFFSET = 8
+NOGAME = -1
+
+_RECORD = _xgstruct.GameFileRecord
+
+# Columns kept per entry type: (name, struct/array type code, offset)
+COLUMNS = {
+    _RECORD.ENTRYTYPE_HEADERGAME: [
+        ('Score1', 'i', 12), ('Score2', 'i', 16),
+        ('CrawfordApply', 'B', 20), ('GameNumber', 'i', 48)],
+    _RECORD.ENTRYTYPE_CUBE: [
+        ('ActiveP', 'i', 12), ('Double', 'i', 16), ('Take', 'i', 20),
+        ('BeaverR', 'i', 24), ('RaccoonR', 'i', 28), ('CubeB', 'i', 32),
+        ('ErrCube', 'd', 200), ('ErrTake', 'd', 216)],
+    _RECORD.ENTRYTYPE_MOVE: [
+        ('ActiveP', 'i', 64), ('Dice1', 'i', 100), ('Dice2', 'i', 104),
+        ('ErrMove', 'd', 2312), ('ErrLuck', 'd', 2320),
+        ('CompChoice', 'i', 2328)],
+    _RECORD.ENTRYTYPE_FOOTERGAME: [
+        ('Score1g', 'i', 12), ('Score2g', 'i', 16), ('Winner', 'i', 24),
+        ('PointsWon', 'i', 28), ('Termination', 'i', 32),
+        ('ErrResign', 'd', 40), ('ErrTakeResign', 'd', 48)],
+    }
+
+_intern = getattr(_sys, 'intern', None) or intern
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG match: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _columnstruct(columns):
+    # One struct reading every column of a frame, padding the gaps
+    fmt = '<'
+    pos = 0
+    for name, code, offset in sorted(columns, key=lambda column: column[2]):
+        fmt += '%dx%s' % (offset - pos, code)
+        pos = offset + _struct.calcsize('<' + code)
+    return _struct.Struct(fmt)
+
+
+_STRUCTS = dict((entrytype, _columnstruct(columns))
+                for entrytype, columns in COLUMNS.items())
+# Column names in the order the structs return them
+_ORDER = dict((entrytype, [name for name, code, offset in
+                           sorted(columns, key=lambda column: column[2])])
+              for entrytype, columns in COLUMNS.items())
+
+
+class RecordView(object):
+
+    """ Handle on the index'th record of a Match. Columns are read with
+    view[name]; decode() returns the full xgstruct record.
+    """
+
+    __slots__ = ('match', 'index')
+
+    def __init__(self, match, index):
+        self.match = match
+        self.index = index
+
+    @property
+    def entrytype(self):
+        return self.match.entrytypes[self.index]
+
+    @property
+    def game(self):
+        return self.match.recordgames[self.index]
+
+    @property
+    def raw(self):
+        """The frame as a memoryview of the match data"""
+        start = self.index * FRAMESIZE
+        return memoryview(self.match.data)[start:start + FRAMESIZE]
+
+    def __getitem__(self, name):
+        entrytype = self.entrytype
+        column = self.match.columns.get(entrytype, {}).get(name)
+        if column is None:
+            return self.decode()[name]
+        return column[self.match.typeindex[self.index]]
+
+    def decode(self):
+        return self.match.decode(self.index)
+
+    def __repr__(self):
+        return '<RecordView %d type %d game %d>' % (
+            self.index, self.entrytype, self.game)
+
+
+class Game(object):
+
+    """ The records start to stop (exclusive) of the ordinal'th game of a
+    Match, from its game header to its game footer.
+    """
+
+    __slots__ = ('match', 'ordinal', 'start', 'stop')
+
+    def __init__(self, match, ordinal, start, stop):
+        self.match = match
+        self.ordinal = ordinal
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        for index in range(self.start, self.stop):
+            yield RecordView(self.match, index)
+
+    def records(self, entrytype=None):
+        """Generator returning the RecordViews of the game, only those of
+        entrytype if given.
+        """
+        for index in range(self.start, self.stop):
+            if entrytype is None or self.match.entrytypes[index] == entrytype:
+                yield RecordView(self.match, index)
+
+    @property
+    def number(self):
+        """The GameNumber of the game header"""
+        return RecordView(self.match, self.start)['GameNumber']
+
+
+class Match(object):
+
+    """ A match (or money session) loaded from the raw temp.xg data. See
+    the module comment for the columns built; data is kept as is and
+    records are decoded from it on demand.
+    """
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        count = len(self.data) // FRAMESIZE
+        self.entrytypes = _array.array(
+            'B', bytearray(self.data[ENTRYTYPE_OFFSET:count * FRAMESIZE:
+                                     FRAMESIZE]))
+        # Position of every record among the records of its type
+        self.typeindex = _array.array('i', [0]) * count
+        self.recordgames = _array.array('i', [NOGAME]) * count
+        self.recordsoftype = dict((entrytype, _array.array('i'))
+                                  for entrytype in range(8))
+        self.columns = dict((entrytype, dict(
+            (name, _array.array(code)) for name, code, offset in columns))
+            for entrytype, columns in COLUMNS.items())
+        self.gamebounds = []
+
+        game = NOGAME
+        for index in range(count):
+            entrytype = self.entrytypes[index]
+            if entrytype == _RECORD.ENTRYTYPE_HEADERGAME:
+                game += 1
+                self.gamebounds.append([index, count])
+            elif entrytype == _RECORD.ENTRYTYPE_FOOTERGAME and \
+                    game != NOGAME:
+                self.gamebounds[game][1] = index + 1
+            if entrytype not in (_RECORD.ENTRYTYPE_HEADERMATCH,
+                                 _RECORD.ENTRYTYPE_FOOTERMATCH):
+                self.recordgames[index] = game
+            oftype = self.recordsoftype.setdefault(entrytype,
+                                                   _array.array('i'))
+            self.typeindex[index] = len(oftype)
+            oftype.append(index)
+            if entrytype in _STRUCTS:
+                values = _STRUCTS[entrytype].unpack_from(self.data,
+                                                         index * FRAMESIZE)
+                columns = self.columns[entrytype]
+                for name, value in zip(_ORDER[entrytype], values):
+                    columns[name].append(value)
+
+        header = self.decode(0) if count else None
+        if not isinstance(header, _xgstruct.HeaderMatchEntry):
+            raise Error("temp.xg doesn't start with a match header")
+        self.version = header.Version
+        text = _xgutils.utf8bytestostr
+        self.player1 = _intern(text(header.Player1 or header.SPlayer1))
+        self.player2 = _intern(text(header.Player2 or header.SPlayer2))
+        self.event = _intern(text(header.Event or header.SEvent))
+        self.location = _intern(text(header.Location or header.SLocation))
+        self.round = _intern(text(header.Round or header.SRound))
+        self.matchlength = header.MatchLength
+        self.date = header.Date
+
+    @classmethod
+    def fromfile(cls, filename):
+        """Load the match of an XG file"""
+        segdata = _xgimport.Import(filename).getsegmentdata(
+            [_xgimport.Import.Segment.XG_GAMEFILE])
+        if _xgimport.Import.Segment.XG_GAMEFILE not in segdata:
+            raise _xgimport.Error("No game file in archive", filename)
+        return cls(segdata[_xgimport.Import.Segment.XG_GAMEFILE])
+
+    def __len__(self):
+        return len(self.entrytypes)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield RecordView(self, index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return RecordView(self, index)
+
+    def decode(self, index):
+        """Decode and return the index'th record as an xgstruct record"""
+        start = index * FRAMESIZE
+        version = getattr(self, 'version', -1)
+        return _RECORD(version=version).fromstream(
+            _io.BytesIO(self.data[start:start + FRAMESIZE]))
+
+    def gamecount(self):
+        return len(self.gamebounds)
+
+    def game(self, ordinal):
+        start, stop = self.gamebounds[ordinal]
+        return Game(self, ordinal, start, stop)
+
+    def games(self):
+        """Generator returning the Games in order"""
+        for ordinal in range(len(self.gamebounds)):
+            yield self.game(ordinal)
+
+    def records(self, entrytype):
+        """Generator returning the RecordViews of one entry type"""
+        for index in self.recordsoftype.get(entrytype, ()):
+            yield RecordView(self, index)
+
+    def column(self, entrytype, name):
+        """Return the array of a column (see COLUMNS) with one value per
+        record of entrytype, in record order.
+        """
+        return self.columns[entrytype][name]
+
+    def memorysize(self):
+        """Return the approximate number of bytes held by the match"""
+        arrays = [self.entrytypes, self.typeindex, self.recordgames]
+        arrays.extend(self.recordsoftype.values())
+        for columns in self.columns.values():
+            arrays.extend(columns.values())
+        return len(self.data) + \
+            sum(len(a) * a.itemsize for a in arrays) + \
+            len(self.gamebounds) * 2 * 8
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Summarize XG files with the compact match model',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('files', metavar='FILE', type=str, nargs='+',
+                        help='An XG files to load')
+    args = parser.parse_args()
+
+    for filename in args.files:
+        try:
+            match = Match.fromfile(filename)
+        except (_xgimport.Error, _xgzarc.Error, Error) as e:
+            _sys.stderr.write('%s\n' % e.value)
+            continue
+        print('%s: %s vs %s, %d games, %d records, %d bytes held '
+              '(%d inflated)' % (filename, match.player1, match.player2,
+                                 match.gamecount(), len(match),
+                                 match.memorysize(), len(match.data)))
@@ -0,0 +1,379 @@
+#
+#   xgmemory.py - Memory footprint of decoded XG records
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   The records of XG files are decoded and kept, the way a process
+#   holding matches keeps them, and the memory they retain is measured
+#   two ways:
+#
+#   Deep size: every object reachable from the records is counted once
+#   with sys.getsizeof and charged to the record that holds it. Nested
+#   records (EngineStructBestMoveRecord in MoveEntry.DataMoves,
+#   EngineStructDoubleAction in CubeEntry.Doubled, TimeSettingRecord in
+#   HeaderMatchEntry.TimeSetting) are charged to their own type. The
+#   bytes are split into the categories of CATEGORIES: the record dict
+#   itself, its keys, numbers, strings, arrays (the tuples and lists and
+#   what they hold) and anything else. An object shared by several
+#   records (the key strings, small ints, None) is charged only to the
+#   first one found.
+#
+#   Traced: with tracemalloc (Python 3.4+), the growth of the allocated
+#   memory while decoding, by the code that allocated it: the xgstruct
+#   class whose method did, or the module for code outside of xgstruct.
+#   This includes what the deep size can't see, like allocator overhead
+#   and the list holding the records.
+#
+#   Without files a match generated by xggen from a fixed seed is used,
+#   so the numbers only change when the representation of the records
+#   does. The results can be saved and given as a baseline to a later
+#   run, which then fails when the bytes per record of a type grew more
+#   than the threshold allows.
+#
+
+import gc as _gc
+import os as _os
+import sys as _sys
+import json as _json
+import time as _time
+import inspect as _inspect
+import platform as _platform
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgcache as _xgcache
+import xgcorpus as _xgcorpus
+import xggen as _xggen
+
+try:
+    import tracemalloc as _tracemalloc
+except ImportError:
+    _tracemalloc = None
+
+try:
+    _NUMBERTYPES = (bool, int, long, float)
+    _STRINGTYPES = (str, bytes, unicode)
+except NameError:
+    _NUMBERTYPES = (bool, int, float)
+    _STRINGTYPES = (str, bytes)
+
+CATEGORY_DICT, CATEGORY_KEY, CATEGORY_NUMBER, CATEGORY_STRING, \
+    CATEGORY_ARRAY, CATEGORY_OTHER = CATEGORIES = \
+    ['dict', 'key', 'number', 'string', 'array', 'other']
+
+DEFAULT_THRESHOLD = 0.05
+SEED = 0
+TRACED_TOTAL = 'traced total'
+
+_SEGMENT = _xgimport.Import.Segment
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG memory: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _isrecord(obj):
+    return isinstance(obj, dict) and \
+        type(obj).__module__ == _xgstruct.__name__
+
+
+def _category(value):
+    if isinstance(value, _NUMBERTYPES) or value is None:
+        return CATEGORY_NUMBER
+    if isinstance(value, _STRINGTYPES):
+        return CATEGORY_STRING
+    if isinstance(value, (tuple, list)):
+        return CATEGORY_ARRAY
+    return CATEGORY_OTHER
+
+
+def deepsizes(records):
+    """Return {record type: {'count': records, 'bytes': total,
+    'categories': {category: bytes}}} of the objects reachable from
+    records, see the deep size above.
+    """
+    types = {}
+    seen = set()
+
+    def charge(owner, category, size):
+        types[owner]['categories'][category] = \
+            types[owner]['categories'].get(category, 0) + size
+        types[owner]['bytes'] += size
+
+    # Walk with a stack: arrays of arrays can be deep enough to make a
+    # recursive walk costly
+    stack = [(record, None, None) for record in reversed(records)]
+    while stack:
+        obj, owner, category = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size = _sys.getsizeof(obj)
+        if _isrecord(obj):
+            owner = type(obj).__name__
+            if owner not in types:
+                types[owner] = {'count': 0, 'bytes': 0, 'categories': {}}
+            types[owner]['count'] += 1
+            charge(owner, CATEGORY_DICT, size)
+            for key, value in obj.items():
+                stack.append((key, owner, CATEGORY_KEY))
+                stack.append((value, owner, _category(value)))
+        elif isinstance(obj, (tuple, list, dict)):
+            charge(owner, category, size)
+            items = obj.items() if isinstance(obj, dict) else obj
+            for item in items:
+                # What an array holds is part of the array
+                stack.append((item, owner, category))
+        else:
+            charge(owner, category, size)
+    return types
+
+
+def _allocators():
+    # (first line, last line, name) of every class in xgstruct
+    allocators = []
+    for name, cls in _inspect.getmembers(_xgstruct, _inspect.isclass):
+        if cls.__module__ != _xgstruct.__name__:
+            continue
+        lines, first = _inspect.getsourcelines(cls)
+        allocators.append((first, first + len(lines) - 1, name))
+    return allocators
+
+
+def traced(func):
+    """Call func under tracemalloc and return its result and a
+    dictionary of the bytes allocated while it ran and still allocated
+    after: 'bytes', the total, and 'sites', the bytes by xgstruct class
+    or module that allocated them. The dictionary is None without
+    tracemalloc.
+    """
+    if _tracemalloc is None:
+        return func(), None
+    xgstructfile = _os.path.splitext(_xgstruct.__file__)[0]
+    allocators = _allocators()
+
+    def site(frame):
+        filename = _os.path.splitext(frame.filename)[0]
+        if filename == xgstructfile:
+            for first, last, name in allocators:
+                if first <= frame.lineno <= last:
+                    return name
+        return _os.path.basename(filename)
+
+    wastracing = _tracemalloc.is_tracing()
+    if not wastracing:
+        _tracemalloc.start(1)
+    try:
+        _gc.collect()
+        before = _tracemalloc.take_snapshot()
+        result = func()
+        _gc.collect()
+        after = _tracemalloc.take_snapshot()
+    finally:
+        if not wastracing:
+            _tracemalloc.stop()
+
+    sites = {}
+    for diff in after.compare_to(before, 'lineno'):
+        if diff.size_diff:
+            name = site(diff.traceback[0])
+            sites[name] = sites.get(name, 0) + diff.size_diff
+    return result, {'bytes': sum(sites.values()), 'sites': sites}
+
+
+def readsegments(filename):
+    """Return the game file and rollout segments of an XG file"""
+    return _xgimport.Import(filename).getsegmentdata(
+        [_SEGMENT.XG_GAMEFILE, _SEGMENT.XG_ROLLOUTS])
+
+
+def generatesegments(seed=SEED):
+    """Return the segments of the fixed match used without files"""
+    return _xggen.MatchGenerator(seed=seed, games=4,
+                                 rollouts=True).generate()
+
+
+def decode(segdatas):
+    """Return the list of all the game file and rollout records of
+    segdatas, a list of segment dictionaries.
+    """
+    records = []
+    for segdata in segdatas:
+        cached = _xgcache.CachedFile(segdata)
+        records.extend(cached.records())
+        records.extend(cached.rollouts())
+    return records
+
+
+def profile(segdatas, trace=True):
+    """Decode segdatas and return the memory they retain as a dictionary
+    that can be saved with saveresults: 'records', the number of
+    records, 'types', see deepsizes, 'categories', the bytes by category
+    of all the types, and 'traced', see traced (None without trace).
+    """
+    if trace:
+        records, tracedsizes = traced(lambda: decode(segdatas))
+    else:
+        records, tracedsizes = decode(segdatas), None
+    types = deepsizes(records)
+    categories = {}
+    for sizes in types.values():
+        for category, size in sizes['categories'].items():
+            categories[category] = categories.get(category, 0) + size
+    return {'python': _platform.python_version(),
+            'implementation': _platform.python_implementation(),
+            'date': _time.strftime('%Y-%m-%d %H:%M:%S'),
+            'records': len(records), 'types': types,
+            'categories': categories, 'traced': tracedsizes}
+
+
+def saveresults(filename, results):
+    with open(filename, 'w') as resultfile:
+        _json.dump(results, resultfile, indent=1, sort_keys=True)
+
+
+def loadresults(filename):
+    try:
+        with open(filename) as resultfile:
+            results = _json.load(resultfile)
+    except ValueError as e:
+        raise Error("%s isn't a memory profile: %s" % (filename, e))
+    if 'types' not in results:
+        raise Error("%s isn't a memory profile" % filename)
+    return results
+
+
+def perrecord(results):
+    """Return {record type: bytes per record} of results, with the
+    traced bytes per decoded record as TRACED_TOTAL if they were traced.
+    """
+    sizes = dict((name, float(sizes['bytes']) / sizes['count'])
+                 for name, sizes in results['types'].items())
+    if results.get('traced') is not None and results['records']:
+        sizes[TRACED_TOTAL] = \
+            float(results['traced']['bytes']) / results['records']
+    return sizes
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare the bytes per record of results with baseline (both as
+    returned by profile) and return a list of (name, bytes, baseline
+    bytes, change, regressed) tuples for the record types found in
+    both. change is the relative change, regressed is True if it is
+    above threshold.
+    """
+    current = perrecord(results)
+    previous = perrecord(baseline)
+    comparison = []
+    for name in sorted(current):
+        if name not in previous:
+            continue
+        change = current[name] / previous[name] - 1.0 \
+            if previous[name] else 0.0
+        comparison.append((name, current[name], previous[name], change,
+                           change > threshold))
+    return comparison
+
+
+def report(results):
+    """Return results as a text table"""
+    lines = ['%-28s %7s %10s %8s' % ('Record type', 'Count', 'Bytes',
+                                      'Per rec') +
+             ''.join(' %8s' % category for category in CATEGORIES)]
+    for name in sorted(results['types']):
+        sizes = results['types'][name]
+        lines.append('%-28s %7d %10d %8.0f' % (
+            name, sizes['count'], sizes['bytes'],
+            float(sizes['bytes']) / sizes['count']) +
+            ''.join(' %8d' % sizes['categories'].get(category, 0)
+                    for category in CATEGORIES))
+    lines.append('%-28s %7d %10d %8.0f' % (
+        'all', results['records'], sum(results['categories'].values()),
+        float(sum(results['categories'].values())) /
+        (results['records'] or 1)) +
+        ''.join(' %8d' % results['categories'].get(category, 0)
+                for category in CATEGORIES))
+
+    if results['traced'] is not None:
+        lines.append('')
+        lines.append('%-28s %10s' % ('Traced allocations', 'Bytes'))
+        sites = results['traced']['sites']
+        for name in sorted(sites, key=lambda name: -sites[name]):
+            lines.append('%-28s %10d' % (name, sites[name]))
+        lines.append('%-28s %10d' % ('total', results['traced']['bytes']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Report the memory retained by the decoded records of '
+        'XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-o", metavar='FILE', dest="output",
+                        help="Save the results as JSON to FILE\n",
+                        default=None)
+    parser.add_argument("-b", metavar='FILE', dest="baseline",
+                        help="Compare with the results saved in FILE\n",
+                        default=None)
+    parser.add_argument("--threshold", metavar='PERCENT', dest="threshold",
+                        type=float, help="Growth of the bytes per record "
+                        "reported as a regression\n(Default %d)\n" %
+                        (DEFAULT_THRESHOLD * 100),
+                        default=DEFAULT_THRESHOLD * 100)
+    parser.add_argument("--no-trace", dest="trace", action='store_false',
+                        help="Don't trace the allocations with "
+                        "tracemalloc\n")
+    parser.add_argument('files', metavar='FILE', type=str, nargs='*',
+                        help='XG files to decode (Default a generated '
+                        'match)')
+    args = parser.parse_args()
+
+    try:
+        baseline = loadresults(args.baseline) if args.baseline else None
+        if args.files:
+            segdatas = [readsegments(filename) for filename in args.files]
+        else:
+            segdatas = [generatesegments()]
+    except _xgcorpus.FILE_ERRORS + (Error,) as e:
+        _sys.stderr.write('%s\n' % getattr(e, 'value', e))
+        _sys.exit(2)
+
+    results = profile(segdatas, trace=args.trace)
+    print(report(results))
+    if args.output is not None:
+        saveresults(args.output, results)
+
+    if baseline is not None:
+        comparison = compare(results, baseline, args.threshold / 100.0)
+        print('\n%-28s %10s %10s %8s' % ('Against baseline', 'Per rec',
+                                         'Baseline', 'Change'))
+        for name, current, previous, change, regressed in comparison:
+            print('%-28s %10.0f %10.0f %+7.1f%%%s' % (
+                name, current, previous, change * 100,
+                ' REGRESSION' if regressed else ''))
+        regressions = sum(1 for entry in comparison if entry[4])
+        if regressions:
+            print('%d of %d record types grew by more than %g%%' %
+                  (regressions, len(comparison), args.threshold))
+            _sys.exit(1)
@@ -0,0 +1,166 @@
+#
+#   xgmetrics.py - Per stage statistics of reading XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   xgimport.Import, xgzarc.ZlibArchive and the xgstruct GameFileRecord
+#   and RolloutFileRecord take an optional stats object. Without one
+#   (the default) nothing is timed. With one, they call
+#
+#     stats.stage(name, seconds, nbytes)
+#         for every timed operation of a stage: STAGE_GDFHEADER,
+#         STAGE_ARCHIVECRC, STAGE_INDEX, STAGE_INFLATE, STAGE_TEMPFILE
+#         or STAGE_CRC
+#     stats.record(entrytype, seconds, nbytes)
+#         for every record decoded, entrytype being the name of its
+#         class (MoveEntry, CubeEntry, ...)
+#
+#   Stats below collects them. Any object with these two methods can
+#   be given instead, to forward them elsewhere.
+#
+
+import os as _os
+import tempfile as _tempfile
+import xgutils as _xgutils
+
+STAGE_GDFHEADER = 'gdfheader'      # reading the game data format header
+STAGE_ARCHIVECRC = 'archivecrc'    # CRC of the whole archive
+STAGE_INDEX = 'index'              # parsing the archive file index
+STAGE_INFLATE = 'inflate'          # inflating archived files
+STAGE_TEMPFILE = 'tempfile'        # writing and reading temp files
+STAGE_CRC = 'crc'                  # CRC of every inflated file
+
+STAGES = [STAGE_GDFHEADER, STAGE_ARCHIVECRC, STAGE_INDEX, STAGE_INFLATE,
+          STAGE_TEMPFILE, STAGE_CRC]
+
+METRIC_PREFIX = 'xg'
+
+
+class Stats(object):
+
+    """ Totals of the operations, seconds and bytes of every stage and of
+    the count, seconds and bytes of the decoded records by entry type.
+    Stats can be pickled, so the Stats of worker processes can be sent
+    back and added up with update.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.records = {}
+
+    def stage(self, name, seconds, nbytes=0):
+        totals = self.stages.get(name)
+        if totals is None:
+            totals = self.stages[name] = [0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += nbytes
+
+    def record(self, entrytype, seconds, nbytes=0):
+        totals = self.records.get(entrytype)
+        if totals is None:
+            totals = self.records[entrytype] = [0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += nbytes
+
+    def update(self, other):
+        """Add the totals of the Stats other"""
+        for mine, theirs in [(self.stages, other.stages),
+                             (self.records, other.records)]:
+            for name, (count, seconds, nbytes) in theirs.items():
+                totals = mine.setdefault(name, [0, 0.0, 0])
+                totals[0] += count
+                totals[1] += seconds
+                totals[2] += nbytes
+
+    def seconds(self):
+        """Return the total time of all the stages and records"""
+        return sum(totals[1] for totals in self.stages.values()) + \
+            sum(totals[1] for totals in self.records.values())
+
+    def report(self):
+        """Return the totals as a text table"""
+        total = self.seconds() or 1.0
+        lines = ['%-22s %10s %10s %6s %12s %10s' % (
+            'Stage', 'Count', 'Seconds', '%', 'Bytes', 'MB/s')]
+
+        def line(name, count, seconds, nbytes):
+            lines.append('%-22s %10d %10.4f %6.1f %12d %10s' % (
+                name, count, seconds, 100.0 * seconds / total, nbytes,
+                '%.2f' % (nbytes / seconds / 1e6) if seconds else '-'))
+
+        for name in sorted(self.stages, key=lambda name: (
+                STAGES.index(name) if name in STAGES else len(STAGES),
+                name)):
+            line(name, *self.stages[name])
+        if self.records:
+            line('decode', *[sum(totals[i] for totals in
+                                 self.records.values()) for i in range(3)])
+            for entrytype in sorted(self.records):
+                line('  ' + entrytype, *self.records[entrytype])
+        return '\n'.join(lines)
+
+    def prometheus(self, prefix=METRIC_PREFIX):
+        """Return the totals as counters in the Prometheus text format"""
+        lines = []
+
+        def counters(name, help, label, totals, column):
+            metric = '%s_%s' % (prefix, name)
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s counter' % metric)
+            for key in sorted(totals):
+                lines.append('%s{%s="%s"} %r' % (
+                    metric, label, key, totals[key][column]))
+
+        counters('stage_operations_total', 'Timed operations by stage',
+                 'stage', self.stages, 0)
+        counters('stage_seconds_total', 'Seconds spent by stage',
+                 'stage', self.stages, 1)
+        counters('stage_bytes_total', 'Bytes processed by stage',
+                 'stage', self.stages, 2)
+        counters('records_total', 'Records decoded by entry type',
+                 'entrytype', self.records, 0)
+        counters('record_seconds_total',
+                 'Seconds spent decoding records by entry type',
+                 'entrytype', self.records, 1)
+        counters('record_bytes_total',
+                 'Bytes of records decoded by entry type',
+                 'entrytype', self.records, 2)
+        return '\n'.join(lines) + '\n'
+
+    def writeprometheus(self, filename, prefix=METRIC_PREFIX):
+        """Write the totals to filename in the Prometheus text format.
+        The file is replaced at once, so a node exporter reading the
+        directory never sees it half written.
+        """
+        directory = _os.path.dirname(_os.path.abspath(filename))
+        fd, tmpname = _tempfile.mkstemp(prefix='tmpXGM', dir=directory)
+        try:
+            with _os.fdopen(fd, 'w') as promfile:
+                promfile.write(self.prometheus(prefix))
+            # mkstemp makes the file private to us, the exporter must be
+            # able to read it
+            _os.chmod(tmpname, 0o644)
+            _xgutils.replacefile(tmpname, filename)
+        except:
+            _os.unlink(tmpname)
+            raise
+
+
+if __name__ == '__main__':
+    pass
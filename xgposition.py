@@ -0,0 +1,313 @@
+#
+#   xgposition.py - Compact position keys and a corpus position index
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   XG stores a position as 26 signed bytes: index 1..24 are the points
+#   seen from the player whose checkers are positive, 25 is that
+#   player's bar and 0 is the bar of the opponent (negative checkers).
+#
+#   Position keys use the gnubg position key layout: for the opponent
+#   and then the player, walk the 24 points and the bar (from that
+#   side's own ace point) writing one 1 bit per checker followed by a 0
+#   bit. The 80 bits are packed least significant bit first into 10
+#   bytes, and the gnubg position ID is that key base64 encoded without
+#   padding. The key describes the array as stored, so the same
+#   position recorded from the other side of the board has the
+#   mirrored key.
+#
+
+import os as _os
+import sys as _sys
+import base64 as _base64
+import sqlite3 as _sqlite3
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgarray as _xgarray
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+KEYSIZE = 10
+KEYBITS = KEYSIZE * 8
+
+# An encoding can't have 80 bits set, so this marks positions that
+# can't be encoded (more than 15 checkers on a side)
+INVALID_KEY = b'\xff' * KEYSIZE
+
+# Where a position came from
+SOURCE_POSINIT, SOURCE_POSITIONI, SOURCE_POSITIONEND, SOURCE_BESTMOVE, \
+    SOURCE_CUBE = range(5)
+SOURCE_NAMES = ['HeaderGameEntry.PosInit', 'MoveEntry.PositionI',
+                'MoveEntry.PositionEnd', 'EngineStructBestMoveRecord.Pos',
+                'CubeEntry.Position']
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG position index: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def positionkeys(positions):
+    """Encode an (n, 26) array of XG positions into an (n, 10) uint8
+    array of position keys. Rows that can't be encoded are set to
+    INVALID_KEY.
+    """
+    if _np is None:
+        raise Error("numpy is required")
+    positions = _np.asarray(positions, dtype=_np.int8).reshape(-1, 26)
+    npos = len(positions)
+
+    # Checkers per slot: the opponent's points from its ace point up
+    # and its bar, then the player's points and bar
+    counts = _np.empty((npos, 50), dtype=_np.int32)
+    counts[:, 0:24] = -_np.minimum(positions[:, 24:0:-1], 0)
+    counts[:, 24] = -_np.minimum(positions[:, 0], 0)
+    counts[:, 25:49] = _np.maximum(positions[:, 1:25], 0)
+    counts[:, 49] = _np.maximum(positions[:, 25], 0)
+
+    # Bit position of the first 1 of each slot
+    starts = _np.cumsum(counts + 1, axis=1) - (counts + 1)
+    valid = (counts[:, :25].sum(axis=1) <= 15) & \
+        (counts[:, 25:].sum(axis=1) <= 15)
+
+    bits = _np.zeros((npos, KEYBITS), dtype=_np.uint8)
+    rows = _np.arange(npos)[:, _np.newaxis]
+    for checker in range(int(counts.max()) if npos else 0):
+        mask = (counts > checker) & valid[:, _np.newaxis]
+        bitpos = _np.where(mask, starts + checker, 0)
+        bits[_np.broadcast_to(rows, mask.shape)[mask], bitpos[mask]] = 1
+
+    keys = _np.packbits(bits, axis=1, bitorder='little')
+    keys[~valid] = 0xff
+    return keys
+
+
+def positionkey(position):
+    """Return the 10 byte key of a single 26 element XG position"""
+    return positionkeys([position])[0].tobytes()
+
+
+def keytoid(key):
+    """Convert a position key to a gnubg style position ID string"""
+    return _base64.b64encode(bytes(key)).decode('ascii').rstrip('=')
+
+
+def idtokey(positionid):
+    """Convert a gnubg style position ID string to a position key"""
+    key = _base64.b64decode(positionid + '=' * (-len(positionid) % 4))
+    if len(key) != KEYSIZE:
+        raise Error("%s is not a valid position ID" % positionid)
+    return key
+
+
+def extractpositions(filename):
+    """Return the keys, game numbers, record numbers and sources of all
+    the positions in an XG file as arrays. The record number is the
+    index of the 2560 byte record in temp.xg.
+    """
+    data = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE]).get(
+        _xgimport.Import.Segment.XG_GAMEFILE, b'')
+    rawframes = _xgarray.frames(data)
+    entrytypes = rawframes[:, _xgarray.ENTRYTYPE_OFFSET]
+    games = _xgarray.gamenumbers(data)
+
+    parts = []
+    for entrytype, dtype, fields in [
+            (_xgstruct.GameFileRecord.ENTRYTYPE_HEADERGAME,
+             _xgarray.HEADERGAME_DTYPE, [('PosInit', SOURCE_POSINIT)]),
+            (_xgstruct.GameFileRecord.ENTRYTYPE_MOVE,
+             _xgarray.MOVEENTRY_DTYPE,
+             [('PositionI', SOURCE_POSITIONI),
+              ('PositionEnd', SOURCE_POSITIONEND),
+              (('DataMoves', 'Pos'), SOURCE_BESTMOVE)]),
+            (_xgstruct.GameFileRecord.ENTRYTYPE_CUBE,
+             _xgarray.CUBEENTRY_DTYPE, [('Position', SOURCE_CUBE)])]:
+        recnums = _np.nonzero(entrytypes == entrytype)[0]
+        recs = rawframes[recnums].copy().view(dtype).reshape(-1)
+        for field, source in fields:
+            if isinstance(field, tuple):
+                positions = recs[field[0]][field[1]]
+            else:
+                positions = recs[field]
+            parts.append((positions, recnums,
+                          _np.full(len(recnums), source, dtype=_np.int8)))
+
+    positions = _np.concatenate([part[0] for part in parts])
+    recnums = _np.concatenate([part[1] for part in parts])
+    sources = _np.concatenate([part[2] for part in parts])
+    keys = positionkeys(positions)
+    valid = (keys != 0xff).any(axis=1)
+    return keys[valid], games[recnums][valid], recnums[valid], sources[valid]
+
+
+class PositionIndex(object):
+
+    """ SQLite index mapping position keys to the file, game and record
+    they occur in. Files are indexed incrementally: a file is only
+    (re)read when its size or modification time has changed since it
+    was last indexed.
+    """
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.conn = _sqlite3.connect(dbname, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                          'file_id INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+                          'mtime REAL, size INTEGER)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS positions ('
+                          'key BLOB, file_id INTEGER, game INTEGER, '
+                          'record INTEGER, source INTEGER)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def stale(self, filenames):
+        """Generator returning the files in filenames that aren't
+        indexed or have changed since they were indexed.
+        """
+        for filename in filenames:
+            path = _os.path.abspath(filename)
+            st = _os.stat(path)
+            row = self.conn.execute('SELECT mtime, size FROM files '
+                                    'WHERE path = ?', (path,)).fetchone()
+            if row is None or row[0] != st.st_mtime or row[1] != st.st_size:
+                yield filename
+
+    def update(self, filename, positions):
+        """Replace the index entries of filename with positions, the
+        arrays returned by extractpositions.
+        """
+        path = _os.path.abspath(filename)
+        st = _os.stat(path)
+        keys, games, recnums, sources = positions
+        self.conn.execute('BEGIN')
+        try:
+            self.__remove(path)
+            fileid = self.conn.execute(
+                'INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)',
+                (path, st.st_mtime, st.st_size)).lastrowid
+            self.conn.executemany(
+                'INSERT INTO positions VALUES (?, ?, ?, ?, ?)',
+                [(_sqlite3.Binary(key.tobytes()), fileid, int(game),
+                  int(recnum), int(source)) for key, game, recnum, source in
+                 zip(keys, games, recnums, sources)])
+            self.conn.execute('COMMIT')
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def __remove(self, path):
+        row = self.conn.execute('SELECT file_id FROM files WHERE path = ?',
+                                (path,)).fetchone()
+        if row is not None:
+            self.conn.execute('DELETE FROM positions WHERE file_id = ?', row)
+            self.conn.execute('DELETE FROM files WHERE file_id = ?', row)
+
+    def prune(self):
+        """Remove the entries of indexed files that no longer exist"""
+        paths = [row[0] for row in self.conn.execute('SELECT path FROM files')]
+        for path in paths:
+            if not _os.path.exists(path):
+                self.__remove(path)
+
+    def createindexes(self):
+        self.conn.execute('CREATE INDEX IF NOT EXISTS positions_key '
+                          'ON positions (key)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS positions_file '
+                          'ON positions (file_id)')
+
+    def lookup(self, key):
+        """Return a list of (path, game, record, source) tuples for every
+        occurrence of the position key.
+        """
+        return self.conn.execute(
+            'SELECT files.path, game, record, source FROM positions '
+            'JOIN files USING (file_id) WHERE key = ? '
+            'ORDER BY files.path, record', (_sqlite3.Binary(key),)
+            ).fetchall()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Build or query an index of the positions in XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("--prune", dest="prune", action='store_true',
+                        help="Drop index entries of files that no longer "
+                        "exist\n")
+    parser.add_argument('database', metavar='DB', type=str,
+                        help='SQLite index database')
+    parser.add_argument('command', choices=['build', 'query'],
+                        help='build: index the XG files in PATH\n'
+                        'query: find the positions IDs given as PATH\n')
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='*',
+                        help='XG files or directories, or position IDs')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    with PositionIndex(args.database) as index:
+        if args.command == 'build':
+            if args.prune:
+                index.prune()
+            # Create the indexes up front so an interrupted build still
+            # leaves a usable database
+            index.createindexes()
+            filenames = list(index.stale(
+                _xgcorpus.findfiles(args.paths, skip=skip)))
+            count = 0
+            for filename, positions, error in _xgcorpus.mapfiles(
+                    extractpositions, filenames, workers=args.workers):
+                if error is not None:
+                    _sys.stderr.write('%s\n' % error)
+                    continue
+                index.update(filename, positions)
+                count += len(positions[0])
+            print('Indexed %d positions from %d files' %
+                  (count, len(filenames)))
+        else:
+            for positionid in args.paths:
+                for path, game, record, source in \
+                        index.lookup(idtokey(positionid)):
+                    print('%s\t%s\tgame %d\trecord %d\t%s' %
+                          (positionid, path, game, record,
+                           SOURCE_NAMES[source]))
@@ -0,0 +1,113 @@
+#
+#   xgrollout.py - XG rollout segment (temp.xgr) module
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   temp.xgr is an array of fixed size (2184 byte) TRolloutContext
+#   records. MoveEntry.RolloutIndexM and CubeEntry.RolloutIndexD are
+#   indices into that array.
+#
+
+import collections as _collections
+import os as _os
+import xgstruct as _xgstruct
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG rollout file: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class RolloutFile(object):
+
+    """ Random access to the rollouts in a temp.xgr stream. A rollout is
+    decoded only when it is requested by index. The most recently used
+    rollouts are kept in a small LRU cache since several moves or cube
+    decisions may refer to the same rollout. Cached entries are shared
+    between callers and shouldn't be modified.
+    """
+
+    DEFAULT_CACHESIZE = 64
+
+    def __init__(self, stream=None, filename=None,
+                 cachesize=DEFAULT_CACHESIZE):
+        self.filename = filename
+        self.stream = stream
+        self.__ownstream = stream is None
+        if stream is None:
+            self.stream = open(filename, 'rb')
+
+        self.__cache = _collections.OrderedDict()
+        self.__cachesize = cachesize
+
+        curstreampos = self.stream.tell()
+        self.stream.seek(0, _os.SEEK_END)
+        self.__numrecs = \
+            self.stream.tell() // _xgstruct.RolloutContextEntry.SIZEOFREC
+        self.stream.seek(curstreampos, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.__cache.clear()
+        if self.__ownstream and self.stream is not None:
+            self.stream.close()
+        self.stream = None
+
+    def __len__(self):
+        return self.__numrecs
+
+    def getrollout(self, index):
+        """Return the RolloutContextEntry at index. Return None for a
+        negative index (no rollout) and raise an Error if the index is
+        past the end of the file.
+        """
+        if index is None or index < 0:
+            return None
+        if index >= self.__numrecs:
+            raise Error("Rollout index %d out of range" % index)
+
+        cache = self.__cache
+        rec = cache.pop(index, None)
+        if rec is None:
+            self.stream.seek(index * _xgstruct.RolloutContextEntry.SIZEOFREC)
+            rec = _xgstruct.RolloutContextEntry().fromstream(self.stream)
+            if len(cache) >= self.__cachesize > 0:
+                cache.popitem(last=False)
+        if self.__cachesize > 0:
+            cache[index] = rec
+        return rec
+
+    def __getitem__(self, index):
+        return self.getrollout(index)
+
+    def __iter__(self):
+        for index in range(self.__numrecs):
+            yield self.getrollout(index)
+
+
+if __name__ == '__main__':
+    pass
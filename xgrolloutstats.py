@@ -0,0 +1,268 @@
+#
+#   xgrolloutstats.py - Batch statistics and merging of XG rollouts
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   A rollout (xgarray.ROLLOUT_DTYPE) keeps, for each of its 37 first
+#   roll slots, the number of games rolled (RolledD) and the sum and sum
+#   of squares of their equities, for the no double line (Sum1,
+#   SumSquare1) and the double/take line (Sum2, SumSquare2). Everything
+#   here works on (n, 37) arrays of those fields so thousands of
+#   rollouts are handled in a few array operations.
+#
+#   Two estimates are derived from the slots:
+#
+#     pooled      every game weighs the same: total sum / total games
+#     stratified  every slot that was rolled weighs the same, the
+#                 estimate of a rollout with dice rotation
+#
+#   Confidence intervals are 95% (1.96 standard errors) of the mean.
+#   Partial rollouts of the same position are merged by adding their
+#   sums, squares and game counts.
+#
+
+import sys as _sys
+import xgimport as _xgimport
+import xgarray as _xgarray
+import xgposition as _xgposition
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+SLOTS = 37
+Z95 = 1.959963984540054
+
+LINE_ND, LINE_DT = 1, 2
+
+# Fields added together when rollouts are merged
+SUMMED_FIELDS = ['Rolled', 'Rolled2', 'Sum1', 'SumSquare1', 'Sum2',
+                 'SumSquare2', 'RolledD', 'Duration']
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG rollout statistics: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def slotstats(sums, sumsquares, counts):
+    """Return the per slot mean, variance (sample), standard deviation
+    and 95% confidence interval of the mean as a dictionary of arrays
+    shaped like the (n, 37) inputs. Slots with fewer than two games have
+    a NaN variance; slots without games a NaN mean.
+    """
+    sums = _np.asarray(sums, dtype=_np.float64)
+    sumsquares = _np.asarray(sumsquares, dtype=_np.float64)
+    counts = _np.asarray(counts, dtype=_np.float64)
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        mean = _np.where(counts > 0, sums / counts, _np.nan)
+        variance = _np.where(counts > 1, (sumsquares - sums * mean) /
+                             (counts - 1), _np.nan)
+        # Rounding can make the variance of a constant slot negative
+        variance = _np.maximum(variance, 0.0)
+        stdev = _np.sqrt(variance)
+        ci = Z95 * stdev / _np.sqrt(counts)
+    return {'mean': mean, 'variance': variance, 'stdev': stdev, 'ci': ci}
+
+
+def estimates(sums, sumsquares, counts):
+    """Return the pooled and stratified estimates of (n, 37) slot arrays
+    as a dictionary of (n,) arrays: pooled, pooledci, stratified,
+    stratifiedci and games.
+    """
+    sums = _np.asarray(sums, dtype=_np.float64)
+    sumsquares = _np.asarray(sumsquares, dtype=_np.float64)
+    counts = _np.asarray(counts, dtype=_np.float64)
+    games = counts.sum(axis=-1)
+    pooled = slotstats(sums.sum(axis=-1), sumsquares.sum(axis=-1), games)
+
+    slots = slotstats(sums, sumsquares, counts)
+    rolled = counts > 0
+    nslots = rolled.sum(axis=-1)
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        stratified = _np.where(rolled, slots['mean'], 0.0).sum(axis=-1) / \
+            nslots
+        # Var(sum w_i mean_i) = sum w_i^2 var_i / n_i with w_i = 1/nslots
+        # (slots with a single game have no variance estimate and are
+        # left out of the interval)
+        slotvar = _np.where(counts > 1, slots['variance'] / counts, 0.0)
+        stratifiedci = Z95 * _np.sqrt(slotvar.sum(axis=-1)) / nslots
+    return {'pooled': pooled['mean'], 'pooledci': pooled['ci'],
+            'stratified': stratified, 'stratifiedci': stratifiedci,
+            'games': games}
+
+
+def rolloutstats(rollouts, line=LINE_ND):
+    """Return the slot statistics (see slotstats) and estimates (see
+    estimates) of a line of an array of ROLLOUT_DTYPE in one dictionary.
+    """
+    suffix = str(line)
+    sums = rollouts['Sum' + suffix]
+    sumsquares = rollouts['SumSquare' + suffix]
+    counts = rollouts['RolledD']
+    result = {'slots': slotstats(sums, sumsquares, counts)}
+    result.update(estimates(sums, sumsquares, counts))
+    return result
+
+
+def merge(rollouts, keys):
+    """Merge the rollouts that share a key. keys is an (n,) array or an
+    (n, k) array whose rows are keys. Returns the unique keys and an
+    array of ROLLOUT_DTYPE with one merged rollout per key: the fields
+    in SUMMED_FIELDS are added, the others are taken from the first
+    rollout of the key. Stdev1 and Stdev2 are recomputed from the
+    merged sums.
+    """
+    keys = _np.asarray(keys)
+    axis = 0 if keys.ndim > 1 else None
+    unique, first, inverse = _np.unique(keys, axis=axis, return_index=True,
+                                        return_inverse=True)
+    inverse = inverse.reshape(-1)
+    merged = _np.array(rollouts[first], dtype=_xgarray.ROLLOUT_DTYPE)
+    for name in SUMMED_FIELDS:
+        total = _np.zeros(merged[name].shape, dtype=_np.float64)
+        _np.add.at(total, inverse, rollouts[name])
+        merged[name] = total
+    for line in (LINE_ND, LINE_DT):
+        merged['Stdev%d' % line] = _np.nan_to_num(slotstats(
+            merged['Sum%d' % line], merged['SumSquare%d' % line],
+            merged['RolledD'])['stdev'])
+    return unique, merged
+
+
+def rank(equities, cis, groups):
+    """Rank the candidates of each group (e.g. the candidate moves of a
+    position) by equity, best first. Returns for every candidate its
+    rank in its group, its equity loss to the best candidate of the
+    group and whether that loss is within the combined 95% confidence
+    intervals of the two (i.e. the rollouts don't separate them).
+    """
+    equities = _np.asarray(equities, dtype=_np.float64)
+    cis = _np.asarray(cis, dtype=_np.float64)
+    groups = _np.asarray(groups)
+    _, groupindex = _np.unique(groups, axis=0 if groups.ndim > 1 else None,
+                               return_inverse=True)
+    groupindex = groupindex.reshape(-1)
+
+    # Sort by group, then by equity descending (NaN last)
+    order = _np.lexsort((-_np.nan_to_num(equities, nan=-_np.inf),
+                         groupindex))
+    sortedgroups = groupindex[order]
+    starts = _np.r_[0, _np.nonzero(_np.diff(sortedgroups))[0] + 1]
+    groupstart = _np.repeat(starts, _np.diff(_np.r_[starts, len(order)]))
+
+    ranks = _np.empty(len(order), dtype=_np.intp)
+    ranks[order] = _np.arange(len(order)) - groupstart
+    best = order[groupstart]
+    bestofcandidate = _np.empty(len(order), dtype=_np.intp)
+    bestofcandidate[order] = best
+    loss = equities[bestofcandidate] - equities
+    return ranks, loss, loss <= _np.hypot(cis, cis[bestofcandidate])
+
+
+def filerollouts(filename):
+    """Return the rolled out candidate moves of an XG file: keys as an
+    (n, 20) uint8 array (position key of the position before the move
+    followed by that of the candidate's resulting position), the dice
+    as an (n, 2) array and the candidates' rollouts.
+    """
+    segdata = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE,
+         _xgimport.Import.Segment.XG_ROLLOUTS])
+    moves = _xgarray.moveentries(
+        segdata.get(_xgimport.Import.Segment.XG_GAMEFILE, b''))
+    allrollouts = _xgarray.rollouts(
+        segdata.get(_xgimport.Import.Segment.XG_ROLLOUTS, b''))
+
+    indices = moves['RolloutIndexM']
+    rolled = _xgarray.candidatemask(moves) & (indices >= 0) & \
+        (indices < len(allrollouts))
+    moveindex, candidate = _np.nonzero(rolled)
+    dm = moves['DataMoves']
+    keys = _np.concatenate([
+        _xgposition.positionkeys(dm['Pos'][moveindex]),
+        _xgposition.positionkeys(dm['PosPlayed'][moveindex, candidate])],
+        axis=1)
+    return keys, dm['Dice'][moveindex], \
+        _np.array(allrollouts[indices[moveindex, candidate]])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Merge and rank the rolled out candidate moves in XG '
+        'files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    parts = []
+    for filename, result, error in _xgcorpus.mapfiles(
+            filerollouts, _xgcorpus.findfiles(args.paths, skip=skip),
+            workers=args.workers):
+        if error is not None:
+            _sys.stderr.write('%s\n' % error)
+            continue
+        parts.append(result)
+    parts = [part for part in parts if len(part[0])]
+    if not parts:
+        _sys.exit(0)
+
+    # A candidate is identified by the position, the dice and the
+    # resulting position; the dice are sorted since their order varies
+    keys = _np.concatenate([part[0] for part in parts])
+    dice = _np.sort(_np.concatenate([part[1] for part in parts]), axis=1)
+    keys = _np.concatenate([keys, dice.astype(_np.uint8)], axis=1)
+    unique, merged = merge(_np.concatenate([part[2] for part in parts]),
+                           keys)
+    stats = rolloutstats(merged)
+    groups = _np.concatenate([unique[:, :_xgposition.KEYSIZE],
+                              unique[:, 2 * _xgposition.KEYSIZE:]], axis=1)
+    ranks, loss, close = rank(stats['stratified'], stats['stratifiedci'],
+                              groups)
+
+    groupids = _np.unique(groups, axis=0, return_inverse=True)[1]
+    order = _np.lexsort((ranks, groupids.reshape(-1)))
+    for row in order:
+        if ranks[row] == 0:
+            _sys.stdout.write('\n%s %d%d\n' % (
+                _xgposition.keytoid(unique[row, :_xgposition.KEYSIZE]),
+                unique[row, -2], unique[row, -1]))
+        _sys.stdout.write('  %2d. %-14s %+8.4f +/- %.4f %8.4f%s %9d games\n'
+                          % (ranks[row] + 1, _xgposition.keytoid(
+                              unique[row, _xgposition.KEYSIZE:
+                                     2 * _xgposition.KEYSIZE]),
+                             stats['stratified'][row],
+                             stats['stratifiedci'][row], -loss[row],
+                             ' ' if close[row] or ranks[row] == 0 else '*',
+                             stats['games'][row]))
@@ -0,0 +1,404 @@
+#
+#   xgscale.py - Scaling benchmark of XG file ingestion
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Where xgbench times the decoding stages one by one, this measures
+#   whole files: every file of a corpus is imported and all of its
+#   game file and rollout records decoded, with xgcorpus.mapfiles and a
+#   number of workers, like the batch tools do. The ingestion modes are
+#
+#     stream  Import.getfilesegment, the segments go through temp files
+#     memory  Import.getsegmentdata, the segments are inflated in memory
+#     cached  xgcache.RecordCache, read from a warm cache
+#
+#   The corpora are generated by xggen into one directory and kept, the
+#   smaller sizes use the first files of the larger ones. Each run
+#   (corpus size, mode, workers) is done in a new process. Every worker
+#   reports its own peak RSS with its results: the peak RSS of a run is
+#   the sum of those of the run process and its workers (pages they
+#   share are counted for each), and the worker peak RSS the largest of
+#   a single worker. The latency of a file is the time its worker spent
+#   on it, queueing not included.
+#
+
+import os as _os
+import sys as _sys
+import json as _json
+import math as _math
+import time as _time
+import timeit as _timeit
+import random as _random
+import shutil as _shutil
+import tempfile as _tempfile
+import platform as _platform
+import multiprocessing as _multiprocessing
+import xgimport as _xgimport
+import xgcorpus as _xgcorpus
+import xgcache as _xgcache
+import xggen as _xggen
+
+try:
+    import resource as _resource
+except ImportError:
+    _resource = None
+
+MODES = ['stream', 'memory', 'cached']
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_GAMES = 3
+CORPUS_PREFIX = 'synthetic'
+PERCENTILES = [50, 90, 99]
+
+_SEGMENT = _xgimport.Import.Segment
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG scaling: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def corpusfiles(directory, count):
+    """Return the names of the first count files of the corpus in
+    directory.
+    """
+    return [_os.path.join(directory, '%s%06d%s' % (
+        CORPUS_PREFIX, index, _xgcorpus.XG_EXTENSION))
+        for index in range(count)]
+
+
+def _makefile(args):
+    # Generate one corpus file, seeded by its index. The file versions
+    # are mixed like in a real corpus.
+    filename, index, seed, games = args
+    _xggen.MatchGenerator(
+        seed=seed + index, games=games, rollouts=index % 10 == 0,
+        version=_random.Random(seed + index).randint(
+            _xggen.MIN_VERSION, _xggen.MAX_VERSION)).writefile(filename)
+    return filename
+
+
+def makecorpus(directory, count, games=DEFAULT_GAMES, seed=0, workers=None,
+               progress=None):
+    """Generate the files of the corpus in directory that don't exist yet
+    and return the list of its first count files. progress, if given, is
+    called with every generated file name.
+    """
+    if not _os.path.isdir(directory):
+        _os.makedirs(directory)
+    filenames = corpusfiles(directory, count)
+    missing = [(filename, index, seed, games)
+               for index, filename in enumerate(filenames)
+               if not _os.path.exists(filename)]
+    if workers is None:
+        workers = _multiprocessing.cpu_count()
+    if workers <= 1:
+        generated = (_makefile(args) for args in missing)
+    else:
+        pool = _multiprocessing.Pool(workers)
+        generated = pool.imap_unordered(_makefile, missing, 16)
+    try:
+        for filename in generated:
+            if progress is not None:
+                progress(filename)
+    finally:
+        if workers > 1:
+            pool.terminate()
+            pool.join()
+    return filenames
+
+
+class _Ingest(object):
+
+    # Import a file and decode its records in the given mode and return
+    # (file size, records, seconds, pid, peak RSS) where the last two
+    # are of the process that did the work. Defined at module level so it can
+    # be pickled for the worker processes.
+
+    def __init__(self, mode, cachedir=None):
+        self.mode = mode
+        self.cachedir = cachedir
+        self.cache = None
+
+    def __call__(self, filename):
+        start = _timeit.default_timer()
+        records = 0
+        if self.mode == 'stream':
+            for segment in _xgimport.Import(filename).getfilesegment():
+                if segment.type in [_SEGMENT.XG_GAMEFILE,
+                                    _SEGMENT.XG_ROLLOUTS]:
+                    for rec in segment.records():
+                        records += 1
+        else:
+            if self.mode == 'memory':
+                cached = _xgcache.CachedFile(
+                    _xgimport.Import(filename).getsegmentdata(
+                        [_SEGMENT.XG_GAMEFILE, _SEGMENT.XG_ROLLOUTS]))
+            else:
+                if self.cache is None:
+                    # Unbounded: evicting would turn hits into misses
+                    self.cache = _xgcache.RecordCache(self.cachedir,
+                                                      maxsize=1 << 62)
+                cached = self.cache.load(filename)
+            for rec in cached.records():
+                records += 1
+            for rec in cached.rollouts():
+                records += 1
+        return (_os.path.getsize(filename), records,
+                _timeit.default_timer() - start, _os.getpid(), peakrss())
+
+
+def peakrss():
+    """Return the peak RSS in bytes of this process, None if it can't be
+    measured.
+    """
+    if _resource is None:
+        return None
+    peak = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return peak if _sys.platform == 'darwin' else peak * 1024
+
+
+def _percentile(values, percent):
+    # Nearest rank percentile of sorted values
+    if not values:
+        return None
+    rank = int(_math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def _ingest(filenames, mode, workers, cachedir):
+    # One run: ingest filenames and return the result dictionary
+    ingest = _Ingest(mode, cachedir)
+    latencies = []
+    peaks = {}
+    nbytes = records = errors = 0
+    start = _timeit.default_timer()
+    for filename, result, error in _xgcorpus.mapfiles(ingest, filenames,
+                                                      workers, 8):
+        if error is not None:
+            errors += 1
+            continue
+        nbytes += result[0]
+        records += result[1]
+        latencies.append(result[2])
+        # ru_maxrss only grows, the last report of a worker is its peak
+        pid, peak = result[3], result[4]
+        if peak is not None:
+            peaks[pid] = max(peaks.get(pid, 0), peak)
+    seconds = _timeit.default_timer() - start
+
+    # Without a pool the files are ingested in this process, which is
+    # then counted once
+    workerpeak = max(peaks.values()) if peaks else None
+    peak = peakrss()
+    if peak is not None:
+        peaks[_os.getpid()] = max(peaks.get(_os.getpid(), 0), peak)
+    totalpeak = sum(peaks.values()) if peaks else None
+
+    latencies.sort()
+    latency = dict(('p%d' % percent, _percentile(latencies, percent))
+                   for percent in PERCENTILES)
+    latency['max'] = latencies[-1] if latencies else None
+    return {'files': len(filenames), 'mode': mode, 'workers': workers,
+            'seconds': seconds, 'bytes': nbytes, 'records': records,
+            'errors': errors,
+            'files_per_sec': len(filenames) / seconds if seconds else None,
+            'bytes_per_sec': nbytes / seconds if seconds else None,
+            'peak_rss': totalpeak, 'peak_rss_worker': workerpeak,
+            'latency': latency}
+
+
+def _childmain(queue, func, args):
+    try:
+        queue.put((func(*args), None))
+    except Exception as e:
+        queue.put((None, getattr(e, 'value', str(e))))
+
+
+def _inchild(func, *args):
+    # Call func(*args) in a new process and return its result
+    queue = _multiprocessing.Queue()
+    child = _multiprocessing.Process(target=_childmain,
+                                     args=(queue, func, args))
+    child.start()
+    try:
+        result, error = queue.get()
+    finally:
+        child.join()
+    if error is not None:
+        raise Error(error)
+    return result
+
+
+def run(filenames, mode, workers, cachedir=None):
+    """Ingest filenames in mode ('stream', 'memory' or 'cached') with
+    workers processes and return a dictionary of the measurements:
+    files, bytes and records ingested, errors, seconds, files_per_sec,
+    bytes_per_sec, peak_rss, the sum of the peak RSS (bytes) of the
+    process running the files and its workers, peak_rss_worker, the
+    largest peak RSS of a single worker, and latency, the percentiles and
+    maximum of the seconds spent per file. The cached mode needs the
+    cache directory, which is filled first (not measured).
+    """
+    if mode not in MODES:
+        raise Error("Unknown mode '%s'" % mode)
+    if mode == 'cached':
+        if cachedir is None:
+            raise Error("The cached mode needs a cache directory")
+        _inchild(_ingest, filenames, mode, workers, cachedir)
+    return _inchild(_ingest, filenames, mode, workers, cachedir)
+
+
+def sweep(directory, sizes=DEFAULT_SIZES, modes=MODES, workers=None,
+          games=DEFAULT_GAMES, progress=None):
+    """Run every combination of corpus size, mode and worker count on the
+    corpus in directory (generated as needed) and return the results of
+    run, adding to them the machine and corpus the numbers are from.
+    progress, if given, is called with every result.
+    """
+    if workers is None:
+        workers = defaultworkers()
+    cachedir = _tempfile.mkdtemp(prefix='tmpXGS')
+    results = []
+    try:
+        filenames = makecorpus(directory, max(sizes), games=games)
+        for size in sorted(sizes):
+            for mode in modes:
+                for nworkers in workers:
+                    result = run(filenames[:size], mode, nworkers, cachedir)
+                    results.append(result)
+                    if progress is not None:
+                        progress(result)
+    finally:
+        _shutil.rmtree(cachedir, ignore_errors=True)
+    return {'python': _platform.python_version(),
+            'implementation': _platform.python_implementation(),
+            'machine': _platform.machine(),
+            'cpus': _multiprocessing.cpu_count(),
+            'date': _time.strftime('%Y-%m-%d %H:%M:%S'),
+            'games': games, 'results': results}
+
+
+def defaultworkers():
+    """Return the worker counts swept by default: the powers of two up
+    to the number of CPUs, and the number of CPUs.
+    """
+    cpus = _multiprocessing.cpu_count()
+    workers = []
+    count = 1
+    while count < cpus:
+        workers.append(count)
+        count *= 2
+    return workers + [cpus]
+
+
+def _intlist(value):
+    # argparse type of a comma separated list of positive integers
+    import argparse
+    try:
+        values = [int(item) for item in value.split(',')]
+    except ValueError:
+        values = []
+    if not values or min(values) < 1:
+        raise argparse.ArgumentTypeError(
+            "'%s' isn't a list of positive numbers" % value)
+    return values
+
+
+def _modelist(value):
+    import argparse
+    modes = value.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(
+                "unknown mode '%s' (%s)" % (mode, ', '.join(MODES)))
+    return modes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure how ingesting XG files scales with the corpus '
+        'size and\nthe number of workers',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", metavar='SIZES', dest="sizes", type=_intlist,
+                        help="Comma separated corpus sizes (Default %s)\n" %
+                        ','.join(str(size) for size in DEFAULT_SIZES),
+                        default=DEFAULT_SIZES)
+    parser.add_argument("-w", metavar='WORKERS', dest="workers",
+                        type=_intlist,
+                        help="Comma separated worker counts (Default %s)\n" %
+                        ','.join(str(count) for count in defaultworkers()),
+                        default=None)
+    parser.add_argument("-m", metavar='MODES', dest="modes", type=_modelist,
+                        help="Comma separated ingestion modes "
+                        "(Default %s)\n" % ','.join(MODES), default=MODES)
+    parser.add_argument("-g", metavar='GAMES', dest="games", type=int,
+                        help="Games per generated file (Default %d)\n" %
+                        DEFAULT_GAMES, default=DEFAULT_GAMES)
+    parser.add_argument("-o", metavar='FILE', dest="output",
+                        help="Save the results as JSON to FILE\n",
+                        default=None)
+    parser.add_argument('corpusdir', metavar='DIR', type=str,
+                        help='Directory of the generated corpus, files '
+                        'missing in it are generated')
+    args = parser.parse_args()
+
+    print('%8s %-7s %7s %9s %8s %8s %8s %8s %8s %8s %8s %6s' % (
+        'Files', 'Mode', 'Workers', 'files/s', 'MB/s', 'RSS MB',
+        'RSS/w MB', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'Errors'))
+
+    def ms(seconds):
+        return '%.2f' % (seconds * 1000) if seconds is not None else '-'
+
+    def mb(nbytes):
+        return '%.1f' % (nbytes / 1048576.0) if nbytes is not None else '-'
+
+    def progress(result):
+        latency = result['latency']
+        print('%8d %-7s %7d %9.1f %8.2f %8s %8s %8s %8s %8s %8s %6d' % (
+            result['files'], result['mode'], result['workers'],
+            result['files_per_sec'], result['bytes_per_sec'] / 1e6,
+            mb(result['peak_rss']), mb(result['peak_rss_worker']),
+            ms(latency['p50']), ms(latency['p90']), ms(latency['p99']),
+            ms(latency['max']), result['errors']))
+        _sys.stdout.flush()
+
+    def generated(filename, count=[0]):
+        count[0] += 1
+        if count[0] % 1000 == 0:
+            _sys.stderr.write('%d files generated\n' % count[0])
+
+    makecorpus(args.corpusdir, max(args.sizes), games=args.games,
+               progress=generated)
+    try:
+        results = sweep(args.corpusdir, sizes=args.sizes, modes=args.modes,
+                        workers=args.workers, games=args.games,
+                        progress=progress)
+    except Error as e:
+        _sys.stderr.write('%s\n' % e.value)
+        _sys.exit(1)
+
+    if args.output is not None:
+        with open(args.output, 'w') as outfile:
+            _json.dump(results, outfile, indent=1, sort_keys=True)
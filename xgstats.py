@@ -0,0 +1,281 @@
+#
+#   xgstats.py - Per player error rate and PR statistics over XG files
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Statistics are kept as sums and counts (see STATS) in float64 arrays
+#   whose last axis is indexed by the STAT_* constants. Sums can simply
+#   be added together, so the statistics of a file (FileStats) are
+#   computed independently, possibly in a worker process, and merged
+#   into an Aggregate. Rates and PR are only derived at the end.
+#
+#   A decision is counted when it was analyzed (the error isn't -1000):
+#
+#     moves      checker plays, except those flagged DataMoves.Unused
+#     cubes      double/no double decisions, charged to ActiveP
+#     takes      take/pass decisions after a double, charged to the
+#                opponent of ActiveP
+#     luckrolls  rolls whose luck was analyzed
+#
+#   Errors are summed as equity lost (their absolute value). PR is the
+#   total error per move, cube and take decision times 500.
+#
+
+import io as _io
+import sys as _sys
+import xgutils as _xgutils
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgarray as _xgarray
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+STATS = ['moves', 'moveerror', 'cubes', 'cubeerror', 'takes', 'takeerror',
+         'luckrolls', 'luck']
+STAT_MOVES, STAT_MOVEERROR, STAT_CUBES, STAT_CUBEERROR, STAT_TAKES, \
+    STAT_TAKEERROR, STAT_LUCKROLLS, STAT_LUCK = range(len(STATS))
+NSTATS = len(STATS)
+
+NOT_ANALYZED = -1000
+PR_SCALE = 500
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG statistics: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _analyzed(errors):
+    # Errors of -1000 mark decisions that weren't analyzed
+    return errors > NOT_ANALYZED + 1
+
+
+def _accumulate(totals, games, players, stat, values, mask):
+    # Add values[mask] into totals[game, player, stat] in one step
+    flat = totals.reshape(-1)
+    index = (games[mask] * 2 + players[mask]) * NSTATS + stat
+    flat += _np.bincount(index, weights=values[mask], minlength=flat.size)
+
+
+class FileStats(object):
+
+    """ Statistics of one XG file: the player names and a (games, 2,
+    NSTATS) array of totals for each game (see gamenumbers) and player.
+    """
+
+    def __init__(self, filename, players, matchlength, gamenumbers,
+                 totals):
+        self.filename = filename
+        self.players = players
+        self.matchlength = matchlength
+        self.gamenumbers = gamenumbers
+        self.totals = totals
+
+    def matchtotals(self):
+        """Return the (2, NSTATS) totals of the whole match"""
+        return self.totals.sum(axis=0)
+
+
+def filestats(filename):
+    """Compute the FileStats of an XG file"""
+    if _np is None:
+        raise Error("numpy is required")
+    data = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE]).get(
+        _xgimport.Import.Segment.XG_GAMEFILE, b'')
+
+    header = _xgstruct.GameFileRecord().fromstream(_io.BytesIO(
+        data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]))
+    if not isinstance(header, _xgstruct.HeaderMatchEntry):
+        raise _xgimport.Error("No match header", filename)
+    players = (_xgutils.utf8bytestostr(header.Player1 or header.SPlayer1),
+               _xgutils.utf8bytestostr(header.Player2 or header.SPlayer2))
+
+    rawframes = _xgarray.frames(data)
+    entrytypes = rawframes[:, _xgarray.ENTRYTYPE_OFFSET]
+    gamenumbers, gameindex = _np.unique(_xgarray.gamenumbers(data),
+                                        return_inverse=True)
+    totals = _np.zeros((len(gamenumbers), 2, NSTATS))
+
+    moves = _xgarray.moveentries(data)
+    games = gameindex[entrytypes == _xgstruct.GameFileRecord.ENTRYTYPE_MOVE]
+    active = (moves['ActiveP'] != 1).astype(_np.intp)
+    errmove = _np.abs(moves['ErrMove'])
+    counted = _analyzed(moves['ErrMove']) & \
+        (moves['DataMoves']['Unused'] == 0)
+    ones = _np.ones(len(moves))
+    _accumulate(totals, games, active, STAT_MOVES, ones, counted)
+    _accumulate(totals, games, active, STAT_MOVEERROR, errmove, counted)
+    luck = _analyzed(moves['ErrLuck'])
+    _accumulate(totals, games, active, STAT_LUCKROLLS, ones, luck)
+    _accumulate(totals, games, active, STAT_LUCK, moves['ErrLuck'], luck)
+
+    cubes = _xgarray.cubeentries(data)
+    games = gameindex[entrytypes == _xgstruct.GameFileRecord.ENTRYTYPE_CUBE]
+    doubler = (cubes['ActiveP'] != 1).astype(_np.intp)
+    ones = _np.ones(len(cubes))
+    counted = _analyzed(cubes['ErrCube'])
+    _accumulate(totals, games, doubler, STAT_CUBES, ones, counted)
+    _accumulate(totals, games, doubler, STAT_CUBEERROR,
+                _np.abs(cubes['ErrCube']), counted)
+    counted = _analyzed(cubes['ErrTake']) & (cubes['Double'] == 1)
+    _accumulate(totals, games, 1 - doubler, STAT_TAKES, ones, counted)
+    _accumulate(totals, games, 1 - doubler, STAT_TAKEERROR,
+                _np.abs(cubes['ErrTake']), counted)
+
+    return FileStats(filename, players, header.MatchLength, gamenumbers,
+                     totals)
+
+
+def ratings(totals):
+    """Return a dictionary of derived statistics (decisions, error,
+    errorrate, pr and luckrate) of an array of totals. Every value has
+    the shape of totals without its last axis; rates without decisions
+    are NaN.
+    """
+    totals = _np.asarray(totals, dtype=_np.float64)
+    decisions = totals[..., STAT_MOVES] + totals[..., STAT_CUBES] + \
+        totals[..., STAT_TAKES]
+    error = totals[..., STAT_MOVEERROR] + totals[..., STAT_CUBEERROR] + \
+        totals[..., STAT_TAKEERROR]
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        errorrate = _np.where(decisions > 0, error / decisions, _np.nan)
+        luckrate = _np.where(totals[..., STAT_LUCKROLLS] > 0,
+                             totals[..., STAT_LUCK] /
+                             totals[..., STAT_LUCKROLLS], _np.nan)
+    return {'decisions': decisions, 'error': error, 'errorrate': errorrate,
+            'pr': errorrate * PR_SCALE, 'luckrate': luckrate}
+
+
+class Aggregate(object):
+
+    """ Corpus totals: per player (players maps a name to an NSTATS
+    array), and optionally per match and per game. Aggregates built
+    from different parts of a corpus can be combined with merge.
+    """
+
+    def __init__(self, matches=True, games=False):
+        self.keepmatches = matches
+        self.keepgames = games
+        self.players = {}
+        self.matches = []           # (filename, players, (2, NSTATS))
+        self.games = []             # (filename, game, players, (2, NSTATS))
+        self.filecount = 0
+
+    def __addplayer(self, name, totals):
+        if name in self.players:
+            self.players[name] += totals
+        else:
+            self.players[name] = totals.copy()
+
+    def add(self, stats):
+        """Add the FileStats of one file"""
+        matchtotals = stats.matchtotals()
+        for player in range(2):
+            self.__addplayer(stats.players[player], matchtotals[player])
+        if self.keepmatches:
+            self.matches.append((stats.filename, stats.players,
+                                 matchtotals))
+        if self.keepgames:
+            for game, totals in zip(stats.gamenumbers, stats.totals):
+                self.games.append((stats.filename, int(game), stats.players,
+                                   totals))
+        self.filecount += 1
+
+    def merge(self, other):
+        """Add the totals of another Aggregate"""
+        for name, totals in other.players.items():
+            self.__addplayer(name, totals)
+        self.matches.extend(other.matches)
+        self.games.extend(other.games)
+        self.filecount += other.filecount
+
+    def playertable(self):
+        """Return the players' names and an (n, NSTATS) array of their
+        totals, sorted by name.
+        """
+        names = sorted(self.players)
+        totals = _np.array([self.players[name] for name in names]).reshape(
+            -1, NSTATS)
+        return names, totals
+
+
+def _printtable(out, title, labels, totals):
+    derived = ratings(totals)
+    out.write('%s\n' % title)
+    out.write('%-40s %8s %8s %10s %9s %8s\n' % ('', 'Decis.', 'Takes',
+                                               'Error', 'Err/dec', 'PR'))
+    for row, label in enumerate(labels):
+        out.write('%-40s %8d %8d %10.3f %9.5f %8.2f\n' % (
+            label[:40], derived['decisions'][row],
+            totals[row, STAT_TAKES], derived['error'][row],
+            derived['errorrate'][row], derived['pr'][row]))
+    out.write('\n')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Per player error rate and PR over XG files',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument("-m", "--matches", dest="matches",
+                        action='store_true', help="Also report each match\n")
+    parser.add_argument("-g", "--games", dest="games", action='store_true',
+                        help="Also report each game\n")
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    aggregate = Aggregate(matches=args.matches, games=args.games)
+    for filename, stats, error in _xgcorpus.mapfiles(
+            filestats, _xgcorpus.findfiles(args.paths, skip=skip),
+            workers=args.workers):
+        if error is not None:
+            _sys.stderr.write('%s\n' % error)
+            continue
+        aggregate.add(stats)
+
+    names, totals = aggregate.playertable()
+    _printtable(_sys.stdout, 'Players (%d files)' % aggregate.filecount,
+                names, totals)
+    for name, rows in [('Matches', aggregate.matches),
+                       ('Games', aggregate.games)]:
+        if not rows:
+            continue
+        rows = sorted(rows, key=lambda row: row[:-2])
+        labels = [' '.join([str(item) for item in row[:-2]] +
+                           [row[-2][player]])
+                  for row in rows for player in range(2)]
+        totals = _np.concatenate([row[-1] for row in rows])
+        _printtable(_sys.stdout, name, labels, totals)
@@ -0,0 +1,246 @@
+#
+#   xgtrain.py - Export analyzed XG positions as training data shards
+#   Copyright (C) 2013,2014  Michael Petch <mpetch@gnubg.org>
+#                                          <mpetch@capp-sysware.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#   Every evaluated candidate of an analyzed move (MoveEntry.DataMoves)
+#   and every analyzed cube decision (CubeEntry.Doubled) becomes one
+#   sample. A sample is made up of:
+#
+#     pos       26 int8     position in XG's 26 point encoding
+#     features  7 float32   see FEATURES
+#     eval      7 float32   XG evaluation of the position
+#     cubeeq    3 float32   no double, double/take and double/drop
+#                           equities (NaN for checker play samples)
+#     kind      int8        SAMPLE_MOVE or SAMPLE_CUBE
+#
+#   Samples are written in shards of a fixed number of rows, one .npy
+#   file per array per shard, so they can be memory mapped with
+#   numpy.load(mmap_mode='r'). manifest.json describes the shards.
+#
+
+import io as _io
+import os as _os
+import sys as _sys
+import json as _json
+import xgimport as _xgimport
+import xgstruct as _xgstruct
+import xgarray as _xgarray
+import xgcorpus as _xgcorpus
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+FEATURES = ['match_length', 'score1', 'score2', 'cube', 'cube_pos',
+            'crawford', 'jacoby']
+ARRAYS = [('pos', 'i1', 26), ('features', '<f4', len(FEATURES)),
+          ('eval', '<f4', 7), ('cubeeq', '<f4', 3), ('kind', 'i1', None)]
+SAMPLE_MOVE, SAMPLE_CUBE = range(2)
+
+MANIFEST = 'manifest.json'
+MONEY_MATCHLENGTH = 99999
+
+
+class Error(Exception):
+
+    def __init__(self, error):
+        self.value = "XG training export: %s" % str(error)
+        self.error = error
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _features(matchlength, rec):
+    # Cube and score features from the Score, Cube, CubePos, Crawford
+    # and Jacoby fields common to both engine structures
+    return _np.column_stack([
+        _np.full(len(rec), matchlength, dtype=_np.float32),
+        rec['Score'][:, 0], rec['Score'][:, 1], rec['Cube'],
+        rec['CubePos'], rec['Crawford'], rec['Jacoby']]).astype(_np.float32)
+
+
+def extractsamples(filename):
+    """Return the training samples of an XG file as a dictionary of
+    arrays keyed by the names in ARRAYS.
+    """
+    data = _xgimport.Import(filename).getsegmentdata(
+        [_xgimport.Import.Segment.XG_GAMEFILE]).get(
+        _xgimport.Import.Segment.XG_GAMEFILE, b'')
+
+    header = _xgstruct.GameFileRecord().fromstream(_io.BytesIO(
+        data[:_xgstruct.HeaderMatchEntry.SIZEOFREC]))
+    matchlength = 0
+    if isinstance(header, _xgstruct.HeaderMatchEntry) and \
+            header.MatchLength != MONEY_MATCHLENGTH:
+        matchlength = header.MatchLength
+
+    # Checker play: one sample per evaluated candidate
+    moves = _xgarray.moveentries(data)
+    dm = moves['DataMoves']
+    mask = _xgarray.candidatemask(moves)
+    counts = mask.sum(axis=1)
+    nmoves = int(counts.sum())
+    movesamples = {
+        'pos': dm['PosPlayed'][mask],
+        'features': _np.repeat(_features(matchlength, dm), counts, axis=0),
+        'eval': dm['Eval'][mask],
+        'cubeeq': _np.full((nmoves, 3), _np.nan, dtype=_np.float32),
+        'kind': _np.full(nmoves, SAMPLE_MOVE, dtype=_np.int8)}
+
+    # Cube decisions: the no double evaluation of analyzed decisions
+    # (ErrCube is -1000 if the decision wasn't analyzed)
+    cubes = _xgarray.cubeentries(data)
+    doubled = cubes['Doubled'][cubes['ErrCube'] > -1000]
+    cubesamples = {
+        'pos': doubled['Pos'],
+        'features': _features(matchlength, doubled),
+        'eval': doubled['Eval'],
+        'cubeeq': _np.column_stack([doubled['equB'], doubled['equDouble'],
+                                    doubled['equDrop']]),
+        'kind': _np.full(len(doubled), SAMPLE_CUBE, dtype=_np.int8)}
+
+    samples = {}
+    for name, dtype, width in ARRAYS:
+        samples[name] = _np.concatenate(
+            [movesamples[name], cubesamples[name]]).astype(dtype)
+    return samples
+
+
+class ShardWriter(object):
+
+    """ Collect samples and write them out in shards of shardsize rows.
+    At most one shard's worth of samples (plus the samples of the file
+    being added) is held in memory.
+    """
+
+    DEFAULT_SHARDSIZE = 1 << 18
+
+    def __init__(self, outdir, shardsize=DEFAULT_SHARDSIZE):
+        if _np is None:
+            raise Error("numpy is required")
+        self.outdir = outdir
+        self.shardsize = shardsize
+        self.shards = []
+        self.files = []
+        self.errors = []
+        self.rowcount = 0
+        self.__pending = dict((name, []) for name, dtype, width in ARRAYS)
+        self.__pendingrows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add(self, samples):
+        rows = len(samples['kind'])
+        for name, dtype, width in ARRAYS:
+            self.__pending[name].append(samples[name])
+        self.__pendingrows += rows
+        while self.__pendingrows >= self.shardsize:
+            self.__writeshard(self.shardsize)
+
+    def __writeshard(self, rows):
+        index = len(self.shards)
+        shard = {'index': index, 'rows': rows, 'arrays': {}}
+        for name, dtype, width in ARRAYS:
+            pending = _np.concatenate(self.__pending[name])
+            filename = 'shard_%05d.%s.npy' % (index, name)
+            _np.save(_os.path.join(self.outdir, filename), pending[:rows])
+            self.__pending[name] = [pending[rows:]]
+            shard['arrays'][name] = filename
+        self.__pendingrows -= rows
+        self.rowcount += rows
+        self.shards.append(shard)
+
+    def close(self):
+        """Write out the last (partial) shard and the manifest"""
+        if self.__pendingrows > 0:
+            self.__writeshard(self.__pendingrows)
+        manifest = {
+            'rows': self.rowcount,
+            'shardsize': self.shardsize,
+            'features': FEATURES,
+            'arrays': dict((name, {'dtype': dtype,
+                                   'shape': [width] if width else []})
+                           for name, dtype, width in ARRAYS),
+            'kinds': {'move': SAMPLE_MOVE, 'cube': SAMPLE_CUBE},
+            'shards': self.shards,
+            'files': self.files,
+            'errors': self.errors}
+        with open(_os.path.join(self.outdir, MANIFEST), 'w') as manifestfile:
+            _json.dump(manifest, manifestfile, indent=1, sort_keys=True)
+
+
+def loadshards(outdir, mmap_mode='r'):
+    """Return the manifest written by ShardWriter and a list with a
+    dictionary of (memory mapped) arrays for each shard.
+    """
+    with open(_os.path.join(outdir, MANIFEST)) as manifestfile:
+        manifest = _json.load(manifestfile)
+    shards = []
+    for shard in manifest['shards']:
+        shards.append(dict(
+            (name, _np.load(_os.path.join(outdir, filename),
+                            mmap_mode=mmap_mode))
+            for name, filename in shard['arrays'].items()))
+    return manifest, shards
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Export analyzed XG positions as training data shards',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-d", metavar='DIR', dest="outdir", required=True,
+                        help="Directory to write the shards to\n")
+    parser.add_argument("-s", metavar='ROWS', dest="shardsize", type=int,
+                        help="Samples per shard (Default is %d)\n"
+                        % ShardWriter.DEFAULT_SHARDSIZE,
+                        default=ShardWriter.DEFAULT_SHARDSIZE)
+    parser.add_argument("-j", metavar='N', dest="workers", type=int,
+                        help="Number of worker processes "
+                        "(Default is the number of CPUs)\n", default=None)
+    parser.add_argument("--skip", metavar='FILE', dest="skip",
+                        help="Skip the files listed in FILE (see xgdedup)\n",
+                        default=None)
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help='XG files or directories to search for them')
+    args = parser.parse_args()
+    skip = _xgcorpus.readskiplist(args.skip) if args.skip else None
+
+    if not _os.path.isdir(args.outdir):
+        _os.makedirs(args.outdir)
+
+    with ShardWriter(args.outdir, shardsize=args.shardsize) as writer:
+        for filename, samples, error in _xgcorpus.mapfiles(
+                extractsamples, _xgcorpus.findfiles(args.paths, skip=skip),
+                workers=args.workers):
+            if error is not None:
+                _sys.stderr.write('%s\n' % error)
+                writer.errors.append(filename)
+                continue
+            writer.files.append(filename)
+            writer.add(samples)
+
+    print('Wrote %d samples from %d files in %d shards' %
+          (writer.rowcount, len(writer.files), len(writer.shards)))
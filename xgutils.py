@@ -18,8 +18,10 @@
 #
 #
 
+import os as _os
 import sys as _sys
 import zlib as _zlib
+import struct as _struct
 import datetime as _datetime
 
 
@@ -82,6 +84,21 @@ def utf16intarraytostr2x(intarray):
 
     return ''.join(newstr)
 
+def utf8bytestostr(value):
+    """Convert the UTF-8 encoded bytes returned by utf16intarraytostr
+    under Python 3.x to a string. Strings are returned unchanged and
+    None as an empty string.
+    """
+    if isinstance(value, bytes) and str is not bytes:
+        return value.decode('utf-8', 'replace')
+    return value if value is not None else ''
+
+
+# Rename a file, replacing the destination if it exists (os.replace is
+# Python 3.3+)
+replacefile = getattr(_os, 'replace', _os.rename)
+
+
 def delphidatetimeconv(delphi_datetime):
     """Convert a double float Delphi style timedate object to a Python
     datetime object. Delphi uses the number of days since
@@ -106,6 +123,56 @@ def delphishortstrtostr(shortstring_abytes):
                     shortstring_abytes[1:(shortstring_abytes[0] + 1)]])
 
 
+def strtoutf16intarray(string, size):
+    """Convert a string to a null terminated array of size integers
+    (UTF16), the inverse of utf16intarraytostr. string may be unicode or
+    UTF-8 encoded bytes as returned by utf16intarraytostr. Longer
+    strings are truncated.
+    """
+    if string is None:
+        string = u''
+    elif isinstance(string, bytes):
+        string = string.decode('utf-8')
+    encoded = string.encode('utf-16-le')[:(size - 1) * 2]
+    intarray = list(_struct.unpack('<%dH' % (len(encoded) // 2), encoded))
+    return intarray + [0] * (size - len(intarray))
+
+
+def strtodelphishortstr(string, size):
+    """Convert a string to a Delphi Pascal style shortstring of size
+    bytes (length byte included) as a list of integers, the inverse of
+    delphishortstrtostr. Characters outside of latin-1 are replaced and
+    longer strings are truncated.
+    """
+    if string is None:
+        string = ''
+    chars = bytearray(string.encode('latin-1', 'replace')
+                      if not isinstance(string, bytes) else string)
+    chars = chars[:min(size - 1, 255)]
+    return [len(chars)] + list(chars) + [0] * (size - 1 - len(chars))
+
+
+def datetimetodelphi(value):
+    """Convert a Python datetime object, or its string form as returned
+    by str(delphidatetimeconv(...)), to a Delphi style double float
+    timedate. Numbers are returned unchanged.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, _datetime.datetime):
+        value = _datetime.datetime.strptime(
+            value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else
+            '%Y-%m-%d %H:%M:%S')
+    delta = value - _datetime.datetime(1899, 12, 30)
+    delphi_datetime = delta.days + \
+        (delta.seconds + delta.microseconds / 1e6) / 86400.0
+    # delphidatetimeconv truncates to the second, add half a millisecond
+    # where float rounding would move the time back a second
+    if int(86400 * (delphi_datetime % 1)) != delta.seconds:
+        delphi_datetime += 0.0005 / 86400.0
+    return delphi_datetime
+
+
 if __name__ == '__main__':
     pass
 else:
@@ -22,11 +22,14 @@
 #
 
 from __future__ import with_statement as _with
+import io as _io
 import tempfile as _tempfile
 import struct as _struct
 import zlib as _zlib
 import os as _os
+import timeit as _timeit
 import xgutils as _xgutils
+import xgmetrics as _xgmetrics
 
 
 class Error(Exception):
@@ -39,6 +42,11 @@ class Error(Exception):
         return repr(self.value)
 
 
+def _signed32(value):
+    # CRCs are kept unsigned but stored as signed 32 bit integers
+    return value - 0x100000000 if value >= 0x80000000 else value
+
+
 class ArchiveRecord(dict):
 
     SIZEOFREC = 36
@@ -72,6 +80,13 @@ class ArchiveRecord(dict):
         self.compressedregistry = bool(unpacked_data[5])
         self.reserved = unpacked_data[6:]
 
+    def tostream(self, stream):
+        stream.write(_struct.pack(
+            '<llllll12B',
+            *([_signed32(self.crc), self.filecount, self.version,
+               self.registrysize, self.archivesize, self.compressedregistry] +
+              (list(self.reserved) + [0] * 12)[:12])))
+
 
 class FileRecord(dict):
 
@@ -109,19 +124,137 @@ class FileRecord(dict):
         self.compressed = bool(unpacked_data[516] == 0)
         self.compressionlevel = unpacked_data[517]
 
+    def tostream(self, stream):
+        stream.write(_struct.pack(
+            '<256B256BllllBBxx',
+            *(_xgutils.strtodelphishortstr(self.name, 256) +
+              _xgutils.strtodelphishortstr(self.path, 256) +
+              [self.osize, self.csize, self.start, _signed32(self.crc),
+               0 if self.compressed else 1, self.compressionlevel])))
+
     def __str__(self):
         return str(self.todict())
 
 
+def readarchiverecord(stream):
+    """Return the ArchiveRecord at the end of stream without reading or
+    checking the archive itself. The stream position is left unchanged.
+    """
+    curstreampos = stream.tell()
+    try:
+        stream.seek(0, _os.SEEK_END)
+        if stream.tell() < ArchiveRecord.SIZEOFREC:
+            raise Error("File too small for an archive record")
+        stream.seek(-ArchiveRecord.SIZEOFREC, _os.SEEK_END)
+        arcrec = ArchiveRecord()
+        arcrec.fromstream(stream)
+    finally:
+        stream.seek(curstreampos, 0)
+    return arcrec
+
+
+def readregistry(stream):
+    """Return the ArchiveRecord, the list of FileRecords and the offset of
+    the archive data in stream, reading only the archive record and the
+    file index. Unlike ZlibArchive the CRC of the whole archive isn't
+    checked. The stream position is left unchanged.
+    """
+    arcrec = readarchiverecord(stream)
+    curstreampos = stream.tell()
+    try:
+        stream.seek(-ArchiveRecord.SIZEOFREC - arcrec.registrysize,
+                    _os.SEEK_END)
+        startofarcdata = stream.tell() - arcrec.archivesize
+        registry = stream.read(arcrec.registrysize)
+    finally:
+        stream.seek(curstreampos, 0)
+
+    if arcrec.compressedregistry:
+        try:
+            registry = _zlib.decompressobj().decompress(registry)
+        except _zlib.error:
+            raise Error("Error extracting archive index")
+    if len(registry) < arcrec.filecount * FileRecord.SIZEOFREC:
+        raise Error("Archive index truncated")
+
+    filerecords = []
+    for recordnum in range(0, arcrec.filecount):
+        filerec = FileRecord()
+        filerec.fromstream(_io.BytesIO(registry[
+            recordnum * FileRecord.SIZEOFREC:
+            (recordnum + 1) * FileRecord.SIZEOFREC]))
+        filerecords.append(filerec)
+    return arcrec, filerecords, startofarcdata
+
+
+def readfiledata(stream, filerec, startofarcdata):
+    """Return the contents of one archived file (a FileRecord returned by
+    readregistry) in memory, checking its CRC. The stream position is
+    left unchanged.
+    """
+    curstreampos = stream.tell()
+    try:
+        stream.seek(filerec.start + startofarcdata)
+        data = stream.read(filerec.csize)
+    finally:
+        stream.seek(curstreampos, 0)
+
+    if filerec.compressed:
+        try:
+            data = _zlib.decompressobj().decompress(data)
+        except _zlib.error:
+            raise Error("Error extracting archived file")
+    if _zlib.crc32(data) & 0xffffffff != filerec.crc:
+        raise Error("File CRC check failed - file corrupt")
+    return data
+
+
+def writearchive(stream, files, compressionlevel=6, version=1):
+    """Write an archive of files, a list of (name, data) tuples, to
+    stream: the compressed files, the compressed file index and the
+    ArchiveRecord with the CRC of both. Empty files are stored rather
+    than compressed since ZlibArchive can't extract a compressed empty
+    file. Return the ArchiveRecord written.
+    """
+    crc = 0
+    start = 0
+    registry = _io.BytesIO()
+    for name, data in files:
+        filerec = FileRecord(name=name, path='', osize=len(data),
+                             crc=_zlib.crc32(data) & 0xffffffff,
+                             compressed=len(data) > 0, start=start,
+                             compressionlevel=compressionlevel)
+        if filerec.compressed:
+            data = _zlib.compress(data, compressionlevel)
+        filerec.csize = len(data)
+        filerec.tostream(registry)
+        stream.write(data)
+        crc = _zlib.crc32(data, crc)
+        start += len(data)
+
+    registry = _zlib.compress(registry.getvalue(), compressionlevel)
+    stream.write(registry)
+    arcrec = ArchiveRecord(crc=_zlib.crc32(registry, crc) & 0xffffffff,
+                           filecount=len(files), version=version,
+                           registrysize=len(registry), archivesize=start,
+                           compressedregistry=True)
+    arcrec.tostream(stream)
+    return arcrec
+
+
 class ZlibArchive(object):
     __MAXBUFSIZE = 32768
     __TMP_PREFIX = 'tmpXGI'
 
-    def __init__(self, stream=None, filename=None):
+    def __init__(self, stream=None, filename=None, stats=None):
+        """ Open the archive in stream or in the file filename. stats, if
+        given, receives the time spent in each stage (see xgmetrics).
+        """
         self.arcrec = ArchiveRecord()
         self.arcregistry = []
         self.startofarcdata = -1
         self.endofarcdata = -1
+        self.stats = stats
 
         self.filename = filename
         self.stream = stream
@@ -135,28 +268,53 @@ class ZlibArchive(object):
         filename = None
         stream = []
 
+        # Time the inflating and the temp file writes apart if there are
+        # stats, without costing anything if there aren't
+        stats = self.stats
+        if stats is not None:
+            def timed(func, stage, countresult):
+                # func reporting its time and the size of its argument,
+                # or of its result if countresult, to stats
+                def call(data):
+                    start = _timeit.default_timer()
+                    result = func(data)
+                    stats.stage(stage, _timeit.default_timer() - start,
+                                len(result if countresult else data))
+                    return result
+                return call
+            start = _timeit.default_timer()
+
         try:
             tmpfd, filename = _tempfile.mkstemp(prefix=self.__TMP_PREFIX)
             with _os.fdopen(tmpfd, "wb") as tmpfile:
+                write = tmpfile.write
+                if stats is not None:
+                    stats.stage(_xgmetrics.STAGE_TEMPFILE,
+                                _timeit.default_timer() - start)
+                    write = timed(write, _xgmetrics.STAGE_TEMPFILE, False)
 
                 if (iscompressed):
                     # Extract a compressed segment
                     decomp = _zlib.decompressobj()
+                    inflate = decomp.decompress
+                    if stats is not None:
+                        inflate = timed(inflate, _xgmetrics.STAGE_INFLATE,
+                                        True)
                     buf = self.stream.read(self.__MAXBUFSIZE)
-                    stream = decomp.decompress(buf)
+                    stream = inflate(buf)
 
                     if len(stream) <= 0:
                         raise IOError()
 
-                    tmpfile.write(stream)
+                    write(stream)
 
                     # Read until we have uncompressed a complete segment
                     while len(decomp.unused_data) == 0:
                         block = self.stream.read(self.__MAXBUFSIZE)
                         if len(block) > 0:
                             try:
-                                stream = decomp.decompress(block)
-                                tmpfile.write(stream)
+                                stream = inflate(block)
+                                write(stream)
                             except:
                                 break
                         else:
@@ -176,7 +334,7 @@ class ZlibArchive(object):
                             blksize = bytesleft
 
                         block = self.stream.read(blksize)
-                        tmpfile.write(block)
+                        write(block)
                         bytesleft = bytesleft - blksize
 
                         if bytesleft == 0:
@@ -205,10 +363,16 @@ class ZlibArchive(object):
             self.startofarcdata = self.stream.tell() - self.arcrec.archivesize
 
             # Compute the CRC32 of all the archive data including file index
+            if self.stats is not None:
+                start = _timeit.default_timer()
             streamcrc = _xgutils.streamcrc32(
                     self.stream,
                     startpos=self.startofarcdata,
                     numbytes=(self.endofarcdata - self.startofarcdata))
+            if self.stats is not None:
+                self.stats.stage(_xgmetrics.STAGE_ARCHIVECRC,
+                                 _timeit.default_timer() - start,
+                                 self.endofarcdata - self.startofarcdata)
             if streamcrc != self.arcrec.crc:
                 raise Error("Archive CRC check failed - file corrupt")
 
@@ -219,6 +383,8 @@ class ZlibArchive(object):
                 raise Error("Error extracting archive index")
 
             # Retrieve all the files in the index
+            if self.stats is not None:
+                start = _timeit.default_timer()
             with open(idx_filename, "rb") as idx_file:
                 for recordnum in range(0, self.arcrec.filecount):
                     curidxpos = self.stream.tell()
@@ -231,6 +397,10 @@ class ZlibArchive(object):
                     self.stream.seek(curidxpos, 0)
 
             _os.unlink(idx_filename)
+            if self.stats is not None:
+                self.stats.stage(_xgmetrics.STAGE_INDEX,
+                                 _timeit.default_timer() - start,
+                                 len(filerecords) * FileRecord.SIZEOFREC)
         finally:
             self.stream.seek(curstreampos, 0)
 
@@ -246,7 +416,12 @@ class ZlibArchive(object):
         tmpfile = open(tmpfilename, "rb")
 
         # Compute the CRC32 on the uncompressed file
+        if self.stats is not None:
+            start = _timeit.default_timer()
         streamcrc = _xgutils.streamcrc32(tmpfile)
+        if self.stats is not None:
+            self.stats.stage(_xgmetrics.STAGE_CRC,
+                             _timeit.default_timer() - start, filerec.osize)
         if streamcrc != filerec.crc:
             raise Error("File CRC check failed - file corrupt")
 